@@ -0,0 +1,132 @@
+"""
+Cache de configurações de agentes
+Evita consultar agentes_solo a cada mensagem: entradas recentes são servidas
+direto da memória, entradas mais antigas são revalidadas pelo updated_at
+(consulta de uma coluna) e IDs inexistentes ficam em cache negativo
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+AGENT_CACHE_FRESH_SECONDS = float(os.getenv("AGENT_CACHE_FRESH_SECONDS", "15"))
+AGENT_CACHE_TTL = float(os.getenv("AGENT_CACHE_TTL", "300"))
+AGENT_CACHE_NEGATIVE_TTL = float(os.getenv("AGENT_CACHE_NEGATIVE_TTL", "30"))
+AGENT_CACHE_MAX_ENTRIES = int(os.getenv("AGENT_CACHE_MAX_ENTRIES", "1000"))
+
+_MISSING = object()
+
+
+class AgentConfigCache:
+    """
+    Cache LRU de configurações de agentes
+
+    - Até fresh_seconds após a carga: servido da memória
+    - Entre fresh_seconds e ttl_seconds: revalidado comparando o updated_at
+    - Após ttl_seconds (ou updated_at diferente): recarregado por completo
+    - Agentes inexistentes: cache negativo por negative_ttl_seconds
+    """
+
+    def __init__(self, fresh_seconds: float = AGENT_CACHE_FRESH_SECONDS,
+                 ttl_seconds: float = AGENT_CACHE_TTL,
+                 negative_ttl_seconds: float = AGENT_CACHE_NEGATIVE_TTL,
+                 max_entries: int = AGENT_CACHE_MAX_ENTRIES):
+        self.fresh_seconds = fresh_seconds
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        # agent_id -> [agente ou None, carregado_em, validado_em]
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.stats = {"hits": 0, "negative_hits": 0, "revalidations": 0, "stale": 0,
+                      "misses": 0, "invalidations": 0, "errors": 0}
+
+    def get(self, agent_id: str, loader: Callable[[str], Optional[Dict]],
+            version_loader: Optional[Callable[[str], Optional[str]]] = None) -> Optional[Dict]:
+        """
+        Retorna a configuração do agente, consultando o banco só quando necessário
+
+        Args:
+            agent_id: ID do agente
+            loader: Carrega o agente completo (ou None se não existir)
+            version_loader: Carrega apenas o updated_at do agente
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(agent_id, _MISSING)
+            if entry is not _MISSING:
+                agent, loaded_at, validated_at = entry
+                if agent is None:
+                    if now - loaded_at < self.negative_ttl_seconds:
+                        self.stats["negative_hits"] += 1
+                        return None
+                elif now - validated_at < self.fresh_seconds:
+                    self._entries.move_to_end(agent_id)
+                    self.stats["hits"] += 1
+                    return agent
+
+            generation = self._generation
+
+        outcome = "misses"
+        if entry is not _MISSING and entry[0] is not None and version_loader is not None \
+                and now - entry[1] < self.ttl_seconds:
+            outcome = "stale"
+            try:
+                version = version_loader(agent_id)
+                if version is not None and version == entry[0].get("updated_at"):
+                    with self._lock:
+                        if self._entries.get(agent_id) is entry:
+                            entry[2] = now
+                            self._entries.move_to_end(agent_id)
+                        self.stats["revalidations"] += 1
+                    return entry[0]
+            except Exception as e:
+                logging.warning(f"Falha ao revalidar agente {agent_id}: {e}")
+                with self._lock:
+                    self.stats["errors"] += 1
+
+        with self._lock:
+            self.stats[outcome] += 1
+        agent = loader(agent_id)
+        with self._lock:
+            # Não grava se houve invalidação durante a carga (o valor pode estar desatualizado)
+            if generation != self._generation:
+                return agent
+        self.set(agent_id, agent)
+        return agent
+
+    def set(self, agent_id: str, agent: Optional[Dict]):
+        """Armazena (ou substitui) a configuração do agente; None registra um cache negativo"""
+        now = time.monotonic()
+        with self._lock:
+            self._entries[agent_id] = [agent, now, now]
+            self._entries.move_to_end(agent_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, agent_id: Optional[str] = None):
+        """Descarta a configuração de um agente (ou de todos)"""
+        with self._lock:
+            self.stats["invalidations"] += 1
+            self._generation += 1
+            if agent_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(agent_id, None)
+
+    def get_stats(self) -> Dict:
+        """Métricas do cache (inclui taxa de acerto sem ida ao banco)"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["negative_hits"] + stats["revalidations"] + stats["stale"] + stats["misses"]
+        served = stats["hits"] + stats["negative_hits"]
+        stats["lookups"] = lookups
+        stats["hit_rate"] = round(served / lookups, 3) if lookups else 0.0
+        stats["fresh_seconds"] = self.fresh_seconds
+        stats["ttl_seconds"] = self.ttl_seconds
+        stats["negative_ttl_seconds"] = self.negative_ttl_seconds
+        return stats
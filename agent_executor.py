@@ -0,0 +1,296 @@
+"""
+Execução de agentes fora do event loop, com limites de concorrência
+agent.run() / team.run() são bloqueantes (chamada HTTP ao provedor). Chamados
+direto no handler async, uma resposta lenta congela o worker inteiro. Aqui as
+execuções vão para um pool de threads próprio e limitado, com vagas por
+agente e por conta: um agente (ou cliente) lento enfileira só as próprias
+requisições, e cada requisição tem prazo máximo (fila + execução). Streams
+passam pelas mesmas vagas e ocupam a vaga até o último pedaço.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+AGENT_EXECUTOR_WORKERS = int(os.getenv("AGENT_EXECUTOR_WORKERS", "32"))
+# Execuções simultâneas por agente/time e por conta (0 = sem limite). Agentes padrão são
+# compartilhados por todas as contas: um limite de 1 deixaria uma conta lenta enfileirar as demais
+AGENT_MAX_CONCURRENCY = int(os.getenv("AGENT_MAX_CONCURRENCY", "4"))
+ACCOUNT_MAX_CONCURRENCY = int(os.getenv("ACCOUNT_MAX_CONCURRENCY", "16"))
+# Requisições aguardando vaga por agente (acima disso a requisição é recusada; 0 = sem limite)
+AGENT_MAX_QUEUE = int(os.getenv("AGENT_MAX_QUEUE", "32"))
+# Prazo total da requisição em segundos (espera na fila + execução)
+AGENT_RUN_TIMEOUT = float(os.getenv("AGENT_RUN_TIMEOUT", "120"))
+
+
+class AgentBusyError(Exception):
+    """Fila do agente cheia (HTTP 429)"""
+
+
+class AgentDeadlineExceeded(Exception):
+    """Prazo da requisição esgotado na fila ou na execução (HTTP 504)"""
+
+
+class _Lane:
+    """Vagas de um agente ou de uma conta e quem está esperando por elas"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit) if limit > 0 else None
+        # admitted = com vaga ou aguardando; atualizado antes de qualquer await
+        self.admitted = 0
+        self.running = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.wait_ms = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return self.admitted - self.running
+
+    def queued_after_admit(self) -> int:
+        """Quantos ficariam na fila se mais uma requisição fosse admitida"""
+        return max(self.admitted + 1 - self.limit, 0) if self.limit > 0 else 0
+
+    def admit(self):
+        self.admitted += 1
+        self.max_waiting = max(self.max_waiting, self.admitted - self.limit if self.limit > 0 else 0)
+
+    async def acquire(self):
+        if self.semaphore is not None:
+            await self.semaphore.acquire()
+        self.running += 1
+
+    def abandon(self):
+        """Desistiu antes de conseguir a vaga (prazo ou cancelamento)"""
+        self.admitted -= 1
+
+    def release(self):
+        self.running -= 1
+        self.admitted -= 1
+        if self.semaphore is not None:
+            self.semaphore.release()
+
+    def snapshot(self) -> Dict:
+        return {"running": self.running, "waiting": self.waiting, "max_waiting": self.max_waiting,
+                "completed": self.completed, "timeouts": self.timeouts, "rejected": self.rejected,
+                "avg_wait_ms": round(self.wait_ms / self.completed, 1) if self.completed else 0.0}
+
+
+class AgentExecutor:
+    """
+    Pool de threads limitado para agent.run(), com vagas por agente e por conta
+
+    As vagas são controladas no event loop (asyncio.Semaphore), então só
+    ocupam uma thread as execuções que já têm vaga; as demais esperam sem
+    custo. Se o prazo estourar durante a execução, a resposta é 504, mas as
+    vagas só são devolvidas quando a thread termina de fato (a chamada ao
+    provedor não pode ser interrompida).
+    """
+
+    def __init__(self, workers: int = AGENT_EXECUTOR_WORKERS, agent_limit: int = AGENT_MAX_CONCURRENCY,
+                 account_limit: int = ACCOUNT_MAX_CONCURRENCY, max_queue: int = AGENT_MAX_QUEUE,
+                 timeout: float = AGENT_RUN_TIMEOUT):
+        self.workers = max(workers, 1)
+        self.agent_limit = agent_limit
+        self.account_limit = account_limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._agents: Dict[str, _Lane] = {}
+        self._accounts: Dict[str, _Lane] = {}
+        self.stats = {"submitted": 0, "completed": 0, "errors": 0, "rejected": 0,
+                      "queue_timeouts": 0, "run_timeouts": 0}
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="agent-run")
+        return self._executor
+
+    def _lane(self, lanes: Dict[str, _Lane], key: str, limit: int) -> _Lane:
+        lane = lanes.get(key)
+        if lane is None:
+            lane = lanes[key] = _Lane(limit)
+        return lane
+
+    async def _acquire(self, agent_key: str, account_key: Optional[str], timeout: float,
+                       lane_limit: Optional[int]) -> Tuple[List[_Lane], Optional[float], float]:
+        """Reserva as vagas do agente e da conta (vagas, prazo em perf_counter, espera em ms)"""
+        started = time.perf_counter()
+        deadline = started + timeout if timeout and timeout > 0 else None
+        agent_lane = self._lane(self._agents, agent_key, self.agent_limit if lane_limit is None else lane_limit)
+        account_lane = self._lane(self._accounts, account_key or "default", self.account_limit)
+
+        if self.max_queue > 0 and agent_lane.queued_after_admit() > self.max_queue:
+            agent_lane.rejected += 1
+            self.stats["rejected"] += 1
+            raise AgentBusyError(f"Fila de {agent_key} cheia ({agent_lane.waiting} aguardando)")
+        self.stats["submitted"] += 1
+
+        acquired: List[_Lane] = []
+        pending: Optional[_Lane] = None
+        try:
+            # Sempre na mesma ordem (agente, conta) para não haver espera circular
+            for lane in (agent_lane, account_lane):
+                pending = lane
+                lane.admit()
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    raise asyncio.TimeoutError
+                await asyncio.wait_for(lane.acquire(), remaining)
+                acquired.append(lane)
+                pending = None
+        except asyncio.TimeoutError:
+            self._abandon(pending, acquired)
+            agent_lane.timeouts += 1
+            self.stats["queue_timeouts"] += 1
+            raise AgentDeadlineExceeded(f"Prazo de {timeout:g}s esgotado aguardando vaga em {agent_key}")
+        except BaseException:
+            self._abandon(pending, acquired)
+            raise
+        return acquired, deadline, (time.perf_counter() - started) * 1000
+
+    async def run(self, func: Callable[..., Any], *args: Any, agent_key: str,
+                  account_key: Optional[str] = None, timeout: Optional[float] = None,
+                  lane_limit: Optional[int] = None, **kwargs: Any) -> Any:
+        """
+        Executa func(*args, **kwargs) no pool respeitando as vagas e o prazo
+
+        Args:
+            agent_key: Agente ou time (ex.: "agent:<id>", "team:<id>")
+            account_key: Conta dona do agente (None = "default")
+            timeout: Prazo total em segundos (padrão AGENT_RUN_TIMEOUT; 0 = sem prazo)
+            lane_limit: Vagas de agent_key, se diferente de AGENT_MAX_CONCURRENCY (vale na criação da fila)
+
+        Raises:
+            AgentBusyError: Fila do agente cheia
+            AgentDeadlineExceeded: Prazo esgotado
+        """
+        timeout = self.timeout if timeout is None else timeout
+        acquired, deadline, waited_ms = await self._acquire(agent_key, account_key, timeout, lane_limit)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, lambda: func(*args, **kwargs))
+        # As vagas voltam quando a thread termina, mesmo que a requisição já tenha desistido
+        future.add_done_callback(lambda f: self._finish(f, acquired, waited_ms))
+        remaining = None if deadline is None else max(deadline - time.perf_counter(), 0)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), remaining)
+        except asyncio.TimeoutError:
+            self._run_timeout(agent_key, timeout)
+
+    async def iterate(self, chunks: Iterator[Any], *, agent_key: str, account_key: Optional[str] = None,
+                      timeout: Optional[float] = None) -> AsyncIterator[Any]:
+        """
+        Consome um iterador bloqueante (ex.: run(stream=True)) no pool, com as mesmas vagas e prazo de run()
+
+        As vagas ficam ocupadas do primeiro ao último pedaço e só voltam quando
+        a thread que lê o pedaço atual termina e o iterador é fechado.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        acquired, deadline, waited_ms = await self._acquire(agent_key, account_key, timeout, None)
+        loop = asyncio.get_running_loop()
+        sentinel = object()
+        future: Optional[asyncio.Future] = None
+        exhausted = False
+        try:
+            while True:
+                future = loop.run_in_executor(self.executor, next, chunks, sentinel)
+                remaining = None if deadline is None else max(deadline - time.perf_counter(), 0)
+                try:
+                    chunk = await asyncio.wait_for(asyncio.shield(future), remaining)
+                except asyncio.TimeoutError:
+                    self._run_timeout(agent_key, timeout)
+                if chunk is sentinel:
+                    exhausted = True
+                    return
+                yield chunk
+        finally:
+            self._close_after(future, chunks, exhausted, acquired, waited_ms)
+
+    def _close_after(self, future: Optional["asyncio.Future"], chunks: Iterator[Any], exhausted: bool,
+                     lanes: List[_Lane], waited_ms: float):
+        """Fecha o iterador (interrompe a geração no provedor) e devolve as vagas, sem bloquear o loop"""
+        loop = asyncio.get_running_loop()
+
+        def close(_=None):
+            if exhausted or not hasattr(chunks, "close"):
+                self._finish(future, lanes, waited_ms)
+                return
+            closing = loop.run_in_executor(self.executor, _close_quietly, chunks)
+            closing.add_done_callback(lambda f: self._finish(future, lanes, waited_ms))
+
+        if future is not None and not future.done():
+            # Fechar um gerador em execução em outra thread falha: espera o pedaço atual
+            future.add_done_callback(close)
+        else:
+            close()
+
+    def _run_timeout(self, agent_key: str, timeout: float):
+        self._agents[agent_key].timeouts += 1
+        self.stats["run_timeouts"] += 1
+        logging.warning(f"Execução de {agent_key} passou do prazo de {timeout:g}s")
+        raise AgentDeadlineExceeded(f"Prazo de {timeout:g}s esgotado na execução de {agent_key}")
+
+    def _release(self, lanes: List[_Lane]):
+        for lane in reversed(lanes):
+            lane.release()
+
+    def _abandon(self, pending: Optional[_Lane], acquired: List[_Lane]):
+        if pending is not None:
+            pending.abandon()
+        self._release(acquired)
+
+    def _finish(self, future: Optional["asyncio.Future"], lanes: List[_Lane], waited_ms: float):
+        self._release(lanes)
+        for lane in lanes:
+            lane.completed += 1
+            lane.wait_ms += waited_ms
+        self.stats["completed"] += 1
+        if future is not None and (future.cancelled() or future.exception() is not None):
+            self.stats["errors"] += 1
+
+    def queue_depth(self) -> int:
+        """Execuções aguardando thread livre no pool"""
+        executor = self._executor
+        return executor._work_queue.qsize() if executor is not None else 0
+
+    def get_stats(self, agent_key: Optional[str] = None) -> Dict:
+        """Execuções em andamento, filas por agente/conta e prazos estourados"""
+        agents = {k: v.snapshot() for k, v in list(self._agents.items()) if agent_key is None or k == agent_key}
+        stats = dict(self.stats)
+        stats.update({
+            "workers": self.workers,
+            "executor_queue": self.queue_depth(),
+            "running": sum(lane.running for lane in self._agents.values()),
+            "waiting": sum(lane.waiting for lane in self._agents.values()),
+            "limits": {"agent": self.agent_limit, "account": self.account_limit,
+                       "max_queue": self.max_queue, "timeout": self.timeout},
+            "agents": agents,
+            "accounts": {k: v.snapshot() for k, v in list(self._accounts.items())} if agent_key is None else {},
+        })
+        return stats
+
+    def shutdown(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _close_quietly(chunks: Iterator[Any]):
+    try:
+        chunks.close()
+    except Exception as e:
+        logging.info(f"Stream não fechado: {e}")
+
+
+# Instância global
+agent_executor = AgentExecutor()
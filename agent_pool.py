@@ -0,0 +1,141 @@
+"""
+Pool LRU de instâncias de agentes
+O registro guarda apenas as configurações (leves); os objetos Agent (modelo,
+ferramentas, cliente HTTP) ficam neste pool com tamanho máximo. Agentes frios
+são criados sob demanda e os menos usados são descartados quando o pool
+enche ou quando a memória do processo passa do limite configurado.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+AGENT_POOL_SIZE = int(os.getenv("AGENT_POOL_SIZE", "256"))
+# Limite de memória residente do processo em MB (0 = sem limite)
+AGENT_POOL_MAX_RSS_MB = float(os.getenv("AGENT_POOL_MAX_RSS_MB", "0"))
+# Agentes mantidos mesmo sob pressão de memória
+AGENT_POOL_MIN_SIZE = int(os.getenv("AGENT_POOL_MIN_SIZE", "8"))
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def current_rss_mb() -> Optional[float]:
+    """Memória residente atual do processo em MB (None fora do Linux)"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class AgentPool:
+    """
+    Instâncias materializadas por chave, em ordem de uso (LRU)
+
+    get(key, builder) devolve a instância do pool ou cria uma nova com
+    builder(); a criação acontece fora do lock, então agentes frios não
+    bloqueiam os demais.
+    """
+
+    def __init__(self, max_size: int = AGENT_POOL_SIZE, max_rss_mb: float = AGENT_POOL_MAX_RSS_MB,
+                 min_size: int = AGENT_POOL_MIN_SIZE, rss_reader: Callable[[], Optional[float]] = current_rss_mb):
+        self.max_size = max(max_size, 1)
+        self.max_rss_mb = max_rss_mb
+        self.min_size = max(min_size, 0)
+        self._rss_reader = rss_reader
+        self._agents: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.stats = {"hits": 0, "misses": 0, "builds": 0, "build_errors": 0,
+                      "evictions": 0, "pressure_evictions": 0, "discards": 0, "build_ms": 0.0}
+
+    def get(self, key: Hashable, builder: Callable[[], Any]) -> Any:
+        """Instância do agente (criada com builder() se não estiver no pool)"""
+        with self._lock:
+            agent = self._agents.get(key)
+            if agent is not None:
+                self._agents.move_to_end(key)
+                self.stats["hits"] += 1
+                return agent
+            self.stats["misses"] += 1
+            generation = self._generation
+
+        started = time.perf_counter()
+        try:
+            agent = builder()
+        except Exception:
+            with self._lock:
+                self.stats["build_errors"] += 1
+            raise
+        with self._lock:
+            self.stats["builds"] += 1
+            self.stats["build_ms"] += (time.perf_counter() - started) * 1000
+            existing = self._agents.get(key)
+            if existing is not None:
+                # Outra requisição criou o mesmo agente enquanto este era construído
+                self._agents.move_to_end(key)
+                return existing
+            # Não guarda se a configuração mudou durante a construção
+            if generation == self._generation:
+                self._store(key, agent)
+        return agent
+
+    def put(self, key: Hashable, agent: Any):
+        """Guarda uma instância já criada (ex.: logo após criar o agente)"""
+        with self._lock:
+            self._store(key, agent)
+
+    def _store(self, key: Hashable, agent: Any):
+        self._agents[key] = agent
+        self._agents.move_to_end(key)
+        while len(self._agents) > self.max_size:
+            self._agents.popitem(last=False)
+            self.stats["evictions"] += 1
+        if self.max_rss_mb > 0 and len(self._agents) > self.min_size:
+            rss = self._rss_reader()
+            if rss is not None and rss > self.max_rss_mb:
+                # Libera metade dos agentes acima do mínimo; o coletor devolve a memória aos poucos
+                excess = (len(self._agents) - self.min_size + 1) // 2
+                for _ in range(excess):
+                    self._agents.popitem(last=False)
+                    self.stats["pressure_evictions"] += 1
+                logging.info(f"Pool de agentes acima de {self.max_rss_mb:.0f} MB ({rss:.0f} MB): "
+                             f"{excess} agentes descartados")
+
+    def discard(self, key: Hashable):
+        """Descarta a instância (configuração alterada ou agente removido)"""
+        with self._lock:
+            self._generation += 1
+            if self._agents.pop(key, None) is not None:
+                self.stats["discards"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._agents.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._agents
+
+    def __len__(self) -> int:
+        return len(self._agents)
+
+    def get_stats(self) -> Dict:
+        """Agentes em memória, acertos, criações e descartes"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["warm"] = len(self._agents)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        build_ms = stats.pop("build_ms")
+        stats["avg_build_ms"] = round(build_ms / stats["builds"], 2) if stats["builds"] else 0.0
+        stats["max_size"] = self.max_size
+        stats["max_rss_mb"] = self.max_rss_mb
+        rss = self._rss_reader()
+        stats["rss_mb"] = round(rss, 1) if rss is not None else None
+        return stats
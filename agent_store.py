@@ -0,0 +1,135 @@
+"""
+Persistência das configurações dos agentes personalizados
+Cada agente criado pela API vira uma linha em agentes_solo (colunas usuais +
+user_id e config, ver agentes_solo_config.sql). No restart o registro é
+recarregado a partir dessas linhas; os objetos Agent só são criados quando
+usados (ver agent_pool.py).
+"""
+import logging
+import os
+from typing import Dict, List, Optional
+
+from supabase_client import get_supabase_client
+
+AGENT_STORE_ENABLED = os.getenv("AGENT_STORE_ENABLED", "true").lower() == "true"
+AGENT_STORE_PAGE_SIZE = int(os.getenv("AGENT_STORE_PAGE_SIZE", "1000"))
+
+# Campos do registro guardados na coluna config (JSONB)
+CONFIG_FIELDS = ("system_message", "enable_user_memories", "tools", "add_history_to_context",
+                 "num_history_runs", "add_datetime_to_context", "markdown", "model", "response_cache")
+
+
+def record_to_row(record: Dict) -> Dict:
+    """Registro do agente -> linha de agentes_solo"""
+    model = record.get("model") or {}
+    if isinstance(model, str):
+        model = {"provider": "openai", "name": model}
+    instructions = record.get("instructions") or []
+    return {
+        "id": record["id"],
+        "name": record["name"],
+        "role": record.get("role") or "Agente Personalizado",
+        "instructions": instructions if isinstance(instructions, list) else [instructions],
+        "model": model.get("name", "gpt-4o-mini"),
+        "provider": model.get("provider", "openai"),
+        "account_id": record.get("account_id"),
+        "user_id": record.get("user_id"),
+        "config": {field: record.get(field) for field in CONFIG_FIELDS},
+    }
+
+
+def row_to_record(row: Dict) -> Dict:
+    """Linha de agentes_solo -> registro do agente (linhas sem config recebem os padrões)"""
+    config = row.get("config") or {}
+    return {
+        "name": row["name"],
+        "role": row.get("role"),
+        "instructions": config.get("system_message") or row.get("instructions") or [],
+        "user_id": row.get("user_id") or "default_user",
+        "id": row["id"],
+        "model": config.get("model") or {"provider": row.get("provider") or "openai",
+                                         "name": row.get("model") or "gpt-4o-mini"},
+        "system_message": config.get("system_message"),
+        "enable_user_memories": config.get("enable_user_memories", True),
+        "tools": config.get("tools") or [],
+        "add_history_to_context": config.get("add_history_to_context", True),
+        "num_history_runs": config.get("num_history_runs", 5),
+        "add_datetime_to_context": config.get("add_datetime_to_context", True),
+        "markdown": config.get("markdown", True),
+        "account_id": row.get("account_id"),
+        "response_cache": config.get("response_cache", False),
+    }
+
+
+class AgentConfigStore:
+    """
+    Grava e recarrega as configurações em agentes_solo
+
+    Falhas de banco não impedem a criação do agente: são registradas no log
+    e o agente continua disponível até o próximo restart.
+    """
+
+    def __init__(self, enabled: bool = AGENT_STORE_ENABLED, page_size: int = AGENT_STORE_PAGE_SIZE):
+        self.enabled = enabled
+        self.page_size = page_size
+        self._client = None
+
+    def _table(self):
+        if self._client is None:
+            try:
+                self._client = get_supabase_client()
+            except (ValueError, RuntimeError):
+                # Sem credenciais/pacote: agentes ficam só em memória neste processo
+                self.enabled = False
+                raise
+        return self._client.table("agentes_solo")
+
+    def save(self, record: Dict) -> bool:
+        """Insere ou atualiza a configuração do agente em uma única chamada (registros sem ID não são persistidos)"""
+        if not self.enabled or not record.get("id"):
+            return False
+        try:
+            self._table().upsert(record_to_row(record), on_conflict="id").execute()
+            return True
+        except Exception as e:
+            logging.warning(f"Falha ao persistir configuração do agente {record.get('id')}: {e}")
+            return False
+
+    def delete(self, agent_id: Optional[str]) -> bool:
+        """Remove a configuração persistida do agente"""
+        if not self.enabled or not agent_id:
+            return False
+        try:
+            self._table().delete().eq("id", agent_id).execute()
+            return True
+        except Exception as e:
+            logging.warning(f"Falha ao remover configuração do agente {agent_id}: {e}")
+            return False
+
+    def load_all(self) -> List[Dict]:
+        """
+        Configurações gravadas por este store, em páginas de page_size linhas
+
+        Só linhas com user_id: agentes criados por outros caminhos (ex.:
+        /v1/messages via SupabaseService) não viram agentes personalizados.
+        """
+        if not self.enabled:
+            return []
+        records: List[Dict] = []
+        try:
+            start = 0
+            while True:
+                result = self._table().select("*").filter("user_id", "not.is", "null").order("created_at").range(
+                    start, start + self.page_size - 1).execute()
+                rows = result.data or []
+                records.extend(row_to_record(row) for row in rows)
+                if len(rows) < self.page_size:
+                    break
+                start += self.page_size
+        except Exception as e:
+            logging.warning(f"Configurações de agentes não carregadas de agentes_solo: {e}")
+        return records
+
+
+# Instância global
+agent_store = AgentConfigStore()
@@ -0,0 +1,11 @@
+-- Configuração completa dos agentes personalizados da API (api.py)
+-- Execute este script no SQL Editor do Supabase (depois de agentes_solo_updated_at.sql)
+--
+-- O registro de agentes grava aqui cada agente criado por POST /agents e
+-- recarrega as linhas no restart; as instâncias são recriadas sob demanda.
+
+ALTER TABLE public.agentes_solo
+    ADD COLUMN IF NOT EXISTS user_id TEXT,
+    ADD COLUMN IF NOT EXISTS config JSONB NOT NULL DEFAULT '{}'::jsonb;
+
+CREATE INDEX IF NOT EXISTS idx_agentes_solo_user_id ON public.agentes_solo(user_id);
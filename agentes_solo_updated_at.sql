@@ -0,0 +1,19 @@
+-- Mantém agentes_solo.updated_at atualizado em qualquer UPDATE
+-- (o cache de configurações de agentes revalida suas entradas por esta coluna)
+
+ALTER TABLE public.agentes_solo
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+
+CREATE OR REPLACE FUNCTION update_agentes_solo_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS update_agentes_solo_updated_at ON public.agentes_solo;
+CREATE TRIGGER update_agentes_solo_updated_at
+    BEFORE UPDATE ON public.agentes_solo
+    FOR EACH ROW
+    EXECUTE FUNCTION update_agentes_solo_updated_at();
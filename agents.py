@@ -1,7 +1,13 @@
 import os
 import json
+import threading
+from collections.abc import MutableMapping
 from typing import List
 from config import Config
+from agent_pool import AgentPool
+from agent_store import agent_store
+from shared_registry import SharedMapping
+from model_clients import model_clients
 
 try:
     from agno.agent import Agent
@@ -49,10 +55,8 @@ def create_model():
     """Cria uma instância do modelo OpenAI nativo configurado"""
     if AGNO_AVAILABLE:
         try:
-            return OpenAIChat(
-                model_id="gpt-4o-mini",
-                api_key=os.getenv("OPENAI_API_KEY")
-            )
+            # Cliente HTTP compartilhado com os demais agentes (ver model_clients.py)
+            return model_clients.create_model(OpenAIChat, "openai", "gpt-4o-mini", os.getenv("OPENAI_API_KEY"))
         except NameError:
             print("OpenAIChat não disponível, usando mock")
             return MockModel("gpt-4o-mini", os.getenv("OPENAI_API_KEY"))
@@ -76,18 +80,12 @@ def create_model_from_config(model_config):
         try:
             if provider == "gemini" or provider == "google":
                 # Para modelos Gemini, usa OpenRouterModel
-                return OpenRouterModel(
-                    model_id=model_name,
-                    api_key=os.getenv("OPENAI_API_KEY"),
-                    base_url="https://api.openai.com/v1"
-                )
+                return model_clients.create_model(OpenRouterModel, provider, model_name,
+                                                  os.getenv("OPENAI_API_KEY"), "https://api.openai.com/v1")
             elif provider == "openai":
                 # Para modelos OpenAI, usa OpenRouterModel
-                return OpenRouterModel(
-                    model_id=model_name,
-                    api_key=os.getenv("OPENAI_API_KEY"),
-                    base_url="https://api.openai.com/v1"
-                )
+                return model_clients.create_model(OpenRouterModel, provider, model_name,
+                                                  os.getenv("OPENAI_API_KEY"), "https://api.openai.com/v1")
             else:
                 print(f"Provider {provider} não suportado, usando OpenAI")
                 return create_model()
@@ -184,63 +182,295 @@ def create_agente_vendas_kit_festas():
         markdown=True
     )
 
-def get_all_agents(account_id: str = None):
-    """Retorna todos os agentes disponíveis (padrão + personalizados)"""
-    agents = [
-        create_assistente_principal(),
-        create_agente_pesquisa(),
-        create_agente_tecnico(),
-        create_agente_saudacao(),
-        create_agente_vendas_kit_festas()
-    ]
-    
-    # Adiciona agentes personalizados filtrados por account_id se fornecido
-    for agent_data in custom_agents_storage.values():
-        if account_id is None or agent_data.get("account_id") == account_id:
-            agents.append(agent_data["agent"])
-    
-    return agents
+DEFAULT_AGENT_FACTORIES = [
+    create_assistente_principal,
+    create_agente_pesquisa,
+    create_agente_tecnico,
+    create_agente_saudacao,
+    create_agente_vendas_kit_festas,
+]
 
-def save_agent_memory(user_id: str, messages: list):
-    """Placeholder para salvar memória - implementação futura"""
-    # TODO: Implementar integração com sistema de memória
-    return True
+def _agent_name(agent):
+    """Nome do agente (Agent do Agno expõe .name; o mock também tem .config.name)"""
+    name = getattr(agent, 'name', None)
+    if name is None and hasattr(agent, 'config'):
+        name = getattr(agent.config, 'name', None)
+    return name
 
-# Armazenamento dinâmico de agentes personalizados
-custom_agents_storage = {}
+def _agent_ids(agent):
+    """IDs atribuídos ao objeto do agente (id no Agno, agent_id no mock)"""
+    return [value for value in (getattr(agent, 'id', None), getattr(agent, 'agent_id', None)) if value]
 
-def create_custom_agent(name: str, role: str = None, instructions: list = None, user_id: str = "default_user", agent_id: str = None, model: dict = None, system_message: str = None, enable_user_memories: bool = True, tools: list = None, add_history_to_context: bool = True, num_history_runs: int = 5, add_datetime_to_context: bool = True, markdown: bool = True, account_id: str = None):
-    """Cria um agente personalizado dinamicamente usando AgentOS"""
-    
+
+def build_custom_agent(agent_data):
+    """Cria a instância do agente personalizado a partir do registro de configuração"""
     AgentClass = Agent if AGNO_AVAILABLE else MockAgent
     ToolsClass = DuckDuckGoTools if AGNO_AVAILABLE else MockDuckDuckGoTools
     
-    # Usa system_message se fornecido, senão usa instructions
-    agent_instructions = system_message or (instructions if instructions else ["Você é um assistente útil."])
-    
-    # Cria o modelo baseado nos parâmetros fornecidos
-    agent_model = create_model_from_config(model) if model else create_model()
-    
-    # Cria o agente com os parâmetros fornecidos
+    agent_instructions = agent_data.get("instructions") or ["Você é um assistente útil."]
+    model = agent_data.get("model")
+    tools = agent_data.get("tools")
     agent = AgentClass(
-        name=name,
-        model=agent_model,
+        name=agent_data["name"],
+        model=create_model_from_config(model) if model else create_model(),
         instructions=agent_instructions if isinstance(agent_instructions, list) else [agent_instructions],
         tools=[ToolsClass()] if tools and "DuckDuckGoTools" in tools else [],
-        markdown=markdown
+        markdown=agent_data.get("markdown", True)
     )
     
     # Adiciona ID se fornecido
+    agent_id = agent_data.get("id")
     if agent_id:
         agent.id = agent_id
         # Para MockAgent, também adiciona o ID como atributo
         if not AGNO_AVAILABLE:
             agent.agent_id = agent_id
+    return agent
+
+def custom_agent_key(user_id, name, agent_id=None):
+    """Chave do agente personalizado no registro"""
+    return f"{user_id}_{name}_{agent_id}" if agent_id else f"{user_id}_{name}"
+
+
+class AgentRegistry(MutableMapping):
+    """
+    Registro de agentes com índices por id, nome, usuário e conta
+
+    Os agentes padrão são criados uma única vez (na primeira consulta). Os
+    agentes personalizados continuam acessíveis como um dict (chave ->
+    registro de configuração), mas cada inclusão ou remoção atualiza os
+    índices, de modo que as buscas não dependem do número de agentes
+    carregados. As instâncias dos personalizados ficam no pool LRU e são
+    recriadas a partir do registro quando necessário.
+    """
+
+    def __init__(self, default_factories=None, builder=build_custom_agent, pool=None, namespace="agents"):
+        self._default_factories = list(default_factories or [])
+        self._builder = builder
+        self.pool = pool if pool is not None else AgentPool()
+        self._defaults = None
+        self._default_index = {}
+        self._by_id = {}
+        self._by_user_name = {}
+        self._by_name = {}
+        self._by_account_name = {}
+        self._by_user = {}
+        self._by_account = {}
+        self._lock = threading.RLock()
+        # Registros compartilhados entre workers (Redis); alterações de outros processos chegam por _on_remote_change
+        self._records = SharedMapping(namespace, listener=self._on_remote_change, lock=self._lock)
+        with self._lock:
+            self._rebuild_indexes()
+
+    # ==================== AGENTES PADRÃO ====================
+
+    def default_agents(self):
+        """Agentes padrão (criados uma vez e reutilizados)"""
+        if self._defaults is None:
+            with self._lock:
+                if self._defaults is None:
+                    agents = [factory() for factory in self._default_factories]
+                    index = {}
+                    for agent in agents:
+                        for key in _agent_ids(agent) + [_agent_name(agent)]:
+                            if key:
+                                index.setdefault(key, agent)
+                    self._default_index = index
+                    self._defaults = agents
+        return self._defaults
+
+    # ==================== DICT (CHAVE -> REGISTRO) ====================
+
+    def __getitem__(self, key):
+        return self._records[key]
+
+    def __setitem__(self, key, record):
+        with self._lock:
+            if key in self._records:
+                self._unindex(key, self._records[key])
+            self._records[key] = record
+            self._index(key, record)
+        self.pool.discard(key)
+
+    def __delitem__(self, key):
+        with self._lock:
+            record = self._records.pop(key)
+            self._unindex(key, record)
+        self.pool.discard(key)
+
+    def __iter__(self):
+        # Itera sobre uma cópia: o registro pode mudar durante a iteração
+        return iter(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def _on_remote_change(self, key, previous, record):
+        """Aplica nos índices e no pool uma alteração feita por outro worker"""
+        if previous is not None:
+            self._unindex(key, previous)
+        if record is not None:
+            self._index(key, record)
+        self.pool.discard(key)
+
+    def _rebuild_indexes(self):
+        for index in (self._by_id, self._by_user_name, self._by_name, self._by_account_name,
+                      self._by_user, self._by_account):
+            index.clear()
+        for key, record in self._records.items():
+            self._index(key, record)
+
+    def _index(self, key, record):
+        if record.get("id"):
+            self._by_id[record["id"]] = key
+        self._by_user_name[(record.get("user_id"), record.get("name"))] = key
+        self._by_name.setdefault(record.get("name"), {})[key] = None
+        self._by_account_name.setdefault((record.get("account_id"), record.get("name")), {})[key] = None
+        self._by_user.setdefault(record.get("user_id"), {})[key] = None
+        self._by_account.setdefault(record.get("account_id"), {})[key] = None
+
+    def _unindex(self, key, record):
+        if record.get("id") and self._by_id.get(record["id"]) == key:
+            del self._by_id[record["id"]]
+        user_name = (record.get("user_id"), record.get("name"))
+        if self._by_user_name.get(user_name) == key:
+            del self._by_user_name[user_name]
+            # Outro agente do mesmo usuário com o mesmo nome passa a responder pelo nome
+            for other in self._by_name.get(record.get("name"), {}):
+                if other != key and (self._records.get(other) or {}).get("user_id") == record.get("user_id"):
+                    self._by_user_name[user_name] = other
+        for index, value in ((self._by_name, record.get("name")),
+                             (self._by_account_name, (record.get("account_id"), record.get("name"))),
+                             (self._by_user, record.get("user_id")),
+                             (self._by_account, record.get("account_id"))):
+            keys = index.get(value)
+            if keys is not None:
+                keys.pop(key, None)
+                if not keys:
+                    del index[value]
+
+    # ==================== CONSULTAS ====================
+
+    def key_for_id(self, agent_id):
+        """Chave do agente personalizado com o ID informado (ou None)"""
+        return self._by_id.get(agent_id)
+
+    def key_for_name(self, name, user_id="default_user"):
+        """Chave do agente personalizado do usuário com o nome informado (ou None)"""
+        return self._by_user_name.get((user_id, name))
+
+    def get_record(self, agent_id):
+        """Registro do agente personalizado com o ID informado"""
+        return self._records.get(self.key_for_id(agent_id))
+
+    def get_record_by_name(self, name, user_id="default_user"):
+        """Registro do agente personalizado do usuário com o nome informado"""
+        return self._records.get(self.key_for_name(name, user_id))
+
+    def _keys(self, account_id=None, user_id=None):
+        with self._lock:
+            if account_id is None and user_id is None:
+                return list(self._records)
+            if account_id is not None:
+                keys = self._by_account.get(account_id, {})
+                return [k for k in keys if user_id is None or self._records[k].get("user_id") == user_id]
+            return list(self._by_user.get(user_id, {}))
+
+    def records(self, account_id=None, user_id=None):
+        """Registros personalizados filtrados por conta e/ou usuário"""
+        return [record for record in map(self._records.get, self._keys(account_id, user_id)) if record is not None]
+
+    def custom_agents(self, account_id=None, user_id=None):
+        """Instâncias dos agentes personalizados filtrados por conta e/ou usuário"""
+        agents = (self.agent(key) for key in self._keys(account_id, user_id))
+        return [agent for agent in agents if agent is not None]
+
+    def get_by_id(self, agent_id, account_id=None):
+        """Agente padrão (por ID ou nome) ou personalizado (por ID ou nome), respeitando a conta"""
+        self.default_agents()
+        agent = self._default_index.get(agent_id)
+        if agent is not None:
+            return agent
+        with self._lock:
+            key = self.key_for_id(agent_id)
+            if key is not None and account_id and self._records[key].get("account_id") != account_id:
+                key = None
+            if key is None:
+                # Fallback para nome se não tiver ID
+                keys = self._by_account_name.get((account_id, agent_id)) if account_id else self._by_name.get(agent_id)
+                key = next(iter(keys)) if keys else None
+        return self.agent(key) if key is not None else None
+
+    def get_by_name(self, name, user_id="default_user"):
+        """Agente padrão pelo nome ou, se não houver, o personalizado do usuário"""
+        self.default_agents()
+        agent = self._default_index.get(name)
+        if agent is not None:
+            return agent
+        key = self.key_for_name(name, user_id)
+        return self.agent(key) if key is not None else None
+
+    # ==================== INSTÂNCIAS ====================
+
+    def agent(self, key):
+        """Instância do agente personalizado (do pool ou criada a partir do registro)"""
+        record = self._records.get(key)
+        if record is None:
+            return None
+        return self.pool.get(key, lambda: self._builder(record))
+
+    def load_persisted(self, store):
+        """Carrega os registros persistidos (restart); as instâncias são criadas sob demanda"""
+        records = store.load_all()
+        items = [(custom_agent_key(r["user_id"], r["name"], r["id"]), r) for r in records]
+        with self._lock:
+            # Grava primeiro e reconstrói os índices: _unindex consulta _records, que precisa estar completo
+            self._records.seed(items)
+            self._rebuild_indexes()
+        return len(records)
+
+    def get_stats(self):
+        """Agentes registrados e métricas do pool de instâncias"""
+        return {
+            "default_agents": len(self._default_factories),
+            "custom_agents": len(self._records),
+            "accounts": len(self._by_account),
+            "pool": self.pool.get_stats(),
+            "shared": self._records.get_stats(),
+        }
+
+
+# Armazenamento dinâmico de agentes personalizados (registro indexado)
+agent_registry = AgentRegistry(DEFAULT_AGENT_FACTORIES)
+custom_agents_storage = agent_registry
+
+def get_all_agents(account_id: str = None):
+    """Retorna todos os agentes disponíveis (padrão + personalizados)"""
+    agents = list(agent_registry.default_agents())
+    
+    # Adiciona agentes personalizados filtrados por account_id se fornecido
+    agents.extend(agent_registry.custom_agents(account_id=account_id))
+    
+    return agents
+
+def save_agent_memory(user_id: str, messages: list):
+    """Placeholder para salvar memória - implementação futura"""
+    # TODO: Implementar integração com sistema de memória
+    return True
+
+
+def create_custom_agent(name: str, role: str = None, instructions: list = None, user_id: str = "default_user", agent_id: str = None, model: dict = None, system_message: str = None, enable_user_memories: bool = True, tools: list = None, add_history_to_context: bool = True, num_history_runs: int = 5, add_datetime_to_context: bool = True, markdown: bool = True, account_id: str = None, response_cache: bool = False, replace_key: str = None):
+    """
+    Cria um agente personalizado dinamicamente usando AgentOS
+
+    replace_key: chave do registro que o novo agente substitui (atualização);
+    só é removida depois que o novo registro está gravado.
+    """
     
-    # Armazena o agente personalizado
-    agent_key = f"{user_id}_{name}_{agent_id}" if agent_id else f"{user_id}_{name}"
-    custom_agents_storage[agent_key] = {
-        "agent": agent,
+    # Usa system_message se fornecido, senão usa instructions
+    agent_instructions = system_message or (instructions if instructions else ["Você é um assistente útil."])
+    
+    agent_data = {
         "name": name,
         "role": role,
         "instructions": agent_instructions,
@@ -254,116 +484,79 @@ def create_custom_agent(name: str, role: str = None, instructions: list = None,
         "num_history_runs": num_history_runs,
         "add_datetime_to_context": add_datetime_to_context,
         "markdown": markdown,
-        "account_id": account_id  # Adiciona account_id ao storage
+        "account_id": account_id,  # Adiciona account_id ao storage
+        "response_cache": response_cache  # Respostas reaproveitadas para perguntas repetidas (response_cache.py)
     }
     
+    # Cria a instância antes de registrar: configurações inválidas não entram no registro
+    agent = build_custom_agent(agent_data)
+    
+    # Armazena a configuração (registro + agentes_solo) e deixa a instância quente no pool
+    agent_key = custom_agent_key(user_id, name, agent_id)
+    agent_registry[agent_key] = agent_data
+    if replace_key is not None and replace_key != agent_key:
+        # Nome alterado: o ID já aponta para a chave nova, então o agente não some para outros workers
+        del agent_registry[replace_key]
+    agent_store.save(agent_data)
+    agent_registry.pool.put(agent_key, agent)
+    
     return agent
 
 def update_custom_agent(name: str, new_name: str = None, role: str = None, instructions: list = None, user_id: str = "default_user"):
     """Atualiza um agente personalizado"""
-    agent_key = f"{user_id}_{name}"
-    if agent_key not in custom_agents_storage:
+    agent_key = agent_registry.key_for_name(name, user_id)
+    if agent_key is None:
         return None
     
-    agent_data = custom_agents_storage[agent_key]
+    agent_data = agent_registry[agent_key]
     
     # Atualiza os campos fornecidos
     updated_name = new_name if new_name else agent_data["name"]
     updated_role = role if role else agent_data["role"]
     updated_instructions = instructions if instructions else agent_data["instructions"]
     
-    # Remove o agente antigo se o nome mudou
-    if new_name and new_name != name:
-        del custom_agents_storage[agent_key]
-        agent_key = f"{user_id}_{updated_name}"
-    
-    # Cria o agente atualizado
-    updated_agent = create_custom_agent(updated_name, updated_role, updated_instructions, user_id)
+    # Cria o agente atualizado mantendo ID, modelo, conta e demais opções; se a criação
+    # falhar, o registro antigo continua valendo (a chave inclui o nome e é trocada ao final)
+    updated_agent = create_custom_agent(
+        updated_name, updated_role, updated_instructions, user_id,
+        agent_id=agent_data.get("id"),
+        model=agent_data.get("model"),
+        enable_user_memories=agent_data.get("enable_user_memories", True),
+        tools=agent_data.get("tools"),
+        add_history_to_context=agent_data.get("add_history_to_context", True),
+        num_history_runs=agent_data.get("num_history_runs", 5),
+        add_datetime_to_context=agent_data.get("add_datetime_to_context", True),
+        markdown=agent_data.get("markdown", True),
+        account_id=agent_data.get("account_id"),
+        response_cache=agent_data.get("response_cache", False),
+        replace_key=agent_key
+    )
     
     return updated_agent
 
 def delete_custom_agent(agent_id: str, user_id: str = "default_user"):
     """Remove um agente personalizado pelo ID"""
-    # Busca o agente pelo ID
-    for agent_key, agent_data in list(custom_agents_storage.items()):
-        agent = agent_data["agent"]
-        if hasattr(agent, 'id') and agent.id == agent_id:
-            del custom_agents_storage[agent_key]
-            return True
+    agent_key = agent_registry.key_for_id(agent_id)
+    if agent_key is None:
         # Fallback para nome se não tiver ID
-        agent_name = getattr(agent.config, 'name', None) if hasattr(agent, 'config') else None
-        if agent_name == agent_id:
-            del custom_agents_storage[agent_key]
-            return True
-    return False
+        agent_key = agent_registry.key_for_name(agent_id, user_id)
+    if agent_key is None:
+        return False
+    try:
+        agent_data = agent_registry.pop(agent_key)
+    except KeyError:
+        return False
+    agent_store.delete(agent_data.get("id"))
+    return True
 
 def get_custom_agents(user_id: str = "default_user"):
     """Retorna todos os agentes personalizados do usuário"""
-    user_agents = []
-    for agent_key, agent_data in custom_agents_storage.items():
-        if agent_data["user_id"] == user_id:
-            user_agents.append(agent_data["agent"])
-    return user_agents
+    return agent_registry.custom_agents(user_id=user_id)
 
 def get_agent_by_name(name: str, user_id: str = "default_user"):
     """Busca um agente pelo nome (padrão ou personalizado) usando AgentOS"""
-    # Primeiro busca nos agentes padrão
-    agents = get_all_agents()
-    for agent in agents:
-        agent_name = getattr(agent.config, 'name', None) if hasattr(agent, 'config') else None
-        if agent_name == name:
-            return agent
-    
-    # Depois busca nos agentes personalizados
-    agent_key = f"{user_id}_{name}"
-    if agent_key in custom_agents_storage:
-        return custom_agents_storage[agent_key]["agent"]
-    
-    return None
+    return agent_registry.get_by_name(name, user_id)
 
 def get_agent_by_id(agent_id: str, account_id: str = None):
     """Busca um agente pelo ID (padrão ou personalizado) usando AgentOS"""
-    print(f"🔍 Buscando agente com ID: {agent_id}")
-    print(f"📦 Agentes no storage: {list(custom_agents_storage.keys())}")
-    
-    # Primeiro busca nos agentes padrão
-    agents = get_all_agents()
-    for agent in agents:
-        if hasattr(agent, 'id') and agent.id == agent_id:
-            print(f"✅ Agente encontrado nos padrão: {agent.id}")
-            return agent
-        # Fallback para nome se não tiver ID
-        agent_name = getattr(agent.config, 'name', None) if hasattr(agent, 'config') else None
-        if agent_name == agent_id:
-            print(f"✅ Agente encontrado por nome nos padrão: {agent_name}")
-            return agent
-    
-    # Depois busca nos agentes personalizados
-    for agent_key, agent_data in custom_agents_storage.items():
-        print(f"🔎 Verificando chave: {agent_key}, tipo: {type(agent_data)}")
-        # Se account_id for fornecido, filtra por ele
-        if account_id and agent_data.get("account_id") != account_id:
-            continue
-            
-        print(f"📋 Dados do agente: {agent_data}")
-        agent = agent_data["agent"]
-        # Verifica ID do agente
-        if hasattr(agent, 'id') and agent.id == agent_id:
-            print(f"✅ Agente encontrado por id: {agent_id}")
-            return agent
-        # Verifica agent_id para MockAgent
-        if hasattr(agent, 'agent_id') and agent.agent_id == agent_id:
-            print(f"✅ Agente encontrado por agent_id: {agent_id}")
-            return agent
-        # Verifica ID armazenado no dicionário
-        if agent_data.get("id") == agent_id:
-            print(f"✅ Agente encontrado no dicionário: {agent_id}")
-            return agent
-        # Fallback para nome se não tiver ID
-        agent_name = getattr(agent.config, 'name', None) if hasattr(agent, 'config') else None
-        if agent_name == agent_id:
-            print(f"✅ Agente encontrado por nome: {agent_name}")
-            return agent
-    
-    print(f"❌ Agente não encontrado: {agent_id}")
-    return None
\ No newline at end of file
+    return agent_registry.get_by_id(agent_id, account_id)
@@ -8,9 +8,11 @@ import os
 import json
 import uuid
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase_client import get_supabase_client, LOCAL_BACKEND, Client
+from memory_filters import apply_memory_filters, apply_keyset_page, split_page, iter_pages
+from memory_stats import get_memory_statistics as fetch_memory_statistics
 
 # Carrega variáveis de ambiente
 load_dotenv()
@@ -23,10 +25,10 @@ class AgnoMemoryService:
         self.supabase_url = os.getenv("SUPABASE_URL")
         self.supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
         
-        if not self.supabase_url or not self.supabase_key:
+        if not LOCAL_BACKEND and (not self.supabase_url or not self.supabase_key):
             raise ValueError("Credenciais do Supabase não encontradas")
         
-        self.supabase: Client = create_client(self.supabase_url, self.supabase_key)
+        self.supabase: Client = get_supabase_client(self.supabase_url, self.supabase_key)
         print("✅ Serviço de memórias do Agno inicializado")
     
     def create_memory(self, 
@@ -105,65 +107,24 @@ class AgnoMemoryService:
                      user_id: str, 
                      agent_id: Optional[str] = None,
                      limit: int = 10,
-                     topics: Optional[List[str]] = None) -> Dict[str, Any]:
+                     topics: Optional[List[str]] = None,
+                     cursor: Optional[str] = None) -> Dict[str, Any]:
         """
-        Lista memórias do usuário
+        Lista memórias do usuário (mais recentes primeiro), paginadas por cursor
         
         Args:
             user_id: ID do usuário
             agent_id: ID do agente (opcional)
             limit: Limite de resultados
             topics: Filtrar por tópicos (opcional)
+            cursor: next_cursor da página anterior (opcional)
             
         Returns:
-            Dict com lista de memórias
+            Dict com lista de memórias e next_cursor (None na última página)
         """
         try:
-            # Construir query base
-            query = self.supabase.table("message_history").select("*")
-            
-            # Filtros
-            query = query.eq("user_id", user_id)
-            query = query.eq("role", "system")  # Apenas memórias (role=system)
-            
-            # Filtrar por agent_id se fornecido
-            if agent_id:
-                query = query.contains("metadata", {"agent_id": agent_id})
-            
-            # Filtrar por type=enriched_memory
-            query = query.contains("metadata", {"type": "enriched_memory"})
-            
-            # Ordenar por data de criação (mais recentes primeiro)
-            query = query.order("created_at", desc=True)
-            
-            # Aplicar limite
-            query = query.limit(limit)
-            
-            # Executar query
-            result = query.execute()
-            
-            memories = []
-            for row in result.data:
-                metadata = row.get("metadata", {})
-                
-                # Filtrar por tópicos se especificado
-                if topics:
-                    row_topics = metadata.get("topics", [])
-                    if not any(topic in row_topics for topic in topics):
-                        continue
-                
-                memory_info = {
-                    "memory_id": metadata.get("memory_id", f"mem-{row['id']}"),
-                    "id": row["id"],
-                    "memory": row["content"],
-                    "user_id": row["user_id"],
-                    "agent_id": metadata.get("agent_id"),
-                    "session_id": row["session_id"],
-                    "topics": metadata.get("topics", []),
-                    "metadata": metadata,
-                    "created_at": row["created_at"]
-                }
-                memories.append(memory_info)
+            rows, next_cursor = self._fetch_memory_page(user_id, agent_id, topics, cursor, limit)
+            memories = [self._format_memory(row) for row in rows]
             
             print(f"✅ Encontradas {len(memories)} memórias para user_id: {user_id}")
             
@@ -172,6 +133,8 @@ class AgnoMemoryService:
                 "count": len(memories),
                 "user_id": user_id,
                 "agent_id": agent_id,
+                "next_cursor": next_cursor,
+                "has_more": next_cursor is not None,
                 "status": "success"
             }
             
@@ -184,6 +147,52 @@ class AgnoMemoryService:
                 "status": "failed"
             }
     
+    def iter_memories(self,
+                      user_id: str,
+                      agent_id: Optional[str] = None,
+                      topics: Optional[List[str]] = None,
+                      page_size: int = 500,
+                      cursor: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Percorre todas as memórias do usuário página a página (exportação)
+        
+        Mantém apenas uma página em memória; erros de consulta são propagados.
+        """
+        def fetch(page_cursor: Optional[str]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+            return self._fetch_memory_page(user_id, agent_id, topics, page_cursor, page_size)
+        
+        for row in iter_pages(fetch, cursor):
+            yield self._format_memory(row)
+    
+    def _fetch_memory_page(self, user_id: str, agent_id: Optional[str], topics: Optional[List[str]],
+                           cursor: Optional[str], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        query = self.supabase.table("message_history").select("*")
+        query = query.eq("user_id", user_id)
+        query = query.eq("role", "system")  # Apenas memórias (role=system)
+        
+        # Filtros de tipo (enriched_memory), agente e tópicos aplicados no banco (indexados)
+        query = apply_memory_filters(query, memory_type="enriched_memory", agent_id=agent_id,
+                                     topics=topics)
+        
+        # Mais recentes primeiro, continuando após o cursor (keyset em created_at, id)
+        result = apply_keyset_page(query, cursor, limit).execute()
+        return split_page(result.data or [], limit)
+    
+    @staticmethod
+    def _format_memory(row: Dict[str, Any]) -> Dict[str, Any]:
+        metadata = row.get("metadata", {})
+        return {
+            "memory_id": metadata.get("memory_id", f"mem-{row['id']}"),
+            "id": row["id"],
+            "memory": row["content"],
+            "user_id": row["user_id"],
+            "agent_id": metadata.get("agent_id"),
+            "session_id": row["session_id"],
+            "topics": metadata.get("topics", []),
+            "metadata": metadata,
+            "created_at": row["created_at"]
+        }
+    
     def update_memory(self, memory_id: str, memory: str, topics: Optional[List[str]] = None) -> Dict[str, Any]:
         """
         Atualiza uma memória existente
@@ -261,7 +270,7 @@ class AgnoMemoryService:
     
     def get_memory_statistics(self, user_id: str, agent_id: Optional[str] = None) -> Dict[str, Any]:
         """
-        Obtém estatísticas das memórias
+        Obtém estatísticas das memórias (total, tópicos e última atividade)
         
         Args:
             user_id: ID do usuário
@@ -271,32 +280,14 @@ class AgnoMemoryService:
             Dict com estatísticas
         """
         try:
-            # Query base
-            query = self.supabase.table("message_history").select("*", count="exact")
-            query = query.eq("user_id", user_id)
-            query = query.eq("role", "system")
-            query = query.contains("metadata", {"type": "enriched_memory"})
-            
-            if agent_id:
-                query = query.contains("metadata", {"agent_id": agent_id})
-            
-            result = query.execute()
-            
-            total_memories = result.count or 0
-            
-            # Contar tópicos únicos
-            topics_set = set()
-            for row in result.data:
-                metadata = row.get("metadata", {})
-                topics = metadata.get("topics", [])
-                topics_set.update(topics)
+            # Contadores mantidos por trigger no banco (memory_stats.sql)
+            stats = fetch_memory_statistics(self.supabase, user_id, agent_id=agent_id,
+                                            memory_type="enriched_memory")
             
             return {
                 "user_id": user_id,
                 "agent_id": agent_id,
-                "total_memories": total_memories,
-                "unique_topics": len(topics_set),
-                "topics_list": list(topics_set),
+                **stats,
                 "status": "success"
             }
             
@@ -1,16 +1,29 @@
 from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional, Union
 import uuid
+import asyncio
+import json
+import time
 from agents import (
-    get_all_agents, get_agent_by_name, get_agent_by_id, save_agent_memory,
+    get_agent_by_name, get_agent_by_id, save_agent_memory,
     create_custom_agent, update_custom_agent, delete_custom_agent, get_custom_agents,
-    custom_agents_storage
+    agent_registry
 )
+from agent_store import agent_store
+from model_clients import model_clients
 from teams import (
-    create_team, get_all_teams, get_team_by_id, update_team, delete_team, run_team
+    create_team, get_all_teams, get_team_by_id, update_team, delete_team,
+    get_team_instance_by_id, save_team_memory, teams_storage
 )
+from agent_executor import agent_executor, AgentBusyError, AgentDeadlineExceeded
+from batch_runs import run_batch, iter_batch, summarize, AGENT_BATCH_MAX_ITEMS, AGENT_BATCH_CONCURRENCY
+from idempotency import idempotency_store, idempotency_key, IdempotencyInProgress
+from usage_accounting import usage_accountant, run_usage, model_name, timed_run
+from response_cache import response_cache, agent_fingerprint
+from run_streaming import iter_text, stream_run, stream_metrics, MEDIA_TYPES, STREAM_HEADERS
 from memory import memory_manager
 from knowledge import knowledge_manager, get_knowledge_by_id, create_knowledge_base_with_config, delete_knowledge_base, add_source_to_knowledge
 import logging
@@ -61,6 +74,7 @@ class AgentCreateRequest(BaseModel):
     model: Optional[str] = Field("gpt-4o-mini", description="Nome do modelo", example="gemini-2.5-flash")
     provider: Optional[str] = Field("openai", description="Provedor do modelo", example="gemini")
     account_id: Optional[str] = Field(None, description="ID da conta", example="f7dae33c-6364-4d88-908f-f5f64426a5c9")
+    response_cache: Optional[bool] = Field(False, description="Reaproveitar respostas de perguntas repetidas (agentes de FAQ)")
 
 class AgentUpdateRequest(BaseModel):
     name: Optional[str] = None
@@ -135,6 +149,24 @@ class AgentRunRequest(BaseModel):
         description="ID da sessão",
         example="session_123"
     )
+    message_id: Optional[str] = Field(
+        None,
+        description="ID da mensagem no canal de origem; reenvios com o mesmo ID recebem a mesma resposta",
+        example="wamid.HBgNNTUxMTk5OTk5OTk5ORUCABIYFjNFQjBDNzE3"
+    )
+
+class AgentBatchRunRequest(BaseModel):
+    messages: List[str] = Field(
+        ...,
+        description="Mensagens independentes (cada uma gera uma execução)",
+        example=["Tenho interesse no kit festa infantil", "Qual o prazo de entrega?"]
+    )
+    user_id: str = Field(..., description="ID do usuário para mensagens")
+    session_id: Optional[str] = Field(None, description="ID da sessão")
+    concurrency: Optional[int] = Field(
+        None,
+        description="Execuções simultâneas (padrão e máximo: AGENT_BATCH_CONCURRENCY)"
+    )
 
 class TeamRunRequest2(BaseModel):
     message: str = Field(..., description="Mensagem para o time")
@@ -184,16 +216,120 @@ def create_api_app() -> FastAPI:
         ]
     )
 
+    @app.on_event("startup")
+    async def load_persisted_agents():
+        """Recarrega as configurações dos agentes personalizados gravadas em agentes_solo"""
+        loaded = await asyncio.to_thread(agent_registry.load_persisted, agent_store)
+        logger.info(f"{loaded} agentes personalizados carregados de agentes_solo")
+
+    @app.on_event("shutdown")
+    async def close_model_clients():
+        """Fecha os pools HTTP dos clientes de modelo compartilhados"""
+        model_clients.close()
+
+    @app.on_event("shutdown")
+    async def shutdown_agent_executor():
+        """Encerra o pool de execução dos agentes"""
+        agent_executor.shutdown()
+
     @app.get("/health", response_model=HealthResponse, tags=["Health"])
     async def health_check():
         """Endpoint de verificação de saúde da API (sem autenticação para Docker health check)"""
-        agents = get_all_agents()
         return HealthResponse(
             status="healthy",
             message="AgentOS API está funcionando corretamente",
-            agents_count=len(agents)
+            agents_count=len(agent_registry.default_agents()) + len(agent_registry)
         )
 
+    @app.get("/stats/agents", tags=["Health"])
+    async def agent_pool_stats(api_key: str = Depends(verify_api_key)):
+        """Agentes registrados e métricas do pool de instâncias (quentes, acertos, descartes)"""
+        return agent_registry.get_stats()
+
+    @app.get("/stats/model-clients", tags=["Health"])
+    async def model_client_stats(api_key: str = Depends(verify_api_key)):
+        """Clientes de modelo compartilhados entre os agentes (reutilização e limites do pool HTTP)"""
+        return model_clients.get_stats()
+
+    @app.get("/stats/executor", tags=["Health"])
+    async def agent_executor_stats(agent_key: Optional[str] = None, api_key: str = Depends(verify_api_key)):
+        """Execuções em andamento, filas por agente/conta e prazos estourados (agent_key = "agent:<id>" ou "team:<id>")"""
+        return agent_executor.get_stats(agent_key)
+
+    @app.get("/stats/response-cache", tags=["Health"])
+    async def response_cache_stats(api_key: str = Depends(verify_api_key)):
+        """Cache de respostas dos agentes: taxa de acerto, acertos por similaridade e latência economizada"""
+        return response_cache.get_stats()
+
+    @app.get("/stats/idempotency", tags=["Health"])
+    async def idempotency_stats(api_key: str = Depends(verify_api_key)):
+        """Mensagens executadas, duplicatas que aguardaram ou receberam a resposta guardada"""
+        return idempotency_store.get_stats()
+
+    @app.get("/usage", tags=["Health"])
+    async def usage_report(hours: int = 24, target: Optional[str] = None, account_id: Optional[str] = None,
+                           group_by: str = "target", api_key: str = Depends(verify_api_key)):
+        """
+        Uso agregado por agente/time, conta e hora: tokens reais, modelos, latências e acertos de cache
+
+        group_by: "target" (agente/time), "account", "hour" ou "target_hour".
+        target = "agent:<id>" ou "team:<id>".
+        """
+        if group_by not in ("target", "account", "hour", "target_hour"):
+            raise HTTPException(status_code=400, detail="group_by deve ser 'target', 'account', 'hour' ou 'target_hour'")
+        rows = await asyncio.to_thread(usage_accountant.query, hours, target, account_id, group_by)
+        return {"hours": hours, "group_by": group_by, "rows": rows, "stats": usage_accountant.get_stats()}
+
+    def usage_response(usage: Dict, total_ms: float, run_ms: float, cache_hit: bool = False) -> Dict:
+        """agent_usage/team_usage devolvido ao cliente (tokens informados pelo provedor)"""
+        return {
+            "input_tokens": usage.get("input_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0),
+            "cached_tokens": usage.get("cached_tokens", 0),
+            "model": usage.get("model"),
+            "cache_hit": cache_hit,
+            "latency_ms": {
+                "total": round(total_ms, 1),
+                "queue": round(max(total_ms - run_ms, 0.0), 1) if not cache_hit else 0.0,
+                "run": round(run_ms, 1)
+            }
+        }
+
+    async def execute_agent(agent, message: str, agent_id: str, record: Dict,
+                            agent_key: Optional[str] = None, lane_limit: Optional[int] = None):
+        """
+        Executa o agente no pool de execução, reaproveitando a resposta em cache quando habilitado
+
+        Returns:
+            (texto da resposta, acerto do cache ou None, uso: tokens reais, modelo e latências)
+        """
+        cache_key = f"agent:{agent_id}"
+        account_id = record.get("account_id")
+        started = time.perf_counter()
+        use_cache = response_cache.enabled_for(agent_id, getattr(agent, "name", None), record)
+        if use_cache:
+            fingerprint = agent_fingerprint(agent, knowledge_manager.version)
+            cached = response_cache.lookup(cache_key, fingerprint, message)
+            if cached is not None:
+                usage = {"input_tokens": 0, "output_tokens": 0, "model": model_name(agent)}
+                total_ms = (time.perf_counter() - started) * 1000
+                usage_accountant.record(cache_key, account_id, usage, total_ms=total_ms, cache_hit=True)
+                return cached["content"], cached, usage_response(usage, total_ms, 0.0, cache_hit=True)
+        try:
+            response, run_ms = await agent_executor.run(timed_run, agent.run, message, agent_key=agent_key or cache_key,
+                                                        account_key=account_id, lane_limit=lane_limit)
+        except Exception:
+            usage_accountant.record(cache_key, account_id, total_ms=(time.perf_counter() - started) * 1000, error=True)
+            raise
+        total_ms = (time.perf_counter() - started) * 1000
+        usage = run_usage(response, fallback_model=model_name(agent))
+        usage_accountant.record(cache_key, account_id, usage, total_ms=total_ms,
+                                queue_ms=max(total_ms - run_ms, 0.0), run_ms=run_ms)
+        response_content = response.content if hasattr(response, 'content') else str(response)
+        if use_cache:
+            response_cache.store(cache_key, fingerprint, message, response_content, total_ms)
+        return response_content, None, usage_response(usage, total_ms, run_ms)
+
     async def chat_with_agent(agent_name: str, request: ChatRequest):
         """Função auxiliar para chat com agente"""
         try:
@@ -204,23 +340,25 @@ def create_api_app() -> FastAPI:
             if not agent:
                 raise HTTPException(status_code=404, detail=f"Agente '{agent_name}' não encontrado")
             
-            # Executa o agente com a mensagem
-            response = agent.run(request.message)
-            
-            # Extrai o conteúdo da resposta
-            response_content = response.content if hasattr(response, 'content') else str(response)
+            # Executa o agente com a mensagem (fora do event loop)
+            record = agent_registry.get_record_by_name(agent_name, user_id) or {}
+            response_content, _, _ = await execute_agent(agent, request.message, record.get("id") or agent_name, record)
             
             # Salva a interação na memória Mem0
             messages = [
                 {"role": "user", "content": request.message},
                 {"role": "assistant", "content": response_content}
             ]
-            save_agent_memory(user_id, messages)
+            await asyncio.to_thread(save_agent_memory, user_id, messages)
             
             return response_content
             
         except HTTPException:
             raise
+        except AgentBusyError as e:
+            raise HTTPException(status_code=429, detail=str(e))
+        except AgentDeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
         except Exception as e:
             logger.error(f"Erro no chat com agente {agent_name}: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
@@ -263,7 +401,9 @@ def create_api_app() -> FastAPI:
                 "name": request.model or "gpt-4o-mini"
             }
             
-            agent = create_custom_agent(
+            # Persistência em agentes_solo (Supabase) fora do event loop
+            agent = await asyncio.to_thread(
+                create_custom_agent,
                 name=request.name,
                 role=request.role,
                 instructions=request.instructions,
@@ -277,7 +417,8 @@ def create_api_app() -> FastAPI:
                 num_history_runs=5,
                 add_datetime_to_context=True,
                 markdown=True,
-                account_id=request.account_id
+                account_id=request.account_id,
+                response_cache=bool(request.response_cache)
             )
             return {
                 "message": "Agente criado com sucesso",
@@ -299,11 +440,10 @@ def create_api_app() -> FastAPI:
             # Agentes padrão - só incluir se account_id não for fornecido
             default_agents_data = []
             if not account_id:
-                default_agents = get_all_agents()
-                for agent in default_agents:
+                for agent in agent_registry.default_agents():
                     default_agents_data.append({
-                        "id": getattr(agent, 'id', str(uuid.uuid4())),
-                        "name": agent.config.name,
+                        "id": getattr(agent, 'id', None) or str(uuid.uuid4()),
+                        "name": getattr(agent, 'name', None) or agent.config.name,
                         "model": {"provider": "openai", "name": "gpt-4o-mini"},
                         "system_message": getattr(agent, 'system_message', ''),
                         "enable_user_memories": True,
@@ -312,21 +452,19 @@ def create_api_app() -> FastAPI:
                         "type": "default"
                     })
             
-            # Agentes personalizados
-            from agents import custom_agents_storage
+            # Agentes personalizados (índice por conta)
             custom_agents_data = []
-            for agent_key, agent_data in custom_agents_storage.items():
-                if not account_id or agent_data.get("account_id") == account_id:
-                    custom_agents_data.append({
-                        "id": agent_data.get("id", agent_key),
-                        "name": agent_data["name"],
-                        "model": agent_data.get("model", {"provider": "openai", "name": "gpt-4o-mini"}),
-                        "system_message": agent_data.get("system_message", ""),
-                        "enable_user_memories": agent_data.get("enable_user_memories", True),
-                        "tools": agent_data.get("tools", []),
-                        "account_id": agent_data.get("account_id"),
-                        "type": "custom"
-                    })
+            for agent_data in agent_registry.records(account_id=account_id or None):
+                custom_agents_data.append({
+                    "id": agent_data.get("id") or f"{agent_data['user_id']}_{agent_data['name']}",
+                    "name": agent_data["name"],
+                    "model": agent_data.get("model", {"provider": "openai", "name": "gpt-4o-mini"}),
+                    "system_message": agent_data.get("system_message", ""),
+                    "enable_user_memories": agent_data.get("enable_user_memories", True),
+                    "tools": agent_data.get("tools", []),
+                    "account_id": agent_data.get("account_id"),
+                    "type": "custom"
+                })
             
             return {
                 "default_agents": default_agents_data,
@@ -341,25 +479,24 @@ def create_api_app() -> FastAPI:
         """Busca um agente específico pelo ID"""
         try:
             # Primeiro verifica nos agentes personalizados
-            from agents import custom_agents_storage
-            for agent_key, agent_data in custom_agents_storage.items():
-                if agent_data.get("id") == agent_id and agent_data["user_id"] == user_id:
-                    return {
-                        "id": agent_data.get("id", agent_key),
-                        "name": agent_data["name"],
-                        "role": agent_data.get("role", "Agente Personalizado"),
-                        "model": agent_data.get("model", {"provider": "openai", "name": "gpt-4o-mini"}),
-                        "system_message": agent_data.get("system_message", ""),
-                        "instructions": agent_data.get("instructions", []),
-                        "enable_user_memories": agent_data.get("enable_user_memories", True),
-                        "tools": agent_data.get("tools", ["DuckDuckGoTools"]),
-                        "add_history_to_context": agent_data.get("add_history_to_context", True),
-                        "num_history_runs": agent_data.get("num_history_runs", 5),
-                        "add_datetime_to_context": agent_data.get("add_datetime_to_context", True),
-                        "markdown": agent_data.get("markdown", True),
-                        "user_id": user_id,
-                        "type": "custom"
-                    }
+            agent_data = agent_registry.get_record(agent_id)
+            if agent_data is not None and agent_data["user_id"] == user_id:
+                return {
+                    "id": agent_id,
+                    "name": agent_data["name"],
+                    "role": agent_data.get("role", "Agente Personalizado"),
+                    "model": agent_data.get("model", {"provider": "openai", "name": "gpt-4o-mini"}),
+                    "system_message": agent_data.get("system_message", ""),
+                    "instructions": agent_data.get("instructions", []),
+                    "enable_user_memories": agent_data.get("enable_user_memories", True),
+                    "tools": agent_data.get("tools", ["DuckDuckGoTools"]),
+                    "add_history_to_context": agent_data.get("add_history_to_context", True),
+                    "num_history_runs": agent_data.get("num_history_runs", 5),
+                    "add_datetime_to_context": agent_data.get("add_datetime_to_context", True),
+                    "markdown": agent_data.get("markdown", True),
+                    "user_id": user_id,
+                    "type": "custom"
+                }
             
             # Se não encontrou nos personalizados, busca nos padrão
             agent = get_agent_by_id(agent_id)
@@ -392,18 +529,13 @@ def create_api_app() -> FastAPI:
         """Atualiza um agente personalizado existente"""
         try:
             # Primeiro, encontra o agente pelo ID para obter o nome atual
-            agent_found = None
-            agent_name = None
-            for agent_key, agent_data in custom_agents_storage.items():
-                if agent_data["user_id"] == user_id and agent_data["id"] == agent_id:
-                    agent_found = agent_data
-                    agent_name = agent_data["name"]
-                    break
-            
-            if not agent_found:
+            agent_found = agent_registry.get_record(agent_id)
+            if not agent_found or agent_found["user_id"] != user_id:
                 raise HTTPException(status_code=404, detail="Agente não encontrado")
+            agent_name = agent_found["name"]
             
-            updated_agent = update_custom_agent(
+            updated_agent = await asyncio.to_thread(
+                update_custom_agent,
                 name=agent_name,
                 new_name=request.name,
                 role=request.role,
@@ -433,10 +565,11 @@ def create_api_app() -> FastAPI:
     async def delete_agent(agent_id: str, user_id: str = "default_user", api_key: str = Depends(verify_api_key)):
         """Remove um agente personalizado"""
         try:
-            success = delete_custom_agent(agent_id, user_id=user_id)
+            success = await asyncio.to_thread(delete_custom_agent, agent_id, user_id=user_id)
             
             if not success:
                 raise HTTPException(status_code=404, detail="Agente não encontrado ou não é personalizável")
+            response_cache.invalidate(f"agent:{agent_id}")
             
             return {"message": f"Agente '{agent_id}' removido com sucesso"}
         except HTTPException:
@@ -474,29 +607,133 @@ def create_api_app() -> FastAPI:
             if not agent:
                 raise HTTPException(status_code=404, detail="Agente não encontrado")
             
-            # Executa o agente apenas com a mensagem
-            response = agent.run(request.message)
+            record = agent_registry.get_record(agent_id) or {}
             
-            # Extrai o conteúdo da resposta se for um objeto
-            response_content = response.content if hasattr(response, 'content') else str(response)
+            async def execute():
+                # Executa o agente apenas com a mensagem (fora do event loop)
+                response_content, cached, usage = await execute_agent(agent, request.message, agent_id, record)
+                return {
+                    "messages": [response_content],
+                    "transferir": False,
+                    "session_id": request.session_id,
+                    "user_id": request.user_id,
+                    "agent_id": agent_id,
+                    "custom": [],
+                    "cached": cached is not None,
+                    "agent_usage": usage
+                }
             
+            # Reenvios do mesmo message_id aguardam/recebem a resposta da primeira execução
+            result, _ = await idempotency_store.run(
+                idempotency_key("run", request.message_id, agent_id, record.get("account_id")), execute)
+            return result
+        except HTTPException:
+            raise
+        except IdempotencyInProgress as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except AgentBusyError as e:
+            raise HTTPException(status_code=429, detail=str(e))
+        except AgentDeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    @app.post("/agents/{agent_id}/run_batch", summary="Executar agente em lote", tags=["Agentes"])
+    async def run_agent_batch(agent_id: str, request: AgentBatchRunRequest, format: str = "json",
+                              api_key: str = Depends(verify_api_key)):
+        """
+        Executa várias mensagens independentes no mesmo agente, com paralelismo limitado
+
+        format=json devolve os resultados na ordem de entrada + resumo (vazão,
+        latências, falhas). format=ndjson envia cada resultado assim que termina
+        ({"index", "response" | "error", "latency_ms"}) e o resumo na última linha.
+        """
+        if format not in ("json", "ndjson"):
+            raise HTTPException(status_code=400, detail="format deve ser 'json' ou 'ndjson'")
+        if not request.messages:
+            raise HTTPException(status_code=400, detail="messages não pode ser vazio")
+        if len(request.messages) > AGENT_BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=400, detail=f"Máximo de {AGENT_BATCH_MAX_ITEMS} mensagens por lote")
+        agent = get_agent_by_id(agent_id)
+        if not agent:
+            raise HTTPException(status_code=404, detail="Agente não encontrado")
+
+        # Uma instância para o lote inteiro; fila própria para não disputar vagas com o tráfego interativo
+        record = agent_registry.get_record(agent_id) or {}
+        concurrency = min(request.concurrency or AGENT_BATCH_CONCURRENCY, AGENT_BATCH_CONCURRENCY)
+
+        async def call(message: str):
+            response_content, _, _ = await execute_agent(agent, message, agent_id, record, agent_key=f"batch:{agent_id}",
+                                                         lane_limit=AGENT_BATCH_CONCURRENCY)
+            return response_content
+
+        if format == "json":
+            batch = await run_batch(call, request.messages, concurrency)
+            return {"agent_id": agent_id, "session_id": request.session_id, "user_id": request.user_id, **batch}
+
+        async def lines():
+            started = time.perf_counter()
+            results = []
+            async for result in iter_batch(call, request.messages, concurrency):
+                results.append(result)
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+            summary = summarize(results, time.perf_counter() - started, concurrency)
+            yield json.dumps({"summary": summary}, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(lines(), media_type=MEDIA_TYPES["ndjson"], headers=STREAM_HEADERS)
+
+    @app.post("/agents/{agent_id}/run/stream", summary="Executar agente em streaming", tags=["Agentes"])
+    async def run_agent_stream(agent_id: str, request: AgentRunRequest, format: str = "sse",
+                               api_key: str = Depends(verify_api_key)):
+        """
+        Executa o agente enviando a resposta em pedaços (SSE ou NDJSON)
+
+        Eventos: start, delta ({"content"}) e done (mesmo corpo de /run + métricas)
+        ou error. A memória é salva quando a geração termina.
+        """
+        if format not in MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail="format deve ser 'sse' ou 'ndjson'")
+        agent = get_agent_by_id(agent_id)
+        if not agent:
+            raise HTTPException(status_code=404, detail="Agente não encontrado")
+        target = f"agent:{agent_id}"
+        account_id = (agent_registry.get_record(agent_id) or {}).get("account_id")
+        final: Dict[str, Any] = {}
+
+        def done_data(content: str, timing: Dict) -> Dict:
+            usage = run_usage(final.get("response"), fallback_model=model_name(agent))
+            usage_accountant.record(target, account_id, usage, total_ms=timing["total_ms"], run_ms=timing["total_ms"])
             return {
-                "messages": [response_content],
+                "messages": [content],
                 "transferir": False,
                 "session_id": request.session_id,
                 "user_id": request.user_id,
                 "agent_id": agent_id,
                 "custom": [],
-                "agent_usage": {
-                    "input_tokens": 0,
-                    "output_tokens": 0,
-                    "model": "gpt-4o-mini"
-                }
+                "agent_usage": usage_response(usage, timing["total_ms"], timing["total_ms"]),
+                "metrics": timing
             }
-        except HTTPException:
-            raise
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+
+        def persist(content: str):
+            save_agent_memory(request.user_id, [
+                {"role": "user", "content": request.message},
+                {"role": "assistant", "content": content}
+            ])
+
+        # Mesmas vagas e prazo de /run; a vaga fica ocupada até o fim do stream
+        chunks = agent_executor.iterate(iter_text(agent, request.message, final), agent_key=target,
+                                        account_key=account_id)
+        events = stream_run(
+            chunks, format, target,
+            {"agent_id": agent_id, "session_id": request.session_id, "user_id": request.user_id},
+            done_data, on_complete=persist, metrics=stream_metrics
+        )
+        return StreamingResponse(events, media_type=MEDIA_TYPES[format], headers=STREAM_HEADERS)
+
+    @app.get("/stats/streaming", tags=["Health"])
+    async def streaming_stats(target: Optional[str] = None, api_key: str = Depends(verify_api_key)):
+        """TTFT e duração total dos streams por agente/time (target = "agent:<id>" ou "team:<id>")"""
+        return stream_metrics.get_stats(target)
 
     # Endpoints CRUD para Teams
     @app.post("/teams", summary="Criar novo time", tags=["Times"])
@@ -617,12 +854,24 @@ def create_api_app() -> FastAPI:
     async def run_team_endpoint(team_id: str, request: TeamRunRequest2, api_key: str = Depends(verify_api_key)):
         """Executa um time específico com uma mensagem"""
         try:
-            team = get_team_by_id(team_id)
+            team = get_team_instance_by_id(team_id)
             if not team:
                 raise HTTPException(status_code=404, detail="Time não encontrado")
             
-            # Executa o time apenas com a mensagem
-            response = run_team(team_id, request.message)
+            # Executa o time apenas com a mensagem (fora do event loop)
+            target = f"team:{team_id}"
+            account_id = (teams_storage.get(team_id) or {}).get("account_id")
+            started = time.perf_counter()
+            try:
+                response, run_ms = await agent_executor.run(timed_run, team.run, request.message, agent_key=target,
+                                                            account_key=account_id)
+            except Exception:
+                usage_accountant.record(target, account_id, total_ms=(time.perf_counter() - started) * 1000, error=True)
+                raise
+            total_ms = (time.perf_counter() - started) * 1000
+            usage = run_usage(response, fallback_model=model_name(team))
+            usage_accountant.record(target, account_id, usage, total_ms=total_ms,
+                                    queue_ms=max(total_ms - run_ms, 0.0), run_ms=run_ms)
             
             # Extrai o conteúdo da resposta se for um objeto
             response_content = response.content if hasattr(response, 'content') else str(response)
@@ -634,17 +883,56 @@ def create_api_app() -> FastAPI:
                 "user_id": request.user_id,
                 "team_id": team_id,
                 "custom": [],
-                "team_usage": {
-                    "input_tokens": 0,
-                    "output_tokens": 0,
-                    "model": "gpt-4o-mini"
-                }
+                "team_usage": usage_response(usage, total_ms, run_ms)
             }
         except HTTPException:
             raise
+        except AgentBusyError as e:
+            raise HTTPException(status_code=429, detail=str(e))
+        except AgentDeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
     
+    @app.post("/teams/{team_id}/run/stream", summary="Executar time em streaming", tags=["Times"])
+    async def run_team_stream(team_id: str, request: TeamRunRequest2, format: str = "sse",
+                              api_key: str = Depends(verify_api_key)):
+        """Executa o time enviando a resposta em pedaços (SSE ou NDJSON); a memória do time é salva ao final"""
+        if format not in MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail="format deve ser 'sse' ou 'ndjson'")
+        team = get_team_instance_by_id(team_id)
+        if not team:
+            raise HTTPException(status_code=404, detail="Time não encontrado")
+        target = f"team:{team_id}"
+        account_id = (teams_storage.get(team_id) or {}).get("account_id")
+        final: Dict[str, Any] = {}
+
+        def done_data(content: str, timing: Dict) -> Dict:
+            usage = run_usage(final.get("response"), fallback_model=model_name(team))
+            usage_accountant.record(target, account_id, usage, total_ms=timing["total_ms"], run_ms=timing["total_ms"])
+            return {
+                "messages": [content],
+                "transferir": False,
+                "session_id": request.session_id,
+                "user_id": request.user_id,
+                "team_id": team_id,
+                "custom": [],
+                "team_usage": usage_response(usage, timing["total_ms"], timing["total_ms"]),
+                "metrics": timing
+            }
+
+        # Mesmas vagas e prazo de /run; a vaga fica ocupada até o fim do stream
+        chunks = agent_executor.iterate(iter_text(team, request.message, final), agent_key=target,
+                                        account_key=account_id)
+        events = stream_run(
+            chunks, format, target,
+            {"team_id": team_id, "session_id": request.session_id, "user_id": request.user_id},
+            done_data,
+            on_complete=lambda content: save_team_memory(team_id, request.user_id, request.message, content),
+            metrics=stream_metrics
+        )
+        return StreamingResponse(events, media_type=MEDIA_TYPES[format], headers=STREAM_HEADERS)
+    
     @app.get("/memory/search", summary="Buscar memórias", tags=["Memória"])
     async def search_memories(user_id: str = "default_user", query: str = "", limit: int = 5, api_key: str = Depends(verify_api_key)):
         """Busca memórias relevantes para o usuário"""
@@ -851,6 +1139,8 @@ def create_api_app() -> FastAPI:
                 setattr(knowledge, 'content', request.content)
             if request.metadata:
                 setattr(knowledge, 'metadata', request.metadata)
+            # Conteúdo alterado: respostas em cache dos agentes deixam de valer
+            knowledge_manager.version += 1
             
             return {
                 "message": "Base de conhecimento atualizada com sucesso",
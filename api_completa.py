@@ -6,16 +6,21 @@ Integra salvamento de mensagens e memórias contextuais usando a tabela message_
 
 import os
 import json
+import asyncio
 import uuid
 from datetime import datetime
 from typing import List, Dict, Any, Optional
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import httpx
-from supabase import create_client, Client
+from supabase_client import get_supabase_client, get_connection_stats, LOCAL_BACKEND, Client
 from dotenv import load_dotenv
 from dual_memory_optimized_service import DualMemoryOptimizedService
+from memory_stats import get_memory_statistics
+from memory_filters import decode_cursor
+from idempotency import idempotency_store, idempotency_key
 
 # Carrega variáveis de ambiente
 load_dotenv()
@@ -24,19 +29,27 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
+if not LOCAL_BACKEND and (not SUPABASE_URL or not SUPABASE_KEY):
     raise ValueError("SUPABASE_URL e SUPABASE_KEY devem estar definidas no arquivo .env")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase: Client = get_supabase_client(SUPABASE_URL, SUPABASE_KEY)
 
 # Inicializar o serviço de memória dual otimizado
 dual_memory_service = DualMemoryOptimizedService()
 
+# Persistência e enriquecimento rodam após a resposta; este limite evita que
+# rajadas de mensagens abram um número ilimitado de chamadas ao Supabase
+BACKGROUND_MAX_CONCURRENCY = int(os.getenv("BACKGROUND_MAX_CONCURRENCY", "8"))
+background_semaphore = asyncio.Semaphore(BACKGROUND_MAX_CONCURRENCY)
+background_stats = {"scheduled": 0, "running": 0, "completed": 0, "failed": 0}
+
 # Funções para integração com o serviço de memória dual otimizado
+# (o cliente Supabase é síncrono: as chamadas rodam em threads para não bloquear o event loop)
 async def save_conversation(user_id: str, session_id: str, agent_id: str, user_message: str, agent_response: str) -> Dict[str, Any]:
     """Salva uma conversa completa na tabela mensagens_ia"""
     try:
-        result = dual_memory_service.save_chat_message(
+        result = await asyncio.to_thread(
+            dual_memory_service.save_chat_message,
             user_id=user_id,
             session_id=session_id,
             agent_id=agent_id,
@@ -54,7 +67,8 @@ async def save_conversation(user_id: str, session_id: str, agent_id: str, user_m
 async def create_enriched_memory(user_id: str, session_id: str, content: str, metadata: Dict[str, Any] = None) -> Dict[str, Any]:
     """Cria uma memória enriquecida na tabela message_history"""
     try:
-        result = dual_memory_service.create_enriched_memory(
+        result = await asyncio.to_thread(
+            dual_memory_service.create_enriched_memory,
             user_id=user_id,
             session_id=session_id,
             content=content,
@@ -71,7 +85,8 @@ async def create_enriched_memory(user_id: str, session_id: str, content: str, me
 async def list_enriched_memories(user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
     """Lista memórias enriquecidas do usuário"""
     try:
-        memories = dual_memory_service.search_enriched_memories(
+        memories = await asyncio.to_thread(
+            dual_memory_service.search_enriched_memories,
             user_id=user_id,
             limit=limit
         )
@@ -83,14 +98,30 @@ async def list_enriched_memories(user_id: str, limit: int = 10) -> List[Dict[str
         print(f"Erro ao listar memórias enriquecidas: {e}")
         return []
 
-async def auto_enrich_conversation(user_id: str, session_id: str, user_message: str, agent_response: str):
+async def get_conversation_history(session_id: str, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """Histórico recente da sessão (mensagens_ia), mais recentes primeiro"""
+    try:
+        return await asyncio.to_thread(
+            dual_memory_service.get_chat_history,
+            user_id=user_id,
+            session_id=session_id,
+            limit=limit
+        )
+    except Exception as e:
+        print(f"Erro ao buscar histórico da sessão: {e}")
+        return []
+
+async def auto_enrich_conversation(user_id: str, session_id: str, user_message: str, agent_response: str,
+                                   account_id: Optional[str] = None):
     """Enriquece automaticamente a conversa criando uma síntese concisa"""
     try:
-        memories = dual_memory_service.auto_enrich_conversation(
+        memories = await asyncio.to_thread(
+            dual_memory_service.auto_enrich_conversation,
             user_id=user_id,
             session_id=session_id,
             user_message=user_message,
-            agent_response=agent_response
+            agent_response=agent_response,
+            account_id=account_id
         )
         
         print(f"✅ Criadas {len(memories)} memórias enriquecidas automaticamente")
@@ -100,6 +131,34 @@ async def auto_enrich_conversation(user_id: str, session_id: str, user_message:
         print(f"Erro no enriquecimento automático: {e}")
         return {"status": "error", "error": str(e)}
 
+async def persist_interaction(user_id: str, session_id: str, agent_id: str, user_message: str,
+                              agent_response: str, account_id: Optional[str] = None):
+    """Salva a conversa e a enriquece (executado em background após a resposta)"""
+    async with background_semaphore:
+        background_stats["running"] += 1
+        try:
+            saved = await save_conversation(
+                user_id=user_id,
+                session_id=session_id,
+                agent_id=agent_id,
+                user_message=user_message,
+                agent_response=agent_response
+            )
+            enriched = await auto_enrich_conversation(
+                user_id=user_id,
+                session_id=session_id,
+                user_message=user_message,
+                agent_response=agent_response,
+                account_id=account_id
+            )
+            failed = saved.get("status") == "error" or enriched.get("status") == "error"
+            background_stats["failed" if failed else "completed"] += 1
+        except Exception as e:
+            background_stats["failed"] += 1
+            print(f"❌ Erro ao persistir interação em background: {e}")
+        finally:
+            background_stats["running"] -= 1
+
 # Modelos Pydantic
 class MessageInput(BaseModel):
     mensagem: str
@@ -111,6 +170,17 @@ class MessageInput(BaseModel):
     user_id: str
     id_conta: str
 
+class MessageResult(BaseModel):
+    """Resultado de cada mensagem da lista, na ordem recebida"""
+    message_id: str
+    session_id: str
+    user_id: str
+    agent_id: str
+    messages: List[str] = []
+    merged: bool = False  # True quando a mensagem foi respondida junto com outra posterior da mesma sessão
+    error: Optional[str] = None
+    agent_usage: Dict[str, Any] = {}
+
 class MessageOutput(BaseModel):
     messages: List[str]
     transferir: bool = False
@@ -119,6 +189,7 @@ class MessageOutput(BaseModel):
     agent_id: str
     custom: List[Dict[str, str]] = []
     agent_usage: Dict[str, Any] = {}
+    results: List[MessageResult] = []
 
 class MemoryRequest(BaseModel):
     user_id: str
@@ -178,79 +249,154 @@ def simulate_agent_response(message: str, context: Dict[str, Any]) -> Dict[str,
         }
     }
 
+CHAT_BATCH_MAX_CONCURRENCY = int(os.getenv("CHAT_BATCH_MAX_CONCURRENCY", "8"))
+
+def group_messages(messages: List[MessageInput]) -> List[List[int]]:
+    """
+    Agrupa os índices das mensagens por (user_id, agent_id, session_id)
+    
+    Os grupos seguem a ordem da primeira mensagem de cada um; mensagens sem
+    session_id do mesmo usuário e agente compartilham uma nova sessão.
+    """
+    groups: Dict[tuple, List[int]] = {}
+    for index, msg in enumerate(messages):
+        groups.setdefault((msg.user_id, msg.agent_id, msg.session_id or None), []).append(index)
+    return list(groups.values())
+
+async def process_turn(items: List[MessageInput], background_tasks: BackgroundTasks) -> Dict[str, Any]:
+    """Gera uma resposta do agente para as mensagens de uma mesma sessão (um único turno)"""
+    first = items[0]
+    user_message = "\n".join(msg.mensagem for msg in items)
+    
+    print(f"🔄 Processando {len(items)} mensagem(ns) para user_id: {first.user_id}, agent_id: {first.agent_id}")
+    
+    # 1. Buscar memórias enriquecidas e histórico da sessão em paralelo
+    memories, history = await asyncio.gather(
+        list_enriched_memories(first.user_id, limit=5),
+        get_conversation_history(first.session_id, first.user_id, limit=10)
+    )
+    
+    # 2. Preparar contexto para o agente
+    context = {
+        "memories": memories,
+        "history": history,
+        "user_id": first.user_id,
+        "agent_id": first.agent_id,
+        "session_id": first.session_id
+    }
+    
+    # 3. Gerar resposta do agente
+    agent_result = simulate_agent_response(user_message, context)
+    response_text = agent_result["response"]
+    usage_info = agent_result["usage"]
+    
+    # 4. Salvar conversa (mensagens_ia) e enriquecer (message_history) após a resposta
+    background_stats["scheduled"] += 1
+    background_tasks.add_task(
+        persist_interaction,
+        user_id=first.user_id,
+        session_id=first.session_id,
+        agent_id=first.agent_id,
+        user_message=user_message,
+        agent_response=response_text,
+        account_id=first.id_conta
+    )
+    
+    return {
+        "messages": [response_text],
+        "agent_usage": {
+            "input_tokens": usage_info["input_tokens"],
+            "output_tokens": usage_info["output_tokens"],
+            "model": usage_info["model"]
+        }
+    }
+
 @app.post("/v1/chat", response_model=MessageOutput)
-async def process_message(request: List[MessageInput]):
-    """Processa mensagem com sistema de memórias enriquecidas"""
+async def process_message(request: List[MessageInput], background_tasks: BackgroundTasks):
+    """
+    Processa a lista de mensagens com sistema de memórias enriquecidas
+    
+    Mensagens da mesma sessão (usuário + agente + session_id) viram um único
+    turno do agente; sessões diferentes são processadas em paralelo. Os
+    campos de topo descrevem a sessão da primeira mensagem e `results` traz
+    o resultado de cada mensagem na ordem recebida.
+    """
     try:
         if not request or len(request) == 0:
             raise HTTPException(status_code=400, detail="Lista de mensagens vazia")
         
-        # Pegar primeira mensagem
-        msg_input = request[0]
-        
-        # Gerar session_id se não fornecido
-        if not msg_input.session_id:
-            msg_input.session_id = str(uuid.uuid4())
-        
-        # Gerar message_id se não fornecido
-        if not msg_input.message_id:
-            msg_input.message_id = str(uuid.uuid4())
+        groups = group_messages(request)
+        # Cada message_id do turno fica registrado com o resultado do turno: um reenvio de
+        # qualquer uma das mensagens (sozinha ou agrupada de outro jeito) recebe o mesmo turno
+        turn_keys = [
+            [idempotency_key("chat", request[i].message_id, request[i].id_conta, request[i].agent_id)
+             for i in indexes if request[i].message_id]
+            for indexes in groups
+        ]
+        for indexes in groups:
+            # Gerar session_id se não fornecido (um por grupo)
+            session_id = request[indexes[0]].session_id or str(uuid.uuid4())
+            for index in indexes:
+                request[index].session_id = session_id
+                # Gerar message_id se não fornecido
+                if not request[index].message_id:
+                    request[index].message_id = str(uuid.uuid4())
         
-        print(f"🔄 Processando mensagem para user_id: {msg_input.user_id}, agent_id: {msg_input.agent_id}")
+        semaphore = asyncio.Semaphore(CHAT_BATCH_MAX_CONCURRENCY)
         
-        # 1. Buscar memórias enriquecidas relevantes
-        memories = await list_enriched_memories(msg_input.user_id, limit=5)
+        async def run_group(indexes: List[int], turn_keys: List[str]) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    # Reenvios do gateway aguardam/recebem o turno já processado (sem nova gravação/enriquecimento)
+                    turn, _ = await idempotency_store.run_many(
+                        turn_keys, lambda: process_turn([request[i] for i in indexes], background_tasks))
+                    return turn
+                except Exception as e:
+                    print(f"❌ Erro ao processar sessão {request[indexes[0]].session_id}: {e}")
+                    return {"error": str(e)}
         
-        # 2. Preparar contexto para o agente
-        context = {
-            "memories": memories,
-            "user_id": msg_input.user_id,
-            "agent_id": msg_input.agent_id,
-            "session_id": msg_input.session_id
-        }
+        turns = await asyncio.gather(*(run_group(indexes, keys) for indexes, keys in zip(groups, turn_keys)))
+        if all("error" in turn for turn in turns):
+            raise HTTPException(status_code=500, detail=f"Erro interno: {turns[0]['error']}")
         
-        # 3. Gerar resposta do agente
-        agent_result = simulate_agent_response(msg_input.mensagem, context)
-        response_text = agent_result["response"]
-        usage_info = agent_result["usage"]
+        # A resposta de cada turno vai para a última mensagem do grupo
+        results: List[Optional[MessageResult]] = [None] * len(request)
+        for indexes, turn in zip(groups, turns):
+            for index in indexes:
+                msg = request[index]
+                last = index == indexes[-1]
+                results[index] = MessageResult(
+                    message_id=msg.message_id,
+                    session_id=msg.session_id,
+                    user_id=msg.user_id,
+                    agent_id=msg.agent_id,
+                    messages=turn.get("messages", []) if last else [],
+                    merged=not last,
+                    error=turn.get("error"),
+                    agent_usage=turn.get("agent_usage", {}) if last else {}
+                )
         
-        # 4. Salvar conversa completa na tabela mensagens_ia
-        await save_conversation(
-            user_id=msg_input.user_id,
-            session_id=msg_input.session_id,
-            agent_id=msg_input.agent_id,
-            user_message=msg_input.mensagem,
-            agent_response=response_text
-        )
-        
-        # 5. Enriquecer automaticamente a conversa
-        await auto_enrich_conversation(
-            user_id=msg_input.user_id,
-            session_id=msg_input.session_id,
-            user_message=msg_input.mensagem,
-            agent_response=response_text
-        )
-        
-        # 8. Preparar resposta
+        # Campos de topo: sessão da primeira mensagem (ou a primeira processada com sucesso)
+        main_group, main_turn = next((g, t) for g, t in zip(groups, turns) if "error" not in t)
+        main_msg = request[main_group[0]]
         response = MessageOutput(
-            messages=[response_text],
+            messages=main_turn["messages"],
             transferir=False,
-            session_id=msg_input.session_id,
-            user_id=msg_input.user_id,
-            agent_id=msg_input.agent_id,
+            session_id=main_msg.session_id,
+            user_id=main_msg.user_id,
+            agent_id=main_msg.agent_id,
             custom=[
                 {"campo": "pdf", "valor": "catalogo_doces"}
             ],
-            agent_usage={
-                "input_tokens": usage_info["input_tokens"],
-                "output_tokens": usage_info["output_tokens"],
-                "model": usage_info["model"]
-            }
+            agent_usage=main_turn["agent_usage"],
+            results=results
         )
         
-        print(f"✅ Resposta gerada com contexto enriquecido")
+        print(f"✅ {len(request)} mensagem(ns) respondida(s) em {len(groups)} turno(s) com contexto enriquecido")
         return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Erro ao processar mensagem: {e}")
         raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
@@ -273,23 +419,76 @@ async def create_memory_endpoint(request: MemoryRequest):
         raise HTTPException(status_code=500, detail=f"Erro ao criar memória: {str(e)}")
 
 @app.get("/v1/memory/list/{user_id}")
-async def list_memories_endpoint(user_id: str, limit: int = 10):
-    """Endpoint para listar memórias enriquecidas"""
+async def list_memories_endpoint(user_id: str, limit: int = 10, cursor: Optional[str] = None,
+                                 agent_id: Optional[str] = None, memory_type: Optional[str] = None):
+    """
+    Endpoint para listar memórias enriquecidas (mais recentes primeiro)
+    
+    Para a próxima página, envie o next_cursor retornado; null indica a última página.
+    """
     try:
-        result = await list_enriched_memories(user_id=user_id, limit=limit)
-        return {"memories": result, "total": len(result)}
+        page = await asyncio.to_thread(
+            dual_memory_service.list_enriched_memories_page,
+            user_id=user_id,
+            cursor=cursor,
+            limit=max(1, min(limit, 1000)),
+            memory_type=memory_type,
+            agent_id=agent_id
+        )
+        return {"memories": page["memories"], "total": len(page["memories"]), "next_cursor": page["next_cursor"]}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao listar memórias: {str(e)}")
 
+@app.get("/v1/memory/export/{user_id}")
+async def export_memories_endpoint(user_id: str, agent_id: Optional[str] = None,
+                                   memory_type: Optional[str] = None, cursor: Optional[str] = None,
+                                   page_size: int = 500):
+    """
+    Exporta todas as memórias enriquecidas do usuário em NDJSON (uma por linha)
+    
+    A resposta é enviada em streaming, página a página, com memória constante.
+    Se a exportação falhar no meio, a última linha traz {"error": ...}.
+    """
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    def lines():
+        try:
+            for memory in dual_memory_service.iter_enriched_memories(
+                user_id=user_id,
+                memory_type=memory_type,
+                agent_id=agent_id,
+                page_size=max(1, min(page_size, 5000)),
+                cursor=cursor
+            ):
+                yield json.dumps(memory, ensure_ascii=False, default=str) + "\n"
+        except Exception as e:
+            print(f"❌ Erro na exportação de memórias de {user_id}: {e}")
+            yield json.dumps({"error": str(e)}, ensure_ascii=False) + "\n"
+    
+    # Iteradores síncronos são consumidos em thread pelo StreamingResponse
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @app.get("/v1/memory/stats/{user_id}")
-async def get_memory_stats(user_id: str, agent_id: Optional[str] = None):
-    """Endpoint para obter estatísticas de memórias enriquecidas"""
+async def get_memory_stats(user_id: str, agent_id: Optional[str] = None, memory_type: Optional[str] = None):
+    """Endpoint para obter estatísticas de memórias enriquecidas (contadores mantidos pelo banco)"""
     try:
-        memories = await list_enriched_memories(user_id=user_id, limit=100)
+        stats = await asyncio.to_thread(
+            get_memory_statistics,
+            dual_memory_service.supabase,
+            user_id,
+            agent_id=agent_id,
+            memory_type=memory_type
+        )
         return {
             "user_id": user_id,
-            "total_memories": len(memories),
             "agent_id": agent_id,
+            **stats,
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
@@ -312,7 +511,7 @@ async def get_user_conversations(user_id: str, limit: int = 20):
 async def get_session_history(session_id: str, user_id: str, limit: int = 20):
     """Endpoint para obter histórico de uma sessão"""
     try:
-        history = get_conversation_history(session_id, user_id, limit)
+        history = await get_conversation_history(session_id, user_id, limit)
         return {
             "session_id": session_id,
             "user_id": user_id,
@@ -322,6 +521,46 @@ async def get_session_history(session_id: str, user_id: str, limit: int = 20):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao obter histórico: {str(e)}")
 
+@app.post("/v1/messages/bulk")
+async def bulk_ingest_messages(request: Request, chunk_size: Optional[int] = None,
+                               max_concurrency: Optional[int] = None):
+    """
+    Ingestão em lote de conversas na tabela mensagens_ia
+    
+    Aceita um array JSON (ou {"messages": [...]}) ou, com Content-Type
+    application/x-ndjson, um objeto por linha enviado em streaming.
+    """
+    try:
+        ingestor = dual_memory_service.chat_bulk_ingestor(chunk_size, max_concurrency)
+        content_type = request.headers.get("content-type", "")
+        if "ndjson" in content_type or "jsonlines" in content_type:
+            return await ingestor.ingest_ndjson_stream(request.stream())
+        
+        body = await request.json()
+        messages = body.get("messages", []) if isinstance(body, dict) else body
+        if not isinstance(messages, list):
+            raise HTTPException(status_code=400, detail="Envie uma lista de mensagens")
+        return await asyncio.to_thread(ingestor.ingest, messages)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro na ingestão em lote: {str(e)}")
+
+@app.get("/v1/stats/connections")
+async def connection_stats_endpoint():
+    """Estatísticas do pool HTTP compartilhado com o Supabase (reutilização de conexões)"""
+    return get_connection_stats()
+
+@app.get("/v1/stats/background")
+async def background_stats_endpoint():
+    """Tarefas de persistência/enriquecimento executadas após as respostas do /v1/chat"""
+    return {
+        **background_stats,
+        "waiting": background_stats["scheduled"] - background_stats["running"]
+                   - background_stats["completed"] - background_stats["failed"],
+        "max_concurrency": BACKGROUND_MAX_CONCURRENCY
+    }
+
 @app.get("/health")
 async def health_check():
     """Endpoint de verificação de saúde da arquitetura dual"""
@@ -361,8 +600,11 @@ async def root():
             "chat": "/v1/chat",
             "create_memory": "/v1/memory/create",
             "list_memories": "/v1/memory/list",
+            "export_memories": "/v1/memory/export/{user_id}",
             "memory_stats": "/v1/memory/stats/{user_id}",
             "session_history": "/v1/history/{session_id}",
+            "bulk_messages": "/v1/messages/bulk",
+            "background_stats": "/v1/stats/background",
             "health": "/health"
         },
         "features": [
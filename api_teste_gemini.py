@@ -5,6 +5,7 @@ Roda na porta 8000 especificamente para testes
 """
 
 import os
+import asyncio
 import uvicorn
 from fastapi import FastAPI, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
@@ -13,6 +14,10 @@ from typing import List, Optional, Dict, Any
 import uuid
 from datetime import datetime
 import json
+import time
+from debounce_scheduler import DebounceScheduler
+from model_clients import model_clients
+from usage_accounting import usage_accountant, run_usage, timed_run
 
 # Configurar variáveis de ambiente
 os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY", "your-openai-api-key-here")
@@ -62,7 +67,7 @@ class ChatMessage(BaseModel):
     user_id: str = ""
     session_id: str = ""
     message_id: str = ""
-    debounce: int = 1000
+    debounce: int = 0
     cliente_id: str = ""
     id_conta: str = ""
 
@@ -75,18 +80,12 @@ def verify_api_key(x_api_key: str = Header(None)):
 def create_model(model_name: str = "google/gemini-pro"):
     """Cria um modelo usando OpenRouterModel"""
     try:
-        return OpenRouterModel(
-            model_id=model_name,
-            api_key=os.getenv("OPENAI_API_KEY"),
-            base_url="https://api.openai.com/v1"
-        )
+        return model_clients.create_model(OpenRouterModel, "openai", model_name,
+                                          os.getenv("OPENAI_API_KEY"), "https://api.openai.com/v1")
     except Exception as e:
         print(f"Erro ao criar modelo {model_name}: {e}")
-        return OpenRouterModel(
-            model_id="gpt-4o-mini",
-            api_key=os.getenv("OPENAI_API_KEY"),
-            base_url="https://api.openai.com/v1"
-        )
+        return model_clients.create_model(OpenRouterModel, "openai", "gpt-4o-mini",
+                                          os.getenv("OPENAI_API_KEY"), "https://api.openai.com/v1")
 
 @app.get("/health")
 async def health_check():
@@ -148,40 +147,70 @@ async def list_agents(api_key: str = Depends(verify_api_key)):
     
     return {"agents": agents_list}
 
+async def run_chat_turn(key: tuple, batches: List[List[ChatMessage]]) -> Dict[str, Any]:
+    """Executa um turno do agente para as mensagens agrupadas de uma sessão"""
+    messages = [message for batch in batches for message in batch]
+    message = messages[0]
+    mensagem = "\n".join(m.mensagem for m in messages)
+    
+    # Verificar se agente existe
+    if message.agent_id not in agents_storage:
+        raise HTTPException(status_code=404, detail="Agente não encontrado")
+    
+    agent_info = agents_storage[message.agent_id]
+    agent = agent_info["agent_instance"]
+    
+    # Executar chat (fora do event loop, para não atrasar os prazos de debounce)
+    started = time.perf_counter()
+    response, run_ms = await asyncio.to_thread(timed_run, agent.run, mensagem)
+    total_ms = (time.perf_counter() - started) * 1000
+    
+    # Tokens informados pelo provedor nas métricas da execução
+    usage = run_usage(response, fallback_model=agent_info["model"])
+    usage_accountant.record(f"agent:{message.agent_id}", None, usage, total_ms=total_ms,
+                            queue_ms=max(total_ms - run_ms, 0.0), run_ms=run_ms)
+    
+    return {
+        "messages": [str(response)],
+        "transferir": False,
+        "session_id": message.session_id,
+        "user_id": message.user_id,
+        "agent_id": message.agent_id,
+        "custom": [],
+        "agent_usage": usage,
+        "debounced_messages": len(messages)
+    }
+
+# Requisições da mesma sessão dentro da janela de debounce viram um único turno
+chat_debouncer = DebounceScheduler(run_chat_turn)
+
 @app.post("/chat")
 async def chat_endpoint(messages: List[ChatMessage], api_key: str = Depends(verify_api_key)):
-    """Endpoint de chat com agentes"""
+    """
+    Endpoint de chat com agentes
+    
+    Todas as mensagens da lista e as requisições seguintes da mesma sessão
+    dentro da janela de debounce (ms) são respondidas em um único turno; as
+    requisições anteriores do grupo retornam messages vazio com debounced=True.
+    """
     try:
         if not messages:
             raise HTTPException(status_code=400, detail="Nenhuma mensagem fornecida")
         
-        message = messages[0]  # Pegar primeira mensagem
-        
-        # Verificar se agente existe
-        if message.agent_id not in agents_storage:
-            raise HTTPException(status_code=404, detail="Agente não encontrado")
-        
-        agent_info = agents_storage[message.agent_id]
-        agent = agent_info["agent_instance"]
-        
-        # Executar chat
-        response = agent.run(message.mensagem)
-        
-        # Simular usage (já que não temos acesso aos tokens reais)
-        usage = {
-            "input_tokens": len(message.mensagem.split()),
-            "output_tokens": len(str(response).split()),
-            "model": agent_info["model"]
-        }
-        
+        message = messages[0]
+        key = (message.agent_id, message.user_id, message.session_id)
+        result, is_last = await chat_debouncer.submit(key, messages, message.debounce)
+        if is_last:
+            return result
         return {
-            "messages": [str(response)],
+            "messages": [],
             "transferir": False,
             "session_id": message.session_id,
             "user_id": message.user_id,
             "agent_id": message.agent_id,
             "custom": [],
-            "agent_usage": usage
+            "agent_usage": {},
+            "debounced": True
         }
         
     except HTTPException:
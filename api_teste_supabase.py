@@ -6,16 +6,19 @@ Baseada na api_teste_gemini.py mas conecta ao Supabase real
 
 import os
 import uuid
+import asyncio
 import time
 from datetime import datetime
 from typing import Dict, List, Optional, Any
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 
 # Importa o serviço do Supabase
 from supabase_service import SupabaseService
+from debounce_scheduler import DebounceScheduler
+from idempotency import idempotency_store, idempotency_key, IdempotencyInProgress
 
 # Carrega variáveis de ambiente
 load_dotenv()
@@ -201,59 +204,138 @@ async def chat_with_agent(request: ChatMessage, api_key: str = Depends(verify_ap
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro no chat: {str(e)}")
 
+async def run_message_turn(key: tuple, requests: List[MessageRequest]) -> Dict[str, Any]:
+    """Executa um turno do agente para as mensagens agrupadas de uma sessão"""
+    first = requests[0]
+    mensagem = "\n".join(req.mensagem for req in requests)
+    
+    # Busca o agente no Supabase (fora do event loop, para não atrasar os prazos de debounce)
+    agent = await asyncio.to_thread(supabase_service.get_agent, first.agent_id)
+    if not agent:
+        raise HTTPException(status_code=404, detail="Agente não encontrado")
+    
+    # Cria modelo mock
+    model = create_model(agent.get("model", "gemini-2.5-flash"))
+    
+    # Gera resposta
+    response = await asyncio.to_thread(model.run, mensagem)
+    
+    # Simula usage
+    usage = {
+        "input_tokens": len(mensagem.split()),
+        "output_tokens": len(response.split()),
+        "model": agent.get("model", "gemini-2.5-flash")
+    }
+    
+    # Gera session_id se não fornecido
+    session_id = first.session_id or str(uuid.uuid4())
+    
+    # Salva mensagem no Supabase (se disponível)
+    try:
+        await asyncio.to_thread(
+            supabase_service.save_message,
+            user_id=first.user_id,
+            session_id=session_id,
+            agent_id=first.agent_id,
+            message=mensagem,
+            response=response
+        )
+    except Exception as e:
+        print(f"Aviso: Não foi possível salvar mensagem: {e}")
+    
+    return {
+        "messages": [response],
+        "transferir": False,
+        "session_id": session_id,
+        "user_id": first.user_id,
+        "agent_id": first.agent_id,
+        "custom": [],
+        "agent_usage": usage,
+        "debounced_messages": len(requests)
+    }
+
+# Mensagens da mesma sessão dentro da janela de debounce viram um único turno
+message_debouncer = DebounceScheduler(run_message_turn)
+
 @app.post("/v1/messages")
 async def send_message_to_agent(request: MessageRequest, api_key: str = Depends(verify_api_key)):
-    """Endpoint compatível com o formato da API completa"""
-    try:
-        # Busca o agente no Supabase
-        agent = supabase_service.get_agent(request.agent_id)
-        if not agent:
-            raise HTTPException(status_code=404, detail="Agente não encontrado")
-        
-        # Cria modelo mock
-        model = create_model(agent.get("model", "gemini-2.5-flash"))
-        
-        # Gera resposta
-        response = model.run(request.mensagem)
-        
-        # Simula usage
-        usage = {
-            "input_tokens": len(request.mensagem.split()),
-            "output_tokens": len(response.split()),
-            "model": agent.get("model", "gemini-2.5-flash")
-        }
-        
-        # Gera session_id se não fornecido
-        session_id = request.session_id or str(uuid.uuid4())
-        
-        # Salva mensagem no Supabase (se disponível)
-        try:
-            supabase_service.save_message(
-                agent_id=request.agent_id,
-                user_id=request.user_id,
-                session_id=session_id,
-                user_message=request.mensagem,
-                agent_response=response,
-                usage=usage
-            )
-        except Exception as e:
-            print(f"Aviso: Não foi possível salvar mensagem: {e}")
-        
+    """
+    Endpoint compatível com o formato da API completa
+    
+    Com debounce > 0 (ms), a mensagem aguarda a janela da sessão: a última
+    mensagem do grupo recebe a resposta e as anteriores retornam
+    messages vazio com debounced=True. Reenvios com o mesmo message_id
+    recebem a resposta da primeira execução, sem nova chamada ao agente.
+    """
+    async def process():
+        key = (request.agent_id, request.user_id, request.session_id or "")
+        result, is_last = await message_debouncer.submit(key, request, request.debounce)
+        if is_last:
+            return result
         return {
-            "messages": [response],
+            "messages": [],
             "transferir": False,
-            "session_id": session_id,
+            "session_id": result["session_id"],
             "user_id": request.user_id,
             "agent_id": request.agent_id,
             "custom": [],
-            "agent_usage": usage
+            "agent_usage": {},
+            "debounced": True
         }
+    
+    try:
+        response, _ = await idempotency_store.run(
+            idempotency_key("messages", request.message_id, request.id_conta, request.agent_id), process)
+        return response
         
     except HTTPException:
         raise
+    except IdempotencyInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro no processamento: {str(e)}")
 
+@app.get("/v1/debounce/stats")
+async def debounce_stats(api_key: str = Depends(verify_api_key)):
+    """Métricas do debounce de /v1/messages (mensagens agrupadas e turnos executados)"""
+    return message_debouncer.get_stats()
+
+@app.get("/v1/idempotency/stats")
+async def idempotency_stats(api_key: str = Depends(verify_api_key)):
+    """Mensagens executadas e reenvios atendidos com a resposta guardada (por message_id)"""
+    return idempotency_store.get_stats()
+
+@app.post("/v1/messages/bulk")
+async def bulk_ingest_messages(request: Request, chunk_size: Optional[int] = None,
+                               max_concurrency: Optional[int] = None,
+                               api_key: str = Depends(verify_api_key)):
+    """
+    Ingestão em lote de mensagens (migrações, replays, webhooks com várias mensagens)
+    
+    Aceita um array JSON (ou {"messages": [...]}) ou, com Content-Type
+    application/x-ndjson, um objeto por linha enviado em streaming.
+    """
+    try:
+        ingestor = supabase_service.messages_bulk_ingestor(chunk_size, max_concurrency)
+        content_type = request.headers.get("content-type", "")
+        if "ndjson" in content_type or "jsonlines" in content_type:
+            return await ingestor.ingest_ndjson_stream(request.stream())
+        
+        body = await request.json()
+        messages = body.get("messages", []) if isinstance(body, dict) else body
+        if not isinstance(messages, list):
+            raise HTTPException(status_code=400, detail="Envie uma lista de mensagens")
+        return await asyncio.to_thread(ingestor.ingest, messages)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro na ingestão em lote: {str(e)}")
+
+@app.get("/v1/cache/agents/stats")
+async def agent_cache_stats(api_key: str = Depends(verify_api_key)):
+    """Métricas do cache de configurações de agentes"""
+    return supabase_service.agent_cache.get_stats()
+
 @app.get("/agents/{agent_id}")
 async def get_agent(agent_id: str, api_key: str = Depends(verify_api_key)):
     """Busca um agente específico no Supabase"""
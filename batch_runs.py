@@ -0,0 +1,76 @@
+"""
+Execução em lote de mensagens independentes em um agente
+Jobs offline (qualificação de leads, regressão de FAQ) enviavam uma
+requisição por mensagem. Aqui o lote usa uma única instância do agente (e os
+clientes de modelo já aquecidos) e roda as mensagens com paralelismo
+limitado, devolvendo os resultados na ordem de entrada ou conforme terminam.
+"""
+import asyncio
+import os
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+# Mensagens por lote e execuções simultâneas de um mesmo agente em lotes
+AGENT_BATCH_MAX_ITEMS = int(os.getenv("AGENT_BATCH_MAX_ITEMS", "500"))
+AGENT_BATCH_CONCURRENCY = int(os.getenv("AGENT_BATCH_CONCURRENCY", "8"))
+
+
+def _content(response: Any) -> str:
+    return response.content if hasattr(response, "content") else str(response)
+
+
+async def iter_batch(call: Callable[[str], Awaitable[Any]], messages: List[str],
+                     concurrency: int = AGENT_BATCH_CONCURRENCY) -> AsyncIterator[Dict]:
+    """
+    Executa call(mensagem) para cada mensagem, até concurrency de cada vez
+
+    Produz um resultado por mensagem, na ordem em que terminam:
+    {"index", "response"} ou {"index", "error"}, com latency_ms.
+    Falhas de uma mensagem não interrompem as demais.
+    """
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def run_one(index: int, message: str) -> Dict:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                result = {"index": index, "response": _content(await call(message))}
+            except Exception as e:
+                result = {"index": index, "error": str(e) or type(e).__name__}
+            result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            return result
+
+    tasks = [asyncio.ensure_future(run_one(i, message)) for i, message in enumerate(messages)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Cliente desconectou no meio do stream: as mensagens ainda na fila não são executadas
+        for task in tasks:
+            task.cancel()
+
+
+def summarize(results: List[Dict], elapsed_s: float, concurrency: int) -> Dict:
+    """Vazão agregada do lote (mensagens/s, latências, falhas)"""
+    latencies = sorted(r["latency_ms"] for r in results)
+    failed = sum(1 for r in results if "error" in r)
+    return {
+        "total": len(results),
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "concurrency": concurrency,
+        "elapsed_ms": round(elapsed_s * 1000, 1),
+        "throughput_per_s": round(len(results) / elapsed_s, 2) if elapsed_s > 0 else None,
+        "avg_latency_ms": round(sum(latencies) / len(latencies), 1) if latencies else None,
+        "p95_latency_ms": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] if latencies else None,
+    }
+
+
+async def run_batch(call: Callable[[str], Awaitable[Any]], messages: List[str],
+                    concurrency: int = AGENT_BATCH_CONCURRENCY) -> Dict:
+    """Executa o lote inteiro e devolve os resultados na ordem de entrada + resumo"""
+    started = time.perf_counter()
+    results: List[Optional[Dict]] = [None] * len(messages)
+    async for result in iter_batch(call, messages, concurrency):
+        results[result["index"]] = result
+    return {"results": results, "summary": summarize(results, time.perf_counter() - started, concurrency)}
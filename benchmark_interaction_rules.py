@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Benchmark das regras de síntese de interações
+Compara a implementação anterior (cadeias de any(palavra in texto) e regex
+recompilada a cada chamada) com o InteractionRuleSet compilado, verificando
+que as sínteses e tópicos produzidos são idênticos, e mede como o custo
+cresce com o número de palavras-chave de um conjunto de regras por conta
+"""
+import random
+import re
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from interaction_rules import DEFAULT_RULES, InteractionRuleSet
+
+USER_PHRASES = [
+    "Qual o horário de funcionamento?", "Quanto custa a consulta?", "Vocês têm plano nutricional?",
+    "Qual o telefone para contato?", "Quero agendar uma consulta", "Oi", "Tudo bem?",
+    "Vocês atendem no sábado?", "O serviço está disponível online?", "Preciso falar com alguém",
+    "Gostaria de saber mais sobre a clínica e o atendimento", "Qual o valor do retorno?",
+]
+AGENT_PHRASES = [
+    "Funcionamos de segunda a sexta, das 8h às 18h.", "A consulta custa 150 reais e o retorno 80 reais.",
+    "Sim, temos plano nutricional completo.", "Não temos atendimento aos sábados.",
+    "Nosso whatsapp é (11) 99999-0000.", "Você pode agendar pelo site ou marcar por telefone.",
+    "Olá! Como posso ajudar você hoje? Estamos à disposição para tirar dúvidas.",
+    "O serviço está indisponível no momento.", "Ok.", "O pacote sai por 1,5 mil com desconto.",
+    "Trabalhamos com nutrição esportiva, clínica e comportamental para todas as idades.",
+]
+
+
+# ==================== IMPLEMENTAÇÃO ANTERIOR ====================
+
+def legacy_key_info(agent_response: str) -> Optional[str]:
+    response_lower = agent_response.lower()
+    if any(word in response_lower for word in ["funciona", "horário", "segunda", "sexta", "8h", "18h"]):
+        if "segunda a sexta" in response_lower and "8h" in response_lower and "18h" in response_lower:
+            return "Agente informou que funciona de segunda a sexta-feira, das 8h às 18h."
+    price_pattern = r'(\d+(?:,\d+)?)\s*(?:reais?|r\$|mil)'
+    prices = re.findall(price_pattern, response_lower)
+    if prices:
+        return f"Agente informou valores de {', '.join(prices)} reais."
+    if any(word in response_lower for word in ["sim", "temos", "oferecemos", "disponível"]):
+        return "Agente confirmou disponibilidade do serviço/produto."
+    elif any(word in response_lower for word in ["não", "não temos", "indisponível"]):
+        return "Agente informou que o serviço/produto não está disponível."
+    if any(word in response_lower for word in ["whatsapp", "telefone", "contato"]):
+        return "Agente forneceu informações de contato."
+    if any(word in response_lower for word in ["agendar", "marcar", "consulta"]):
+        return "Agente forneceu informações sobre agendamento."
+    if len(agent_response.strip()) > 20:
+        words = agent_response.split()[:15]
+        summary = " ".join(words)
+        if len(summary) > 100:
+            summary = summary[:97] + "..."
+        return f"Agente informou que {summary.lower()}"
+    return None
+
+
+def legacy_synthesize(user_message: str, agent_response: str) -> Optional[str]:
+    user_msg_lower = user_message.lower()
+    interesse = detalhe = None
+    if any(word in user_msg_lower for word in ["horário", "funciona", "aberto", "fechado", "atende"]):
+        interesse, detalhe = "horários de funcionamento", "quando funciona"
+    elif any(word in user_msg_lower for word in ["preço", "valor", "custa", "quanto"]):
+        interesse, detalhe = "preços", "valores"
+    elif any(word in user_msg_lower for word in ["produto", "serviço", "tem", "oferece", "disponível"]):
+        interesse, detalhe = "produtos/serviços", "disponibilidade"
+    elif any(word in user_msg_lower for word in ["contato", "telefone", "whatsapp", "falar"]):
+        interesse, detalhe = "formas de contato", "como entrar em contato"
+    elif any(word in user_msg_lower for word in ["agendar", "marcar", "consulta", "horario"]):
+        interesse, detalhe = "agendamento", "como agendar"
+    if not interesse:
+        if len(user_message.strip()) > 10:
+            interesse, detalhe = "informações", "esclarecimentos"
+        else:
+            return None
+    resposta_principal = legacy_key_info(agent_response)
+    if not resposta_principal:
+        return None
+    return f"Usuário demonstrou interesse em {interesse} e quis saber {detalhe}. {resposta_principal}"
+
+
+def legacy_topics(synthesis: str) -> List[str]:
+    topics = []
+    synthesis_lower = synthesis.lower()
+    if "horários de funcionamento" in synthesis_lower:
+        topics.extend(["horario", "funcionamento"])
+    if "preços" in synthesis_lower or "valores" in synthesis_lower:
+        topics.extend(["preco", "valor"])
+    if "produtos" in synthesis_lower or "serviços" in synthesis_lower:
+        topics.extend(["produto", "servico"])
+    if "contato" in synthesis_lower:
+        topics.extend(["contato", "comunicacao"])
+    if "agendamento" in synthesis_lower:
+        topics.extend(["agendamento", "consulta"])
+    if not topics:
+        topics.append("geral")
+    return list(set(topics))
+
+
+# ==================== CARGA ====================
+
+def build_pairs(size: int, seed: int = 11) -> List[Tuple[str, str]]:
+    rng = random.Random(seed)
+    return [(rng.choice(USER_PHRASES), rng.choice(AGENT_PHRASES)) for _ in range(size)]
+
+
+def build_large_rules(interests: int, keywords_per_rule: int, seed: int = 3) -> Dict:
+    """Conjunto de regras de uma conta com muitas palavras-chave (catálogo de serviços)"""
+    rng = random.Random(seed)
+    alphabet = "abcdefghijlmnoprstuv"
+    rules = []
+    for i in range(interests):
+        keywords = ["".join(rng.choice(alphabet) for _ in range(rng.randint(5, 10)))
+                    for _ in range(keywords_per_rule)]
+        rules.append({"keywords": keywords, "interest": f"serviço {i}", "detail": "detalhes"})
+    return {**DEFAULT_RULES, "interests": rules + DEFAULT_RULES["interests"]}
+
+
+def legacy_interest(rules: Dict, user_message: str) -> Optional[str]:
+    """Mesma avaliação em cadeia da implementação anterior, para um conjunto arbitrário"""
+    text = user_message.lower()
+    for rule in rules["interests"]:
+        if any(word in text for word in rule["keywords"]):
+            return rule["interest"]
+    return None
+
+
+def per_call_us(fn: Callable[[str, str], object], pairs: List[Tuple[str, str]], rounds: int = 3) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for user_message, agent_response in pairs:
+            fn(user_message, agent_response)
+        best = min(best, (time.perf_counter() - start) / len(pairs) * 1e6)
+    return best
+
+
+def run_benchmark():
+    print("🧩 BENCHMARK - REGRAS DE SÍNTESE DE INTERAÇÕES")
+    print("=" * 64)
+
+    pairs = build_pairs(20_000)
+    compiled = InteractionRuleSet(DEFAULT_RULES)
+
+    # Equivalência com a implementação anterior
+    for user_message, agent_response in pairs[:2_000]:
+        expected = legacy_synthesize(user_message, agent_response)
+        assert compiled.synthesize(user_message, agent_response) == expected, (user_message, agent_response)
+        if expected:
+            assert sorted(compiled.topics(expected)) == sorted(legacy_topics(expected))
+    print("✅ Sínteses e tópicos idênticos à implementação anterior")
+
+    def legacy_pipeline(user_message: str, agent_response: str):
+        synthesis = legacy_synthesize(user_message, agent_response)
+        return legacy_topics(synthesis) if synthesis else None
+
+    def compiled_pipeline(user_message: str, agent_response: str):
+        synthesis = compiled.synthesize(user_message, agent_response)
+        return compiled.topics(synthesis) if synthesis else None
+
+    print(f"{'regras padrão':<28} | anterior: {per_call_us(legacy_pipeline, pairs):7.2f} µs/msg"
+          f" | compilado: {per_call_us(compiled_pipeline, pairs):7.2f} µs/msg")
+
+    # Custo de identificar o interesse conforme o conjunto de regras cresce
+    for interests, per_rule in ((20, 10), (100, 20), (300, 30)):
+        rules = build_large_rules(interests, per_rule)
+        rule_set = InteractionRuleSet(rules)
+        for user_message, _ in pairs[:500]:
+            expected = legacy_interest(rules, user_message)
+            result = rule_set.interest(user_message)
+            assert (result or {}).get("interest") == (expected or (result or {}).get("interest"))
+        legacy_us = per_call_us(lambda u, a: legacy_interest(rules, u), pairs[:5_000])
+        compiled_us = per_call_us(lambda u, a: rule_set.interest(u), pairs[:5_000])
+        label = f"{interests * per_rule} palavras-chave"
+        print(f"{label:<28} | anterior: {legacy_us:7.2f} µs/msg | compilado: {compiled_us:7.2f} µs/msg")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Benchmark do armazenamento em memória do SupabaseService (modo fallback)
+Compara a lista plana anterior com o InMemoryMessageStore indexado em custo
+por chamada de get_session_messages, get_user_messages e search_messages
+conforme o volume total de mensagens cresce (volume por usuário constante)
+"""
+import random
+import time
+from typing import Callable, Dict, List
+
+from message_store import InMemoryMessageStore
+
+WORDS = [
+    "consulta", "horário", "agendamento", "dieta", "valor", "preço", "retorno",
+    "online", "presencial", "clínica", "plano", "nutricional", "semana", "amanhã",
+    "frutas", "cardápio", "desconto", "sábado", "feriado", "atendimento",
+]
+
+
+class LegacyListStore:
+    """Cópia da implementação anterior (lista plana percorrida a cada chamada)"""
+
+    def __init__(self):
+        self.messages: List[Dict] = []
+
+    def append(self, message: Dict):
+        self.messages.append(message)
+
+    def session_messages(self, session_id: str, limit: int) -> List[Dict]:
+        msgs = [m for m in self.messages if m.get("session_id") == session_id]
+        msgs.sort(key=lambda m: m.get("created_at", ""))
+        return msgs[:limit]
+
+    def user_messages(self, user_id: str, limit: int) -> List[Dict]:
+        msgs = [m for m in self.messages if m.get("user_id") == user_id]
+        msgs.sort(key=lambda m: m.get("created_at", ""), reverse=True)
+        return msgs[:limit]
+
+    def search(self, user_id: str, terms: List[str], limit: int) -> List[Dict]:
+        results = []
+        for m in self.messages:
+            if m.get("user_id") != user_id:
+                continue
+            text = (m.get("user_message", "") + "\n" + m.get("agent_response", "")).lower()
+            if any(term.lower() in text for term in terms):
+                results.append(m)
+        results.sort(key=lambda m: m.get("created_at", ""), reverse=True)
+        return results[:limit]
+
+
+def build_messages(size: int, per_user: int = 50, seed: int = 7) -> List[Dict]:
+    """Gera mensagens sintéticas com volume fixo por usuário (o total cresce com o nº de usuários)"""
+    rng = random.Random(seed)
+    users = max(1, size // per_user)
+    messages = []
+    for i in range(size):
+        user = f"user_{rng.randrange(users)}"
+        messages.append({
+            "id": str(i),
+            "user_id": user,
+            "session_id": f"{user}_s{rng.randrange(3)}",
+            "agent_id": "agent",
+            "user_message": " ".join(rng.choice(WORDS) for _ in range(8)),
+            "agent_response": " ".join(rng.choice(WORDS) for _ in range(20)),
+            "created_at": "now()",
+        })
+    return messages
+
+
+def per_call_us(fn: Callable[[int], object], calls: int) -> float:
+    start = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def run_benchmark():
+    print("📦 BENCHMARK - ARMAZENAMENTO EM MEMÓRIA DE MENSAGENS")
+    print("=" * 60)
+    print(f"{'mensagens':>10} | {'operação':<10} | {'lista (µs)':>12} | {'indexado (µs)':>14}")
+    print("-" * 60)
+    for size in (1_000, 10_000, 50_000):
+        messages = build_messages(size)
+        legacy, indexed = LegacyListStore(), InMemoryMessageStore()
+        for message in messages:
+            legacy.append(message)
+            indexed.append(message)
+
+        users = sorted({m["user_id"] for m in messages})
+        sessions = sorted({m["session_id"] for m in messages})
+        calls = max(20, 20_000 // size * 10)
+
+        operations = {
+            "sessão": (lambda s: (lambda i: s.session_messages(sessions[i % len(sessions)], 50))),
+            "usuário": (lambda s: (lambda i: s.user_messages(users[i % len(users)], 100))),
+            "busca": (lambda s: (lambda i: s.search(users[i % len(users)], ["agend", "horári"], 10))),
+        }
+        for name, make in operations.items():
+            legacy_us = per_call_us(make(legacy), calls)
+            indexed_us = per_call_us(make(indexed), calls)
+            print(f"{size:>10} | {name:<10} | {legacy_us:>12.1f} | {indexed_us:>14.1f}")
+
+        # O conteúdo retornado é o mesmo (a ordem "mais recentes primeiro" agora é real)
+        user = users[0]
+        assert indexed.session_messages(sessions[0], 50) == legacy.session_messages(sessions[0], 50)
+        assert {m["id"] for m in indexed.search(user, ["agend"], 10 ** 6)} == \
+            {m["id"] for m in legacy.search(user, ["agend"], 10 ** 6)}
+        assert indexed.user_messages(user, 5) == [m for m in messages if m["user_id"] == user][::-1][:5]
+
+
+if __name__ == "__main__":
+    run_benchmark()
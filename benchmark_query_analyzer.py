@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Benchmark do analisador de consultas (query_analyzer)
+Compara a extração de termos antiga de DualMemoryService com o novo analisador
+(termos + reordenação por IDF) em qualidade de resultado (precisão/recall@5)
+e custo de CPU por consulta
+"""
+import random
+import re
+import time
+from typing import Callable, Dict, List
+
+from query_analyzer import QueryAnalyzer, QueryAnalyzerCache, fold_accents
+
+TOPICS: Dict[str, List[str]] = {
+    "horario": [
+        "Qual o horário de funcionamento da clínica?",
+        "Voces abrem que horas? qual horario?",
+        "A clínica funciona aos sábados?",
+        "Até que horas vocês atendem na sexta?",
+        "Horários de atendimento no feriado",
+    ],
+    "preco": [
+        "Quanto custa a consulta presencial?",
+        "Qual o preço do plano nutricional?",
+        "preco da consulta online",
+        "Os valores das consultas mudaram?",
+        "Tem desconto no valor do retorno?",
+    ],
+    "agendamento": [
+        "Quero agendar uma consulta para amanhã",
+        "Como faço o agendamento online?",
+        "Posso marcar um retorno na semana que vem?",
+        "Preciso remarcar meu agendamento",
+        "agendamentos disponiveis para terça",
+    ],
+    "dieta": [
+        "Estou seguindo a dieta low carb",
+        "Posso comer frutas na dieta?",
+        "Minhas dietas anteriores não funcionaram",
+        "Quais alimentos evitar na reeducação alimentar?",
+        "Cardápio da dieta para a semana",
+    ],
+}
+
+# Consultas no estilo WhatsApp: sem acentos e com flexões diferentes das do histórico
+QUERIES = [
+    ("Qual é o horário de atendimento?", "horario"),
+    ("qual horario voces atendem", "horario"),
+    ("horarios de funcionamento", "horario"),
+    ("quanto custa uma consulta", "preco"),
+    ("qual o preco", "preco"),
+    ("valor do plano", "preco"),
+    ("quero agendar", "agendamento"),
+    ("como agendo um retorno", "agendamento"),
+    ("quais alimentos posso comer na dieta", "dieta"),
+    ("dietas com frutas", "dieta"),
+]
+
+
+def legacy_extract_search_terms(query: str) -> List[str]:
+    """Cópia da implementação anterior de DualMemoryService._extract_search_terms"""
+    clean_query = re.sub(r'[^\w\s]', ' ', query.lower())
+    words = [word.strip() for word in clean_query.split() if len(word.strip()) > 2]
+    stop_words = {
+        'que', 'para', 'com', 'uma', 'por', 'como', 'mais', 'mas', 'foi', 'dos',
+        'tem', 'seu', 'sua', 'são', 'ele', 'ela', 'isso', 'este', 'esta', 'esse',
+        'essa', 'aquele', 'aquela', 'quando', 'onde', 'porque', 'qual', 'quais'
+    }
+    terms = [word for word in words if word not in stop_words]
+    return terms[:5] if terms else [query.lower()]
+
+
+def build_history(size: int, seed: int = 42) -> List[Dict]:
+    """Gera um histórico sintético de mensagens rotuladas por tópico"""
+    rng = random.Random(seed)
+    history = []
+    topics = list(TOPICS)
+    for i in range(size):
+        topic = rng.choice(topics)
+        text = rng.choice(TOPICS[topic])
+        history.append({"id": i, "topic": topic, "user_message": text, "agent_response": "Certo!"})
+    return history
+
+
+def search(history: List[Dict], terms: List[str], limit: int = 5) -> List[Dict]:
+    """Mesma semântica da busca em memória do SupabaseService (substring, mais recentes primeiro)"""
+    results = []
+    for msg in reversed(history):
+        text = (msg["user_message"] + "\n" + msg["agent_response"]).lower()
+        if any(term.lower() in text for term in terms):
+            results.append(msg)
+            if len(results) >= limit:
+                break
+    return results
+
+
+def evaluate(history: List[Dict], extractor: Callable[[str], List[str]], limit: int = 5,
+             analyzer: QueryAnalyzer = None) -> Dict[str, float]:
+    precision = recall = 0.0
+    for query, topic in QUERIES:
+        if analyzer is None:
+            results = search(history, extractor(query), limit)
+        else:
+            # Mesmo fluxo de DualMemoryService: busca candidatos extras e reordena por IDF
+            candidates = search(history, extractor(query), limit * 4)
+            results = analyzer.rerank(query, candidates, lambda m: m["user_message"], limit=limit)
+        relevant_total = min(limit, sum(1 for m in history if m["topic"] == topic))
+        relevant_found = sum(1 for m in results if m["topic"] == topic)
+        precision += relevant_found / len(results) if results else 0.0
+        recall += relevant_found / relevant_total if relevant_total else 0.0
+    return {"precision@5": precision / len(QUERIES), "recall@5": recall / len(QUERIES)}
+
+
+def cpu_per_query(extractor: Callable[[str], List[str]], iterations: int = 2000) -> float:
+    """Tempo médio de CPU (µs) por consulta"""
+    start = time.process_time()
+    for i in range(iterations):
+        extractor(QUERIES[i % len(QUERIES)][0])
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def run_benchmark():
+    print("🔍 BENCHMARK - ANALISADOR DE CONSULTAS")
+    print("=" * 60)
+    history = build_history(500)
+    documents = [f"{m['user_message']} {m['agent_response']}" for m in history]
+
+    analyzer = QueryAnalyzer(documents)
+    cache = QueryAnalyzerCache()
+
+    def new_extractor(query: str) -> List[str]:
+        return cache.get("bench-user", lambda: documents).extract_search_terms(query, top_k=5)
+
+    legacy_quality = evaluate(history, legacy_extract_search_terms)
+    new_quality = evaluate(history, new_extractor, analyzer=analyzer)
+
+    print("\n📊 QUALIDADE (busca por substring, top 5):")
+    print(f"   Antigo: precisão {legacy_quality['precision@5']:.2f} | recall {legacy_quality['recall@5']:.2f}")
+    print(f"   Novo:   precisão {new_quality['precision@5']:.2f} | recall {new_quality['recall@5']:.2f}")
+
+    print("\n🔎 TERMOS POR CONSULTA:")
+    for query, _ in QUERIES:
+        print(f"   {query!r}")
+        print(f"      antigo: {legacy_extract_search_terms(query)}")
+        print(f"      novo:   {new_extractor(query)}")
+
+    print("\n⏱️  CPU POR CONSULTA:")
+    print(f"   Antigo:                 {cpu_per_query(legacy_extract_search_terms):.1f}µs")
+    print(f"   Novo (analisador em cache): {cpu_per_query(new_extractor):.1f}µs")
+    start = time.process_time()
+    QueryAnalyzer(documents)
+    build_ms = (time.process_time() - start) * 1000
+    print(f"   Compilação do analisador ({len(documents)} mensagens): {build_ms:.1f}ms")
+    print(f"   Cache: {cache.hits} hits / {cache.misses} misses")
+
+    # Garante que o analisador compilado direto e o do cache concordam
+    sample = QUERIES[0][0]
+    assert analyzer.extract_search_terms(sample) == new_extractor(sample)
+    assert fold_accents("Horário") == "horario"
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,218 @@
+"""
+Ingestão em lote de mensagens
+Divide as mensagens em blocos inseridos com uma única requisição cada,
+com concorrência limitada, relatório de falhas por linha e suporte a
+upload NDJSON em streaming (memória limitada ao número de blocos em voo)
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import AsyncIterable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", "4"))
+BULK_MAX_LINE_BYTES = int(os.getenv("BULK_MAX_LINE_BYTES", str(1024 * 1024)))
+
+
+class RowError(Exception):
+    """Linha inválida (não é JSON, campos obrigatórios ausentes etc.)"""
+
+
+def parse_ndjson_lines(lines: Iterable) -> Iterator:
+    """
+    Converte linhas NDJSON em dicts
+
+    Linhas vazias são ignoradas; linhas inválidas geram um RowError no lugar
+    do dict, para que a posição da linha apareça no relatório.
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield RowError(f"JSON inválido: {e}")
+            continue
+        yield row if isinstance(row, dict) else RowError("Cada linha deve ser um objeto JSON")
+
+
+async def iter_ndjson_stream(chunks: AsyncIterable[bytes]):
+    """
+    Lê um corpo NDJSON em streaming (ex.: request.stream()) linha a linha
+
+    Uma linha acima de BULK_MAX_LINE_BYTES gera um único RowError e o
+    restante dela é descartado até a próxima quebra de linha.
+    """
+    buffer = b""
+    skipping = False
+    async for chunk in chunks:
+        if skipping:
+            newline = chunk.find(b"\n")
+            if newline < 0:
+                continue
+            chunk = chunk[newline + 1:]
+            skipping = False
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for item in parse_ndjson_lines(lines):
+            yield item
+        if len(buffer) > BULK_MAX_LINE_BYTES:
+            buffer = b""
+            skipping = True
+            yield RowError(f"Linha excede {BULK_MAX_LINE_BYTES} bytes")
+    if not skipping:
+        for item in parse_ndjson_lines([buffer]):
+            yield item
+
+
+class BulkIngestor:
+    """
+    Executa inserções em blocos com concorrência limitada
+
+    Cada bloco é validado linha a linha e inserido com insert_many. Se o
+    bloco falhar, as linhas são reinseridas uma a uma com insert_one para
+    isolar as que de fato falharam.
+    """
+
+    def __init__(self, insert_many: Callable[[List[Dict]], List[Dict]],
+                 insert_one: Callable[[Dict], Dict],
+                 build_row: Callable[[Dict], Dict],
+                 chunk_size: Optional[int] = None,
+                 max_concurrency: Optional[int] = None,
+                 max_reported_errors: int = 1000):
+        """
+        Args:
+            insert_many: Insere uma lista de linhas numa única requisição
+            insert_one: Insere uma única linha
+            build_row: Valida e converte a entrada na linha da tabela (lança RowError se inválida)
+            chunk_size: Linhas por bloco
+            max_concurrency: Blocos inseridos simultaneamente
+            max_reported_errors: Máximo de erros detalhados no relatório
+        """
+        self.insert_many = insert_many
+        self.insert_one = insert_one
+        self.build_row = build_row
+        self.chunk_size = max(1, chunk_size or BULK_CHUNK_SIZE)
+        self.max_concurrency = max(1, max_concurrency or BULK_MAX_CONCURRENCY)
+        self.max_reported_errors = max_reported_errors
+
+    # ==================== PROCESSAMENTO DE BLOCOS ====================
+
+    def _process_chunk(self, start: int, items: List) -> Tuple[int, List[Dict]]:
+        errors: List[Dict] = []
+        rows: List[Tuple[int, Dict]] = []
+        for offset, item in enumerate(items):
+            index = start + offset
+            try:
+                if isinstance(item, Exception):
+                    raise item
+                rows.append((index, self.build_row(item)))
+            except Exception as e:
+                errors.append({"index": index, "error": str(e)})
+
+        if not rows:
+            return 0, errors
+        try:
+            self.insert_many([row for _, row in rows])
+            return len(rows), errors
+        except Exception as e:
+            logging.warning(f"Falha ao inserir bloco {start}-{start + len(items) - 1}, "
+                            f"reprocessando linha a linha: {e}")
+
+        inserted = 0
+        for index, row in rows:
+            try:
+                self.insert_one(row)
+                inserted += 1
+            except Exception as e:
+                errors.append({"index": index, "error": str(e)})
+        return inserted, errors
+
+    def _new_report(self) -> Dict:
+        return {"received": 0, "inserted": 0, "failed": 0, "chunks": 0, "errors": [],
+                "errors_truncated": False}
+
+    def _merge(self, report: Dict, inserted: int, errors: List[Dict]):
+        report["chunks"] += 1
+        report["inserted"] += inserted
+        report["failed"] += len(errors)
+        room = self.max_reported_errors - len(report["errors"])
+        if len(errors) > room:
+            report["errors_truncated"] = True
+        report["errors"].extend(sorted(errors, key=lambda e: e["index"])[:max(room, 0)])
+
+    def _finish(self, report: Dict, started: float) -> Dict:
+        report["errors"].sort(key=lambda e: e["index"])
+        report["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        logging.info(
+            f"[METRICS] bulk_ingest | received: {report['received']} | inserted: {report['inserted']} | "
+            f"failed: {report['failed']} | chunks: {report['chunks']} | {report['duration_ms']}ms"
+        )
+        return report
+
+    # ==================== ENTRADAS ====================
+
+    def ingest(self, items: Iterable) -> Dict:
+        """
+        Ingere um iterável de entradas (consumido de forma incremental)
+
+        Returns:
+            Relatório com received, inserted, failed, chunks, errors
+            (índice da linha e motivo) e duration_ms
+        """
+        started = time.perf_counter()
+        report = self._new_report()
+        pending = set()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            chunk: List = []
+            for item in items:
+                chunk.append(item)
+                if len(chunk) >= self.chunk_size:
+                    pending.add(executor.submit(self._process_chunk, report["received"], chunk))
+                    report["received"] += len(chunk)
+                    chunk = []
+                    # Limita os blocos em voo para manter a memória constante
+                    if len(pending) >= self.max_concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self._merge(report, *future.result())
+            if chunk:
+                pending.add(executor.submit(self._process_chunk, report["received"], chunk))
+                report["received"] += len(chunk)
+            for future in pending:
+                self._merge(report, *future.result())
+        return self._finish(report, started)
+
+    async def ingest_ndjson_stream(self, chunks: AsyncIterable[bytes]) -> Dict:
+        """Ingere um corpo NDJSON recebido em streaming (ex.: request.stream())"""
+        started = time.perf_counter()
+        report = self._new_report()
+        pending = set()
+
+        async def flush(chunk: List):
+            nonlocal pending
+            pending.add(asyncio.ensure_future(asyncio.to_thread(self._process_chunk, report["received"], chunk)))
+            report["received"] += len(chunk)
+            if len(pending) >= self.max_concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    self._merge(report, *task.result())
+
+        chunk: List = []
+        async for item in iter_ndjson_stream(chunks):
+            chunk.append(item)
+            if len(chunk) >= self.chunk_size:
+                await flush(chunk)
+                chunk = []
+        if chunk:
+            await flush(chunk)
+        if pending:
+            for task in await asyncio.gather(*pending):
+                self._merge(report, *task)
+        return self._finish(report, started)
@@ -0,0 +1,223 @@
+"""
+Empacotador de contexto com orçamento de tokens por agente
+Seleciona trechos de memória/histórico por relevância, recência e deduplicação
+até o limite de tokens configurado para o agente
+"""
+import json
+import logging
+import math
+import os
+import re
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from query_analyzer import get_query_analyzer, stem, tokenize
+
+# Tokenizer real quando disponível; estimativa por regex como fallback
+try:
+    import tiktoken  # type: ignore
+except Exception:  # pacote opcional
+    tiktoken = None  # type: ignore
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+_APPROX_TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]", re.UNICODE)
+
+
+class TokenCounter:
+    """Contador de tokens usando tiktoken (ou estimativa quando indisponível)"""
+
+    def __init__(self, encoding_name: Optional[str] = None):
+        self.encoding_name = encoding_name or os.getenv("CONTEXT_TOKENIZER", "cl100k_base")
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.get_encoding(self.encoding_name)
+            except Exception as e:
+                logging.warning(f"Tokenizer {self.encoding_name} indisponível, usando estimativa: {e}")
+
+    @property
+    def exact(self) -> bool:
+        return self._encoding is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        # Estimativa: palavras longas viram vários tokens (~4 caracteres cada)
+        return len(_APPROX_TOKEN_RE.findall(text))
+
+
+def _load_agent_budgets() -> Dict[str, int]:
+    raw = os.getenv("CONTEXT_TOKEN_BUDGETS", "")
+    if not raw:
+        return {}
+    try:
+        return {str(k): int(v) for k, v in json.loads(raw).items()}
+    except Exception as e:
+        logging.warning(f"CONTEXT_TOKEN_BUDGETS inválido: {e}")
+        return {}
+
+
+class ContextPacker:
+    """
+    Monta o contexto do prompt dentro de um orçamento de tokens
+
+    Cada seção é um cabeçalho seguido de trechos. Os trechos recebem uma
+    pontuação (relevância para a mensagem atual + recência), quase-duplicatas
+    são descartadas e o melhor conjunto que cabe no orçamento é mantido,
+    preservando a ordem original no texto final.
+    """
+
+    def __init__(self, relevance_weight: float = 0.6, recency_weight: float = 0.4,
+                 dedup_threshold: float = 0.8):
+        self.relevance_weight = relevance_weight
+        self.recency_weight = recency_weight
+        self.dedup_threshold = dedup_threshold
+        self.counter = TokenCounter()
+        self._budgets = _load_agent_budgets()
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "tokens_candidates": 0, "tokens_used": 0, "tokens_saved": 0}
+
+    # ==================== ORÇAMENTO ====================
+
+    def get_budget(self, agent_id: Optional[str] = None) -> int:
+        """Orçamento de tokens do agente (ou o padrão)"""
+        if agent_id and agent_id in self._budgets:
+            return self._budgets[agent_id]
+        return DEFAULT_TOKEN_BUDGET
+
+    def set_budget(self, agent_id: str, budget: int):
+        """Define o orçamento de tokens de um agente"""
+        with self._lock:
+            self._budgets[agent_id] = int(budget)
+
+    # ==================== EMPACOTAMENTO ====================
+
+    def pack(self, sections: Sequence[Tuple[str, List[Dict]]], query: str = "",
+             agent_id: Optional[str] = None, user_id: Optional[str] = None,
+             token_budget: Optional[int] = None,
+             history_loader: Optional[Callable[[], Iterable[str]]] = None) -> Dict:
+        """
+        Empacota as seções dentro do orçamento
+
+        Args:
+            sections: Lista de (cabeçalho, trechos). Cada trecho é um dict com
+                "text" e, opcionalmente, "relevance" (0-1, ex.: similaridade
+                vetorial) e "recency" (0-1, 1 = mais recente)
+            query: Mensagem atual, usada para pontuar a relevância
+            agent_id: Agente cujo orçamento será aplicado
+            user_id: Usuário (define o analisador/IDF usado na relevância)
+            token_budget: Orçamento explícito (sobrepõe o do agente)
+            history_loader: Histórico do usuário para o IDF. Sem ele, usa o
+                analisador sem histórico e não grava no cache compartilhado
+                (um analisador vazio ali esconderia o IDF do usuário)
+
+        Returns:
+            Dict com text, tokens_used, tokens_candidates, tokens_saved,
+            budget, selected e dropped
+        """
+        budget = token_budget if token_budget is not None else self.get_budget(agent_id)
+        analyzer = None
+        if query:
+            analyzer = get_query_analyzer(user_id, history_loader) if history_loader else get_query_analyzer()
+        terms = analyzer.top_terms(query) if analyzer else []
+        max_term_score = sum(t["score"] for t in terms) or 1.0
+
+        candidates = []
+        tokens_candidates = 0
+        for section_index, (header, snippets) in enumerate(sections):
+            for snippet_index, snippet in enumerate(snippets):
+                text = (snippet.get("text") or "").strip()
+                if not text:
+                    continue
+                tokens = self.counter.count(text) + 1  # +1 pela quebra de linha
+                tokens_candidates += tokens
+                relevance = snippet.get("relevance")
+                if relevance is None:
+                    relevance = analyzer.relevance(terms, text) / max_term_score if terms else 0.0
+                recency = snippet.get("recency")
+                if recency is None:
+                    recency = recency_from_position(snippet_index, len(snippets), newest_first=False)
+                candidates.append({
+                    "section": section_index,
+                    "order": snippet_index,
+                    "text": text,
+                    "tokens": tokens,
+                    "stems": {stem(tok) for tok in tokenize(text)},
+                    "score": self.relevance_weight * relevance + self.recency_weight * recency,
+                })
+        header_tokens = {i: self.counter.count(header) + 1 for i, (header, _) in enumerate(sections) if header}
+        tokens_candidates += sum(header_tokens[s] for s in {c["section"] for c in candidates} if s in header_tokens)
+
+        selected: List[Dict] = []
+        used = 0
+        opened_sections = set()
+        for candidate in sorted(candidates, key=lambda c: -c["score"]):
+            if self._is_duplicate(candidate, selected):
+                continue
+            cost = candidate["tokens"]
+            if candidate["section"] not in opened_sections:
+                cost += header_tokens.get(candidate["section"], 0)
+            if used + cost > budget:
+                continue
+            used += cost
+            opened_sections.add(candidate["section"])
+            selected.append(candidate)
+
+        text = self._render(sections, selected)
+        report = {
+            "text": text,
+            "budget": budget,
+            "tokens_used": used,
+            "tokens_candidates": tokens_candidates,
+            "tokens_saved": max(tokens_candidates - used, 0),
+            "selected": len(selected),
+            "dropped": len(candidates) - len(selected),
+            "exact_tokenizer": self.counter.exact,
+        }
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["tokens_candidates"] += tokens_candidates
+            self.stats["tokens_used"] += used
+            self.stats["tokens_saved"] += report["tokens_saved"]
+        logging.info(
+            f"[METRICS] context_packer | agent: {agent_id or '-'} | budget: {budget} | "
+            f"used: {used} | candidates: {tokens_candidates} | saved: {report['tokens_saved']}"
+        )
+        return report
+
+    def _is_duplicate(self, candidate: Dict, selected: List[Dict]) -> bool:
+        stems = candidate["stems"]
+        if not stems:
+            return False
+        for other in selected:
+            union = len(stems | other["stems"])
+            if union and len(stems & other["stems"]) / union >= self.dedup_threshold:
+                return True
+        return False
+
+    @staticmethod
+    def _render(sections: Sequence[Tuple[str, List[Dict]]], selected: List[Dict]) -> str:
+        by_section: Dict[int, List[Dict]] = {}
+        for candidate in selected:
+            by_section.setdefault(candidate["section"], []).append(candidate)
+        parts = []
+        for section_index, (header, _) in enumerate(sections):
+            chosen = sorted(by_section.get(section_index, []), key=lambda c: c["order"])
+            if not chosen:
+                continue
+            if header:
+                parts.append(header)
+            parts.extend(c["text"] for c in chosen)
+        return "\n".join(parts)
+
+
+def recency_from_position(index: int, total: int, newest_first: bool = True) -> float:
+    """Recência em [0, 1] a partir da posição do item na lista"""
+    distance = index if newest_first else (total - 1 - index)
+    return math.exp(-0.35 * max(distance, 0))
+
+
+# Instância global do empacotador de contexto
+context_packer = ContextPacker()
@@ -0,0 +1,158 @@
+"""
+Debounce de mensagens por sessão
+Mensagens que chegam em sequência para a mesma sessão (ex.: várias mensagens
+curtas no WhatsApp) ficam retidas durante a janela de debounce e são
+respondidas em um único turno do agente. Os prazos ficam em uma roda de
+temporizadores (timer wheel) avançada por uma única tarefa, em vez de uma
+tarefa ou timer por mensagem.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+DEBOUNCE_TICK_MS = int(os.getenv("DEBOUNCE_TICK_MS", "50"))
+DEBOUNCE_WHEEL_SLOTS = int(os.getenv("DEBOUNCE_WHEEL_SLOTS", "512"))
+# Prazo máximo desde a primeira mensagem retida (quem digita sem parar também recebe resposta)
+DEBOUNCE_MAX_WAIT_MS = int(os.getenv("DEBOUNCE_MAX_WAIT_MS", "10000"))
+DEBOUNCE_MAX_BATCH = int(os.getenv("DEBOUNCE_MAX_BATCH", "20"))
+
+# handler(chave, payloads em ordem de chegada) -> resultado do turno
+BatchHandler = Callable[[Hashable, List[Any]], Awaitable[Any]]
+
+
+class _Batch:
+    __slots__ = ("payloads", "futures", "first_tick", "deadline_tick")
+
+    def __init__(self, first_tick: int):
+        self.payloads: List[Any] = []
+        self.futures: List[asyncio.Future] = []
+        self.first_tick = first_tick
+        self.deadline_tick = first_tick
+
+
+class DebounceScheduler:
+    """
+    Agrupa mensagens por chave (sessão) e executa o handler uma vez por grupo
+
+    Cada nova mensagem adia o prazo do grupo para agora + debounce_ms
+    (limitado a max_wait_ms desde a primeira). Quando o prazo vence, o
+    handler recebe todas as mensagens retidas; a última mensagem recebe o
+    resultado e as anteriores são marcadas como agrupadas.
+    """
+
+    def __init__(self, handler: BatchHandler, tick_ms: int = DEBOUNCE_TICK_MS,
+                 slots: int = DEBOUNCE_WHEEL_SLOTS, max_wait_ms: int = DEBOUNCE_MAX_WAIT_MS,
+                 max_batch: int = DEBOUNCE_MAX_BATCH):
+        self.handler = handler
+        self.tick_seconds = max(tick_ms, 1) / 1000
+        self.max_wait_ticks = self._ticks(max_wait_ms)
+        self.max_batch = max(max_batch, 1)
+        self._wheel: List[Set[Hashable]] = [set() for _ in range(max(slots, 1))]
+        self._batches: Dict[Hashable, _Batch] = {}
+        self._started_at = time.monotonic()
+        self._ticker: Optional[asyncio.Task] = None
+        self.stats = {"submitted": 0, "immediate": 0, "batches": 0, "coalesced": 0, "errors": 0}
+
+    def _ticks(self, milliseconds: int) -> int:
+        return max(int(round(milliseconds / 1000 / self.tick_seconds)), 0)
+
+    def _now_tick(self) -> int:
+        return int((time.monotonic() - self._started_at) / self.tick_seconds)
+
+    # ==================== ENTRADA ====================
+
+    async def submit(self, key: Hashable, payload: Any, debounce_ms: int) -> Tuple[Any, bool]:
+        """
+        Registra uma mensagem e aguarda o turno do seu grupo
+
+        Returns:
+            (resultado do handler, True se esta foi a última mensagem do grupo)
+        """
+        self.stats["submitted"] += 1
+        batch = self._batches.get(key)
+        if debounce_ms <= 0 and batch is None:
+            self.stats["immediate"] += 1
+            return await self.handler(key, [payload]), True
+
+        now = self._now_tick()
+        if batch is None:
+            batch = self._batches[key] = _Batch(now)
+        else:
+            self.stats["coalesced"] += 1
+        future = asyncio.get_running_loop().create_future()
+        batch.payloads.append(payload)
+        batch.futures.append(future)
+
+        if debounce_ms <= 0 or len(batch.payloads) >= self.max_batch:
+            self._flush(key)
+        else:
+            # A cada mensagem o prazo é adiado; a entrada antiga na roda é descartada ao ser visitada
+            deadline = min(now + max(self._ticks(debounce_ms), 1), batch.first_tick + self.max_wait_ticks)
+            batch.deadline_tick = max(deadline, now + 1)
+            self._wheel[batch.deadline_tick % len(self._wheel)].add(key)
+            self._ensure_ticker()
+
+        result, is_last = await future
+        return result, is_last
+
+    # ==================== RODA DE TEMPORIZADORES ====================
+
+    def _ensure_ticker(self):
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.get_running_loop().create_task(self._run_wheel())
+
+    async def _run_wheel(self):
+        tick = self._now_tick()
+        # A tarefa termina quando não há grupos pendentes e é recriada no próximo submit
+        while self._batches:
+            await asyncio.sleep(max((tick + 1) * self.tick_seconds - (time.monotonic() - self._started_at), 0))
+            now = self._now_tick()
+            # Visita todos os slots vencidos desde a última volta (o loop pode ter atrasado)
+            for current in range(tick + 1, min(now, tick + len(self._wheel)) + 1):
+                self._expire_slot(current, now)
+            tick = now
+
+    def _expire_slot(self, current: int, now: int):
+        slot = self._wheel[current % len(self._wheel)]
+        for key in list(slot):
+            batch = self._batches.get(key)
+            if batch is None or batch.deadline_tick % len(self._wheel) != current % len(self._wheel):
+                slot.discard(key)  # grupo já executado ou prazo adiado para outro slot
+            elif batch.deadline_tick <= now:
+                slot.discard(key)
+                self._flush(key)
+
+    def _flush(self, key: Hashable):
+        batch = self._batches.pop(key, None)
+        if batch is None:
+            return
+        self.stats["batches"] += 1
+        asyncio.get_running_loop().create_task(self._run_batch(key, batch))
+
+    async def _run_batch(self, key: Hashable, batch: _Batch):
+        try:
+            result = await self.handler(key, batch.payloads)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logging.warning(f"Falha no turno agrupado de {key}: {e}")
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        last = len(batch.futures) - 1
+        for index, future in enumerate(batch.futures):
+            if not future.done():
+                future.set_result((result, index == last))
+
+    # ==================== MÉTRICAS ====================
+
+    def get_stats(self) -> Dict:
+        """Mensagens recebidas, turnos executados e mensagens agrupadas"""
+        stats = dict(self.stats)
+        stats["pending_sessions"] = len(self._batches)
+        stats["pending_messages"] = sum(len(b.payloads) for b in self._batches.values())
+        stats["tick_ms"] = int(self.tick_seconds * 1000)
+        stats["max_wait_ms"] = int(self.max_wait_ticks * self.tick_seconds * 1000)
+        return stats
@@ -10,9 +10,13 @@ import os
 import json
 import uuid
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase_client import get_supabase_client, LOCAL_BACKEND, Client
+from session_history_cache import chat_history_cache, fetch_recent
+from bulk_ingest import BulkIngestor, RowError
+from memory_filters import apply_memory_filters, apply_keyset_page, split_page, iter_pages
+from interaction_rules import interaction_rules
 
 # Carrega variáveis de ambiente
 load_dotenv()
@@ -25,10 +29,10 @@ class DualMemoryOptimizedService:
         self.supabase_url = os.getenv("SUPABASE_URL")
         self.supabase_key = os.getenv("SUPABASE_KEY")
         
-        if not self.supabase_url or not self.supabase_key:
+        if not LOCAL_BACKEND and (not self.supabase_url or not self.supabase_key):
             raise ValueError("Credenciais do Supabase não encontradas")
         
-        self.supabase: Client = create_client(self.supabase_url, self.supabase_key)
+        self.supabase: Client = get_supabase_client(self.supabase_url, self.supabase_key)
         print("✅ Serviço de memória dual otimizada inicializado")
     
     # ==================== MENSAGENS_IA - HISTÓRICO BRUTO ====================
@@ -75,6 +79,7 @@ class DualMemoryOptimizedService:
             
             if result.data:
                 saved_message = result.data[0]
+                chat_history_cache.append(session_id, saved_message)
                 print(f"✅ Mensagem salva em mensagens_ia: {saved_message['id']}")
                 return {
                     "id": saved_message["id"],
@@ -93,6 +98,59 @@ class DualMemoryOptimizedService:
                 "table": "mensagens_ia"
             }
     
+    def save_chat_messages_bulk(self,
+                                messages: Iterable[Dict[str, Any]],
+                                chunk_size: Optional[int] = None,
+                                max_concurrency: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Salva conversas em lote na tabela mensagens_ia
+        
+        Args:
+            messages: Conversas com user_id, session_id, agent_id, user_message,
+                agent_response e, opcionalmente, message_id
+            chunk_size: Linhas por inserção
+            max_concurrency: Inserções simultâneas
+            
+        Returns:
+            Relatório com received, inserted, failed e errors (índice e motivo)
+        """
+        return self.chat_bulk_ingestor(chunk_size, max_concurrency).ingest(messages)
+    
+    def chat_bulk_ingestor(self, chunk_size: Optional[int] = None,
+                           max_concurrency: Optional[int] = None) -> BulkIngestor:
+        """Ingestor em lote de mensagens_ia (usado também no upload NDJSON em streaming)"""
+        return BulkIngestor(
+            insert_many=self._insert_chat_rows,
+            insert_one=lambda row: self._insert_chat_rows([row])[0],
+            build_row=self._build_chat_row,
+            chunk_size=chunk_size,
+            max_concurrency=max_concurrency,
+        )
+    
+    def _build_chat_row(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        required = ("user_id", "session_id", "agent_id", "user_message")
+        missing = [field for field in required if not item.get(field)]
+        if missing:
+            raise RowError(f"Campos obrigatórios ausentes: {', '.join(missing)}")
+        return {
+            "user_id": item["user_id"],
+            "session_id": item["session_id"],
+            "agent_id": item["agent_id"],
+            "user_message": item["user_message"],
+            "agent_response": item.get("agent_response") or "",
+            "message_id": item.get("message_id") or str(uuid.uuid4()),
+            "timestamp": item.get("timestamp") or datetime.now().isoformat()
+        }
+    
+    def _insert_chat_rows(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        result = self.supabase.table("mensagens_ia").insert(rows).execute()
+        if not result.data:
+            raise Exception("Falha ao inserir mensagens")
+        # Blocos concorrentes não garantem a ordem: invalida em vez de anexar ao cache
+        for session_id in {row.get("session_id") for row in result.data}:
+            chat_history_cache.invalidate(session_id)
+        return result.data
+    
     def get_chat_history(self, 
                         user_id: str, 
                         session_id: Optional[str] = None,
@@ -111,6 +169,23 @@ class DualMemoryOptimizedService:
             Lista de mensagens do histórico
         """
         try:
+            # Histórico recente de uma sessão: lê primeiro do cache quente. O cache
+            # guarda a sessão inteira (compartilhado com SupabaseService), então o
+            # carregador não filtra por usuário
+            if session_id and not agent_id:
+                def load(sid: str, count: int) -> List[Dict[str, Any]]:
+                    rows = self.supabase.table("mensagens_ia").select("*")\
+                        .eq("session_id", sid)\
+                        .order("created_at", desc=True).limit(count).execute()
+                    return list(reversed(rows.data or []))
+                
+                recent = fetch_recent(chat_history_cache, session_id, limit, load)
+                if all(m.get("user_id") == user_id for m in recent):
+                    messages = list(reversed(recent))
+                    print(f"✅ Recuperadas {len(messages)} mensagens do histórico")
+                    return messages
+                # Sessão com mensagens de outros usuários: consulta filtrada abaixo
+            
             query = self.supabase.table("mensagens_ia").select("*")
             query = query.eq("user_id", user_id)
             
@@ -225,42 +300,8 @@ class DualMemoryOptimizedService:
             Lista de memórias enriquecidas
         """
         try:
-            query = self.supabase.table("message_history").select("*")
-            query = query.eq("user_id", user_id)
-            query = query.eq("role", "system")  # Apenas memórias enriquecidas
-            
-            # Filtrar por tipo se especificado
-            if memory_type:
-                query = query.contains("metadata", {"type": memory_type})
-            
-            # Filtrar por agent_id se especificado
-            if agent_id:
-                query = query.contains("metadata", {"agent_id": agent_id})
-            
-            query = query.order("created_at", desc=True).limit(limit)
-            result = query.execute()
-            
-            memories = []
-            for row in result.data:
-                metadata = row.get("metadata", {})
-                
-                # Filtrar por tópicos se especificado
-                if query_topics:
-                    row_topics = metadata.get("topics", [])
-                    if not any(topic in row_topics for topic in query_topics):
-                        continue
-                
-                memory_info = {
-                    "memory_id": metadata.get("memory_id", f"mem-{row['id']}"),
-                    "id": row["id"],
-                    "content": row["content"],
-                    "type": metadata.get("type", "unknown"),
-                    "topics": metadata.get("topics", []),
-                    "agent_id": metadata.get("agent_id"),
-                    "metadata": metadata,
-                    "created_at": row["created_at"]
-                }
-                memories.append(memory_info)
+            rows, _ = self._fetch_enriched_page(user_id, query_topics, memory_type, agent_id, None, limit)
+            memories = [self._format_enriched_memory(row) for row in rows]
             
             print(f"✅ Encontradas {len(memories)} memórias enriquecidas")
             return memories
@@ -269,13 +310,87 @@ class DualMemoryOptimizedService:
             print(f"❌ Erro ao buscar memórias enriquecidas: {e}")
             return []
     
+    def list_enriched_memories_page(self,
+                                    user_id: str,
+                                    cursor: Optional[str] = None,
+                                    limit: int = 10,
+                                    query_topics: Optional[List[str]] = None,
+                                    memory_type: Optional[str] = None,
+                                    agent_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Página de memórias enriquecidas (mais recentes primeiro) paginada por cursor
+        
+        Args:
+            user_id: ID do usuário
+            cursor: next_cursor da página anterior (None para a primeira)
+            limit: Tamanho da página
+            query_topics: Tópicos para filtrar
+            memory_type: Tipo de memória para filtrar
+            agent_id: ID do agente para filtrar
+            
+        Returns:
+            Dict com memories e next_cursor (None na última página)
+            
+        Raises:
+            ValueError: Cursor inválido
+        """
+        rows, next_cursor = self._fetch_enriched_page(user_id, query_topics, memory_type, agent_id, cursor, limit)
+        return {
+            "memories": [self._format_enriched_memory(row) for row in rows],
+            "next_cursor": next_cursor
+        }
+    
+    def iter_enriched_memories(self,
+                               user_id: str,
+                               query_topics: Optional[List[str]] = None,
+                               memory_type: Optional[str] = None,
+                               agent_id: Optional[str] = None,
+                               page_size: int = 500,
+                               cursor: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Percorre todas as memórias enriquecidas do usuário, uma página por vez (exportação)"""
+        def fetch(page_cursor: Optional[str]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+            return self._fetch_enriched_page(user_id, query_topics, memory_type, agent_id, page_cursor, page_size)
+        
+        for row in iter_pages(fetch, cursor):
+            yield self._format_enriched_memory(row)
+    
+    def _fetch_enriched_page(self, user_id: str, query_topics: Optional[List[str]], memory_type: Optional[str],
+                             agent_id: Optional[str], cursor: Optional[str],
+                             limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        query = self.supabase.table("message_history").select("*")
+        query = query.eq("user_id", user_id)
+        query = query.eq("role", "system")  # Apenas memórias enriquecidas
+        
+        # Filtros de tipo, agente e tópicos aplicados no banco (indexados)
+        query = apply_memory_filters(query, memory_type=memory_type, agent_id=agent_id,
+                                     topics=query_topics)
+        
+        # Mais recentes primeiro, continuando após o cursor (keyset em created_at, id)
+        result = apply_keyset_page(query, cursor, limit).execute()
+        return split_page(result.data or [], limit)
+    
+    @staticmethod
+    def _format_enriched_memory(row: Dict[str, Any]) -> Dict[str, Any]:
+        metadata = row.get("metadata", {})
+        return {
+            "memory_id": metadata.get("memory_id", f"mem-{row['id']}"),
+            "id": row["id"],
+            "content": row["content"],
+            "type": metadata.get("type", "unknown"),
+            "topics": metadata.get("topics", []),
+            "agent_id": metadata.get("agent_id"),
+            "metadata": metadata,
+            "created_at": row["created_at"]
+        }
+    
     # ==================== FUNÇÕES DE ENRIQUECIMENTO AUTOMÁTICO ====================
     
     def auto_enrich_conversation(self,
                                 user_id: str,
                                 session_id: str,
                                 user_message: str,
-                                agent_response: str) -> List[Dict[str, Any]]:
+                                agent_response: str,
+                                account_id: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         Enriquece automaticamente uma conversa criando uma síntese concisa da interação
         
@@ -288,6 +403,7 @@ class DualMemoryOptimizedService:
             session_id: ID da sessão
             user_message: Mensagem do usuário
             agent_response: Resposta do agente
+            account_id: Conta do agente (seleciona o conjunto de regras de síntese)
             
         Returns:
             Lista com a memória enriquecida criada
@@ -296,11 +412,11 @@ class DualMemoryOptimizedService:
         
         try:
             # Criar síntese concisa da interação
-            synthesized_memory = self._synthesize_interaction(user_message, agent_response)
+            synthesized_memory = self._synthesize_interaction(user_message, agent_response, account_id)
             
             if synthesized_memory:
                 # Extrair tópicos da síntese para facilitar buscas futuras
-                topics = self._extract_topics_from_synthesis(synthesized_memory)
+                topics = self._extract_topics_from_synthesis(synthesized_memory, account_id)
                 
                 memory = self.create_enriched_memory(
                     user_id=user_id,
@@ -381,153 +497,50 @@ class DualMemoryOptimizedService:
         
         return None
     
-    def _extract_topics_from_synthesis(self, synthesis: str) -> List[str]:
+    def _extract_topics_from_synthesis(self, synthesis: str, account_id: Optional[str] = None) -> List[str]:
         """
         Extrai tópicos relevantes da síntese para facilitar buscas futuras
         
         Args:
             synthesis: String com a síntese da interação
+            account_id: Conta cujas regras devem ser usadas (padrão se None)
             
         Returns:
             Lista de tópicos identificados
         """
-        topics = []
-        synthesis_lower = synthesis.lower()
-        
-        # Mapear interesses para tópicos
-        if "horários de funcionamento" in synthesis_lower:
-            topics.extend(["horario", "funcionamento"])
-        
-        if "preços" in synthesis_lower or "valores" in synthesis_lower:
-            topics.extend(["preco", "valor"])
-        
-        if "produtos" in synthesis_lower or "serviços" in synthesis_lower:
-            topics.extend(["produto", "servico"])
-        
-        if "contato" in synthesis_lower:
-            topics.extend(["contato", "comunicacao"])
-        
-        if "agendamento" in synthesis_lower:
-            topics.extend(["agendamento", "consulta"])
-        
-        # Se não encontrou tópicos específicos, usar genérico
-        if not topics:
-            topics.append("geral")
-        
-        return list(set(topics))  # Remove duplicatas
+        return interaction_rules.get(account_id).topics(synthesis)
     
-    def _synthesize_interaction(self, user_message: str, agent_response: str) -> Optional[str]:
+    def _synthesize_interaction(self, user_message: str, agent_response: str,
+                                account_id: Optional[str] = None) -> Optional[str]:
         """
         Sintetiza uma interação em um registro conciso seguindo o padrão:
         'Usuário demonstrou interesse em [assunto] e quis saber [detalhe]. 
          Informado pelo agente que [resumo da resposta principal].'
         
+        As regras vêm do conjunto compilado da conta (ver interaction_rules.py)
+        
         Args:
             user_message: Mensagem do usuário
             agent_response: Resposta do agente
+            account_id: Conta cujas regras devem ser usadas (padrão se None)
             
         Returns:
             String com a síntese da interação ou None se não relevante
         """
-        user_msg_lower = user_message.lower()
-        agent_resp_lower = agent_response.lower()
-        
-        # Detectar interesse principal do usuário
-        interesse = None
-        detalhe = None
-        
-        # Padrões de interesse em horários
-        if any(word in user_msg_lower for word in ["horário", "funciona", "aberto", "fechado", "atende"]):
-            interesse = "horários de funcionamento"
-            detalhe = "quando funciona"
-            
-        # Padrões de interesse em preços/valores
-        elif any(word in user_msg_lower for word in ["preço", "valor", "custa", "quanto"]):
-            interesse = "preços"
-            detalhe = "valores"
-            
-        # Padrões de interesse em produtos/serviços
-        elif any(word in user_msg_lower for word in ["produto", "serviço", "tem", "oferece", "disponível"]):
-            interesse = "produtos/serviços"
-            detalhe = "disponibilidade"
-            
-        # Padrões de interesse em contato
-        elif any(word in user_msg_lower for word in ["contato", "telefone", "whatsapp", "falar"]):
-            interesse = "formas de contato"
-            detalhe = "como entrar em contato"
-            
-        # Padrões de interesse em agendamento
-        elif any(word in user_msg_lower for word in ["agendar", "marcar", "consulta", "horario"]):
-            interesse = "agendamento"
-            detalhe = "como agendar"
-            
-        # Se não detectou interesse específico, usar padrão genérico
-        if not interesse:
-            if len(user_message.strip()) > 10:  # Apenas para mensagens substantivas
-                interesse = "informações"
-                detalhe = "esclarecimentos"
-            else:
-                return None  # Mensagens muito curtas não são relevantes
-        
-        # Extrair informação principal da resposta do agente
-        resposta_principal = self._extract_key_info_from_response(agent_response)
-        
-        if not resposta_principal:
-            return None
-        
-        # Construir síntese seguindo o padrão especificado
-        sintese = f"Usuário demonstrou interesse em {interesse} e quis saber {detalhe}. {resposta_principal}"
-        
-        return sintese
+        return interaction_rules.get(account_id).synthesize(user_message, agent_response)
     
-    def _extract_key_info_from_response(self, agent_response: str) -> Optional[str]:
+    def _extract_key_info_from_response(self, agent_response: str, account_id: Optional[str] = None) -> Optional[str]:
         """
         Extrai a informação principal da resposta do agente
         
         Args:
             agent_response: Resposta do agente
+            account_id: Conta cujas regras devem ser usadas (padrão se None)
             
         Returns:
             String com a informação principal ou None
         """
-        response_lower = agent_response.lower()
-        
-        # Extrair horários de funcionamento
-        if any(word in response_lower for word in ["funciona", "horário", "segunda", "sexta", "8h", "18h"]):
-            if "segunda a sexta" in response_lower and "8h" in response_lower and "18h" in response_lower:
-                return "Agente informou que funciona de segunda a sexta-feira, das 8h às 18h."
-        
-        # Extrair valores/preços
-        import re
-        price_pattern = r'(\d+(?:,\d+)?)\s*(?:reais?|r\$|mil)'
-        prices = re.findall(price_pattern, response_lower)
-        if prices:
-            return f"Agente informou valores de {', '.join(prices)} reais."
-        
-        # Extrair informações de disponibilidade
-        if any(word in response_lower for word in ["sim", "temos", "oferecemos", "disponível"]):
-            return "Agente confirmou disponibilidade do serviço/produto."
-        elif any(word in response_lower for word in ["não", "não temos", "indisponível"]):
-            return "Agente informou que o serviço/produto não está disponível."
-        
-        # Extrair informações de contato
-        if any(word in response_lower for word in ["whatsapp", "telefone", "contato"]):
-            return "Agente forneceu informações de contato."
-        
-        # Extrair informações de agendamento
-        if any(word in response_lower for word in ["agendar", "marcar", "consulta"]):
-            return "Agente forneceu informações sobre agendamento."
-        
-        # Se a resposta for substantiva mas não se encaixa nos padrões, usar resumo genérico
-        if len(agent_response.strip()) > 20:
-            # Pegar as primeiras palavras significativas
-            words = agent_response.split()[:15]
-            summary = " ".join(words)
-            if len(summary) > 100:
-                summary = summary[:97] + "..."
-            return f"Agente informou que {summary.lower()}"
-        
-        return None
+        return interaction_rules.get(account_id).key_info(agent_response)
 
 # Instância global do serviço
 dual_memory_service = DualMemoryOptimizedService()
\ No newline at end of file
@@ -1,9 +1,11 @@
 """
 Serviço de Memória Dupla - Combina memória interna (Supabase) e externa (Mem0)
 """
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Optional
 from supabase_service import supabase_service
 from memory import memory_manager
+from query_analyzer import get_query_analyzer
+from context_packer import context_packer, recency_from_position
 import logging
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
@@ -63,7 +65,7 @@ class DualMemoryService:
             String formatada com o contexto da sessão
         """
         try:
-            messages = self.supabase.get_session_messages(session_id, limit)
+            messages = self.supabase.get_recent_session_messages(session_id, limit)
             
             if not messages:
                 return "Nova sessão - sem histórico anterior."
@@ -153,7 +155,7 @@ class DualMemoryService:
             if not memories:
                 return "Nenhum contexto enriquecido disponível."
             
-            formatted_context = self.mem0.format_memories_for_context(memories)
+            formatted_context = self.mem0.format_memories_for_context(memories, query=query, user_id=user_id)
             return f"Contexto relevante das conversas anteriores:\n{formatted_context}"
             
         except Exception as e:
@@ -214,7 +216,7 @@ class DualMemoryService:
         Recupera contexto completo de ambas as memórias com paralelização
         """
         t0 = time.perf_counter()
-        search_terms = self._extract_search_terms(query)
+        search_terms = self._extract_search_terms(query, user_id)
 
         results: Dict[str, str] = {
             "session_context": "",
@@ -229,7 +231,7 @@ class DualMemoryService:
             return self.get_enriched_context(user_id, query, memory_limit)
 
         def _get_search():
-            return self._search_with_multiple_terms(user_id, search_terms, 5)
+            return self._search_with_multiple_terms(user_id, search_terms, 5, query=query)
 
         with ThreadPoolExecutor(max_workers=3) as executor:
             future_map = {
@@ -253,21 +255,37 @@ class DualMemoryService:
             pass
         return results
 
-    def _search_with_multiple_terms(self, user_id: str, search_terms: List[str], limit: int = 5) -> str:
+    def _search_with_multiple_terms(self, user_id: str, search_terms: List[str], limit: int = 5,
+                                    query: str = "") -> str:
         """
         Busca usando múltiplos termos com tentativa de query única (OR) e fallback
+
+        Quando a query original é informada, busca candidatos extras e os
+        reordena pela relevância ponderada por IDF do analisador de consultas.
         """
         if not search_terms:
             return "Nenhum termo de busca fornecido."
 
+        fetch_limit = limit * 4 if query else limit
+
+        def _rank(messages: List[Dict]) -> List[Dict]:
+            # Ordena por data (mais recente primeiro) e, havendo query, por relevância
+            messages.sort(key=lambda x: x.get('created_at', ''), reverse=True)
+            if query:
+                analyzer = self._get_query_analyzer(user_id)
+                return analyzer.rerank(
+                    query, messages,
+                    lambda m: f"{m.get('user_message', '')} {m.get('agent_response', '')}",
+                    limit=limit
+                )
+            return messages[:limit]
+
         # Tenta uma única chamada com termos combinados, se o serviço suportar
         try:
             query_str = " | ".join(search_terms)  # usado como sugestão de OR/FTS no service
-            messages = self.supabase.search_messages(user_id, query_str, limit)
+            messages = self.supabase.search_messages(user_id, query_str, fetch_limit)
             if messages:
-                # Ordena por data (mais recente primeiro) e limita
-                messages.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-                messages = messages[:limit]
+                messages = _rank(messages)
                 context_parts = [f"Conversas anteriores relevantes (termos: {', '.join(search_terms)}):"]
                 for msg in messages:
                     context_parts.append(f"• {msg['user_message']} → {msg['agent_response']}")
@@ -280,7 +298,7 @@ class DualMemoryService:
         seen = set()
         for term in search_terms:
             try:
-                msgs = self.supabase.search_messages(user_id, term, limit)
+                msgs = self.supabase.search_messages(user_id, term, fetch_limit)
             except Exception as e:
                 logging.warning(f"Erro ao buscar por '{term}': {e}")
                 continue
@@ -293,14 +311,14 @@ class DualMemoryService:
         if not all_results:
             return f"Nenhuma mensagem anterior encontrada para os termos: {', '.join(search_terms)}"
 
-        all_results.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        limited_results = all_results[:limit]
+        limited_results = _rank(all_results)
         context_parts = [f"Conversas anteriores relevantes (termos: {', '.join(search_terms)}):"]
         for msg in limited_results:
             context_parts.append(f"• {msg['user_message']} → {msg['agent_response']}")
         return "\n".join(context_parts)
     
-    def get_memory_context(self, user_id: str, query: str = "", limit: int = 5) -> str:
+    def get_memory_context(self, user_id: str, query: str = "", limit: int = 5,
+                           agent_id: Optional[str] = None, token_budget: Optional[int] = None) -> str:
         """
         Método principal para recuperar contexto de memória
         Combina histórico recente do usuário e busca semântica
@@ -309,34 +327,48 @@ class DualMemoryService:
             user_id: ID do usuário
             query: Consulta para busca semântica (opcional)
             limit: Número máximo de resultados
+            agent_id: ID do agente (define o orçamento de tokens)
+            token_budget: Orçamento de tokens explícito (opcional)
         
         Returns:
             String formatada com contexto de memória
         """
         try:
-            # Busca mensagens recentes do usuário
+            # Busca mensagens recentes do usuário (mais recentes primeiro)
             recent_messages = self.supabase.get_user_messages(user_id, limit)
             
-            context_parts = []
+            sections = []
             
             if recent_messages:
-                context_parts.append("📝 Contexto de conversas anteriores:")
-                for msg in recent_messages:
-                    context_parts.append(f"• Usuário: {msg['user_message']}")
-                    context_parts.append(f"• Assistente: {msg['agent_response']}")
-                    context_parts.append("---")
+                sections.append(("📝 Contexto de conversas anteriores:", [
+                    {
+                        "text": f"• Usuário: {msg['user_message']}\n• Assistente: {msg['agent_response']}\n---",
+                        "recency": recency_from_position(i, len(recent_messages), newest_first=True),
+                    }
+                    for i, msg in enumerate(recent_messages)
+                ]))
             
             # Se há uma query específica, tenta busca semântica no Mem0
             if query and self.mem0:
                 try:
-                    enriched_context = self.get_enriched_context(user_id, query, 3)
-                    if enriched_context and "Nenhuma memória" not in enriched_context:
-                        context_parts.append("\n🧠 Memórias relevantes:")
-                        context_parts.append(enriched_context)
+                    memories = self.mem0.search_memories(user_id, query, 3)
+                    snippets = []
+                    for memory in memories or []:
+                        text = memory.get('memory') or memory.get('text') or memory.get('content')
+                        if text:
+                            snippets.append({"text": f"- {text}", "relevance": memory.get('similarity')})
+                    if snippets:
+                        sections.append(("\n🧠 Memórias relevantes:", snippets))
                 except Exception as e:
                     logging.warning(f"Falha na busca semântica: {e}")
             
-            return "\n".join(context_parts) if context_parts else "Nenhum contexto anterior encontrado."
+            if not sections:
+                return "Nenhum contexto anterior encontrado."
+            
+            packed = context_packer.pack(sections, query=query, agent_id=agent_id, user_id=user_id,
+                                         token_budget=token_budget,
+                                         history_loader=self._history_loader(user_id) if user_id else None)
+            return packed["text"] or "Nenhum contexto anterior encontrado."
             
         except Exception as e:
              logging.error(f"Erro ao recuperar contexto de memória: {e}")
@@ -439,29 +471,32 @@ class DualMemoryService:
             logging.error(f"Erro ao adicionar memória: {e}")
             return False
 
-    def _extract_search_terms(self, query: str) -> List[str]:
+    def _history_loader(self, user_id: str) -> Callable[[], List[str]]:
+        """Carregador do histórico do usuário usado no IDF do analisador de consultas"""
+        def _load_history() -> List[str]:
+            messages = self.supabase.get_user_messages(user_id, 200)
+            return [
+                f"{msg.get('user_message', '')} {msg.get('agent_response', '')}"
+                for msg in messages or []
+            ]
+
+        return _load_history
+
+    def _get_query_analyzer(self, user_id: Optional[str] = None):
+        """Retorna o analisador de consultas do usuário (compilado a partir do histórico e cacheado)"""
+        return get_query_analyzer(user_id, self._history_loader(user_id) if user_id else None)
+
+    def _extract_search_terms(self, query: str, user_id: Optional[str] = None) -> List[str]:
         """
         Extrai termos de busca relevantes da query
+
+        Usa o analisador de consultas (stopwords, acentos, stemming leve) com
+        pesos IDF calculados a partir do histórico do próprio usuário.
         """
-        import re
-        
-        # Remove pontuação e converte para minúsculas
-        clean_query = re.sub(r'[^\w\s]', ' ', query.lower())
-        
-        # Divide em palavras e remove palavras muito curtas
-        words = [word.strip() for word in clean_query.split() if len(word.strip()) > 2]
-        
-        # Remove palavras comuns (stop words básicas em português)
-        stop_words = {
-            'que', 'para', 'com', 'uma', 'por', 'como', 'mais', 'mas', 'foi', 'dos', 
-            'tem', 'seu', 'sua', 'são', 'ele', 'ela', 'isso', 'este', 'esta', 'esse',
-            'essa', 'aquele', 'aquela', 'quando', 'onde', 'porque', 'qual', 'quais'
-        }
-        
-        terms = [word for word in words if word not in stop_words]
+        terms = self._get_query_analyzer(user_id).extract_search_terms(query, top_k=5)
         
-        # Retorna no máximo 5 termos mais relevantes
-        return terms[:5] if terms else [query.lower()]
+        # Retorna no máximo 5 termos mais relevantes (e suas variantes sem acento)
+        return terms if terms else [query.lower()]
 
 # Instância global do serviço de memória dupla
 dual_memory_service = DualMemoryService()
\ No newline at end of file
@@ -0,0 +1,216 @@
+"""
+Processamento idempotente por message_id
+Retentativas do gateway do WhatsApp reenviam a mesma mensagem; sem controle,
+cada reenvio gerava nova chamada ao modelo, novas linhas em mensagens_ia e
+novo enriquecimento. Aqui cada chave (escopo + message_id) é executada uma
+única vez: duplicatas simultâneas aguardam a execução em andamento e
+duplicatas posteriores recebem a resposta guardada durante a janela de
+retenção. Com Redis, a marcação (SET NX) vale entre workers; sem Redis, vale
+dentro do processo.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from redis_client import get_redis
+
+IDEMPOTENCY_RETENTION_SECONDS = int(os.getenv("IDEMPOTENCY_RETENTION_SECONDS", "3600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+# Validade da marcação "em andamento" no Redis (worker que caiu no meio da execução)
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "300"))
+# Quanto uma duplicata espera pela execução em outro worker antes de desistir (409)
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "120"))
+IDEMPOTENCY_POLL_SECONDS = float(os.getenv("IDEMPOTENCY_POLL_SECONDS", "0.2"))
+IDEMPOTENCY_PREFIX = os.getenv("IDEMPOTENCY_PREFIX", "agentos:idempotency")
+
+_PENDING = json.dumps({"state": "pending"})
+
+
+class IdempotencyInProgress(Exception):
+    """Mensagem ainda em processamento em outro worker após o tempo de espera (HTTP 409)"""
+
+
+def idempotency_key(scope: str, message_id: Optional[str], *parts: Optional[str]) -> Optional[str]:
+    """Chave de idempotência (None quando não há message_id: a requisição é processada normalmente)"""
+    if not message_id:
+        return None
+    return ":".join([scope, *(part or "" for part in parts), message_id])
+
+
+class IdempotencyStore:
+    """
+    Execuções em andamento (futures) e respostas concluídas por chave
+
+    run(key, func) executa func() uma vez por chave. A execução roda em uma
+    tarefa própria: se o cliente da primeira requisição desconectar, as
+    duplicatas que aguardam ainda recebem a resposta. Falhas não são
+    guardadas (a próxima retentativa executa de novo). O resultado precisa
+    ser serializável em JSON (vai para o Redis).
+    """
+
+    def __init__(self, retention: int = IDEMPOTENCY_RETENTION_SECONDS, max_entries: int = IDEMPOTENCY_MAX_ENTRIES,
+                 redis_getter: Callable[[], Any] = get_redis):
+        self.retention = retention
+        self.max_entries = max(max_entries, 1)
+        self._redis_getter = redis_getter
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._completed: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.stats = {"requests": 0, "executed": 0, "joined": 0, "replayed": 0, "remote_replayed": 0,
+                      "remote_waits": 0, "conflicts": 0, "failures": 0, "redis_errors": 0}
+
+    async def run(self, key: Optional[str], func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Executa func() uma única vez por chave
+
+        Returns:
+            (resultado, True se veio de uma execução anterior ou simultânea)
+
+        Raises:
+            IdempotencyInProgress: Outro worker ainda processa a mesma chave
+        """
+        return await self.run_many([key] if key else [], func)
+
+    async def run_many(self, keys: List[Optional[str]], func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Executa func() uma única vez para um conjunto de chaves (ex.: um turno com várias mensagens)
+
+        Se qualquer uma das chaves já tiver resultado (ou execução em
+        andamento), ele é reaproveitado; o resultado novo fica registrado sob
+        todas as chaves. Assim um reenvio de só parte das mensagens, ou
+        agrupado de outro jeito, não executa de novo.
+        """
+        keys = [key for key in dict.fromkeys(keys) if key]
+        if not keys:
+            return await func(), False
+        self.stats["requests"] += 1
+
+        for key in keys:
+            stored = self._completed.get(key)
+            if stored is None:
+                continue
+            if stored[0] > time.time():
+                self.stats["replayed"] += 1
+                self._remember(keys, stored[1])
+                return stored[1], True
+            del self._completed[key]
+
+        for key in keys:
+            task = self._inflight.get(key)
+            if task is not None:
+                self.stats["joined"] += 1
+                result, _ = await asyncio.shield(task)
+                self._remember(keys, result)
+                return result, True
+
+        task = asyncio.ensure_future(self._execute(keys, func))
+        for key in keys:
+            self._inflight[key] = task
+        task.add_done_callback(lambda done: self._finish(keys, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, keys: List[str], task: asyncio.Task):
+        for key in keys:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+        # Falhas já foram entregues a quem aguardava; evita o aviso de exceção não lida
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["failures"] += 1
+
+    def _remember(self, keys: List[str], result: Any):
+        for key in keys:
+            self._completed[key] = (time.time() + self.retention, result)
+            self._completed.move_to_end(key)
+        while len(self._completed) > self.max_entries:
+            self._completed.popitem(last=False)
+
+    @staticmethod
+    def _acquire(client: Any, redis_keys: List[str]) -> Tuple[bool, Optional[str]]:
+        """Marca todas as chaves como em andamento; se alguma já existir, desfaz e devolve o estado dela"""
+        acquired = []
+        for redis_key in redis_keys:
+            if client.set(redis_key, _PENDING, nx=True, ex=IDEMPOTENCY_LOCK_SECONDS):
+                acquired.append(redis_key)
+                continue
+            raw = client.get(redis_key)
+            if acquired:
+                client.delete(*acquired)
+            return False, raw
+        return True, None
+
+    @staticmethod
+    def _store(client: Any, redis_keys: List[str], payload: str, ttl: int):
+        for redis_key in redis_keys:
+            client.set(redis_key, payload, ex=ttl)
+
+    async def _execute(self, keys: List[str], func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        client = self._redis_getter()
+        if client is None:
+            return await self._execute_local(keys, func), False
+
+        redis_keys = [f"{IDEMPOTENCY_PREFIX}:{key}" for key in keys]
+        waited_since = None
+        while True:
+            try:
+                acquired, raw = await asyncio.to_thread(self._acquire, client, redis_keys)
+            except Exception as e:
+                # Redis fora do ar: a idempotência continua valendo dentro do processo
+                logging.warning(f"Idempotência de {keys[0]} só local: {e}")
+                self.stats["redis_errors"] += 1
+                return await self._execute_local(keys, func), False
+
+            if acquired:
+                try:
+                    result = await self._execute_local(keys, func)
+                except BaseException:
+                    await self._redis_call(client.delete, *redis_keys)
+                    raise
+                await self._redis_call(self._store, client, redis_keys,
+                                       json.dumps({"state": "done", "result": result}, ensure_ascii=False, default=str),
+                                       self.retention)
+                return result, False
+
+            if raw is None:
+                # A execução no outro worker falhou e liberou a chave: tenta assumir
+                continue
+            state = json.loads(raw)
+            if state.get("state") == "done":
+                self.stats["remote_replayed"] += 1
+                self._remember(keys, state.get("result"))
+                return state.get("result"), True
+
+            if waited_since is None:
+                waited_since = time.monotonic()
+                self.stats["remote_waits"] += 1
+            elif time.monotonic() - waited_since > IDEMPOTENCY_WAIT_SECONDS:
+                self.stats["conflicts"] += 1
+                raise IdempotencyInProgress(f"Mensagem {keys[0]} ainda em processamento")
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+    async def _execute_local(self, keys: List[str], func: Callable[[], Awaitable[Any]]) -> Any:
+        self.stats["executed"] += 1
+        result = await func()
+        self._remember(keys, result)
+        return result
+
+    async def _redis_call(self, method: Callable[..., Any], *args: Any, **kwargs: Any):
+        try:
+            await asyncio.to_thread(method, *args, **kwargs)
+        except Exception as e:
+            logging.warning(f"Falha ao atualizar a chave de idempotência: {e}")
+            self.stats["redis_errors"] += 1
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        stats["inflight"] = len(self._inflight)
+        stats["retained"] = len(self._completed)
+        stats["retention_seconds"] = self.retention
+        stats["backend"] = "redis" if self._redis_getter() is not None else "memory"
+        return stats
+
+
+# Instância global
+idempotency_store = IdempotencyStore()
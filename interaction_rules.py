@@ -0,0 +1,282 @@
+"""
+Regras de síntese de interações e extração de tópicos
+As regras (interesses do usuário, informações da resposta do agente e tópicos)
+são dados: um conjunto padrão e, opcionalmente, conjuntos por conta lidos do
+JSON em INTERACTION_RULES_PATH. Cada conjunto é compilado uma única vez em um
+matcher de múltiplas palavras-chave (regex combinada em forma de trie), que
+percorre o texto uma só vez e informa todas as regras acionadas.
+
+Formato do arquivo (as chaves ausentes herdam do conjunto padrão):
+    {
+        "default": {...},
+        "<id_conta>": {"interests": [...], "responses": [...], "topics": [...]}
+    }
+"""
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, FrozenSet, List, Optional, Sequence
+
+INTERACTION_RULES_PATH = os.getenv("INTERACTION_RULES_PATH")
+# Até este número de palavras distintas, testes diretos de substring são mais
+# rápidos que a regex combinada (ver benchmark_interaction_rules.py)
+INTERACTION_RULES_SCAN_LIMIT = int(os.getenv("INTERACTION_RULES_SCAN_LIMIT", "48"))
+
+# Regras originais (clínica): a ordem das listas define a prioridade
+DEFAULT_RULES: Dict = {
+    "interests": [
+        {"keywords": ["horário", "funciona", "aberto", "fechado", "atende"],
+         "interest": "horários de funcionamento", "detail": "quando funciona"},
+        {"keywords": ["preço", "valor", "custa", "quanto"],
+         "interest": "preços", "detail": "valores"},
+        {"keywords": ["produto", "serviço", "tem", "oferece", "disponível"],
+         "interest": "produtos/serviços", "detail": "disponibilidade"},
+        {"keywords": ["contato", "telefone", "whatsapp", "falar"],
+         "interest": "formas de contato", "detail": "como entrar em contato"},
+        {"keywords": ["agendar", "marcar", "consulta", "horario"],
+         "interest": "agendamento", "detail": "como agendar"},
+    ],
+    # Usado quando nenhum interesse casa e a mensagem tem mais de min_length caracteres
+    "fallback_interest": {"min_length": 10, "interest": "informações", "detail": "esclarecimentos"},
+    "synthesis_template": "Usuário demonstrou interesse em {interest} e quis saber {detail}. {response}",
+    "responses": [
+        {"keywords": ["funciona", "horário", "segunda", "sexta", "8h", "18h"],
+         "requires": ["segunda a sexta", "8h", "18h"],
+         "text": "Agente informou que funciona de segunda a sexta-feira, das 8h às 18h."},
+        {"pattern": r"(\d+(?:,\d+)?)\s*(?:reais?|r\$|mil)",
+         "text": "Agente informou valores de {values} reais."},
+        {"keywords": ["sim", "temos", "oferecemos", "disponível"],
+         "text": "Agente confirmou disponibilidade do serviço/produto."},
+        {"keywords": ["não", "não temos", "indisponível"],
+         "text": "Agente informou que o serviço/produto não está disponível."},
+        {"keywords": ["whatsapp", "telefone", "contato"],
+         "text": "Agente forneceu informações de contato."},
+        {"keywords": ["agendar", "marcar", "consulta"],
+         "text": "Agente forneceu informações sobre agendamento."},
+    ],
+    # Resumo genérico (primeiras palavras) para respostas sem regra correspondente
+    "response_summary": {"min_length": 20, "max_words": 15, "max_chars": 100,
+                         "text": "Agente informou que {summary}"},
+    "topics": [
+        {"keywords": ["horários de funcionamento"], "topics": ["horario", "funcionamento"]},
+        {"keywords": ["preços", "valores"], "topics": ["preco", "valor"]},
+        {"keywords": ["produtos", "serviços"], "topics": ["produto", "servico"]},
+        {"keywords": ["contato"], "topics": ["contato", "comunicacao"]},
+        {"keywords": ["agendamento"], "topics": ["agendamento", "consulta"]},
+    ],
+    "default_topics": ["geral"],
+}
+
+
+class KeywordMatcher:
+    """
+    Localiza, em uma única passada, quais grupos de palavras-chave aparecem no texto
+
+    A busca é por substring (mesma semântica de `palavra in texto`). As
+    palavras são compiladas em uma regex em forma de trie; o motor de regex
+    salta as posições que não iniciam nenhuma palavra e, a cada ocorrência,
+    a busca recomeça no caractere seguinte para encontrar sobreposições.
+    Conjuntos pequenos (até scan_limit palavras) testam cada palavra distinta
+    uma única vez, o que em textos curtos custa menos que a regex.
+    """
+
+    def __init__(self, groups: Sequence[Sequence[str]], scan_limit: int = INTERACTION_RULES_SCAN_LIMIT):
+        owners: Dict[str, set] = {}
+        for index, keywords in enumerate(groups):
+            for keyword in keywords:
+                keyword = keyword.lower()
+                if keyword:
+                    owners.setdefault(keyword, set()).add(index)
+
+        # A regex devolve a palavra mais longa em cada posição; as palavras
+        # que são prefixo dela também ocorreram ali
+        self._groups: Dict[str, FrozenSet[int]] = {}
+        for keyword in owners:
+            indexes = set()
+            for other, other_indexes in owners.items():
+                if keyword.startswith(other):
+                    indexes |= other_indexes
+            self._groups[keyword] = frozenset(indexes)
+
+        self._regex = None
+        self._scan = tuple((keyword, frozenset(indexes)) for keyword, indexes in owners.items())
+        if len(owners) > scan_limit:
+            self._regex = re.compile(_trie_pattern(owners))
+
+    def match(self, text: str) -> FrozenSet[int]:
+        """Índices dos grupos com pelo menos uma palavra presente no texto (já em minúsculas)"""
+        if not text:
+            return frozenset()
+        if self._regex is None:
+            found = set()
+            for keyword, indexes in self._scan:
+                if keyword in text:
+                    found |= indexes
+            return frozenset(found)
+        groups = self._groups
+        search = self._regex.search
+        found = set()
+        match = search(text)
+        while match:
+            found |= groups[match.group()]
+            match = search(text, match.start() + 1)
+        return frozenset(found)
+
+
+def _trie_pattern(words) -> str:
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    return _node_pattern(trie)
+
+
+def _node_pattern(node: Dict) -> str:
+    terminal = "" in node
+    branches = [re.escape(char) + _node_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+    # Quantificador guloso: tenta a palavra mais longa antes de aceitar o prefixo
+    if terminal:
+        return f"(?:{body})?" if len(branches) > 1 or len(branches[0]) > 1 else f"{body}?"
+    return body
+
+
+class InteractionRuleSet:
+    """Conjunto de regras compilado (uma instância por conta)"""
+
+    def __init__(self, rules: Dict):
+        self.rules = rules
+        self._interests = rules.get("interests") or []
+        self._responses = rules.get("responses") or []
+        self._topics = rules.get("topics") or []
+        self._fallback = rules.get("fallback_interest")
+        self._summary = rules.get("response_summary")
+        self._template = rules.get("synthesis_template") or DEFAULT_RULES["synthesis_template"]
+        self._default_topics = list(rules.get("default_topics") or [])
+
+        self._interest_matcher = KeywordMatcher([r.get("keywords", []) for r in self._interests])
+        self._topic_matcher = KeywordMatcher([r.get("keywords", []) for r in self._topics])
+
+        # Regras de resposta: palavras "keywords" (qualquer uma) e "requires"
+        # (todas) entram no mesmo matcher; "pattern" é compilado uma vez
+        groups: List[List[str]] = []
+        self._response_rules = []
+        for rule in self._responses:
+            any_group = None
+            if rule.get("keywords"):
+                any_group = len(groups)
+                groups.append(rule["keywords"])
+            required = []
+            for keyword in rule.get("requires", []):
+                required.append(len(groups))
+                groups.append([keyword])
+            pattern = re.compile(rule["pattern"]) if rule.get("pattern") else None
+            self._response_rules.append((any_group, required, pattern, rule.get("text", "")))
+        self._response_matcher = KeywordMatcher(groups)
+
+    def interest(self, user_message: str) -> Optional[Dict]:
+        """Interesse principal do usuário ({"interest", "detail"}) ou None se irrelevante"""
+        matched = self._interest_matcher.match(user_message.lower())
+        if matched:
+            rule = self._interests[min(matched)]
+            return {"interest": rule.get("interest"), "detail": rule.get("detail")}
+        if self._fallback and len(user_message.strip()) > self._fallback.get("min_length", 10):
+            return {"interest": self._fallback.get("interest"), "detail": self._fallback.get("detail")}
+        return None
+
+    def key_info(self, agent_response: str) -> Optional[str]:
+        """Informação principal da resposta do agente"""
+        response_lower = agent_response.lower()
+        matched = self._response_matcher.match(response_lower)
+        for any_group, required, pattern, text in self._response_rules:
+            if any_group is not None and any_group not in matched:
+                continue
+            if not all(index in matched for index in required):
+                continue
+            if pattern is not None:
+                values = pattern.findall(response_lower)
+                if not values:
+                    continue
+                return text.format(values=", ".join(values))
+            return text
+
+        summary_rule = self._summary
+        if summary_rule and len(agent_response.strip()) > summary_rule.get("min_length", 20):
+            summary = " ".join(agent_response.split()[:summary_rule.get("max_words", 15)])
+            max_chars = summary_rule.get("max_chars", 100)
+            if len(summary) > max_chars:
+                summary = summary[:max_chars - 3] + "..."
+            return summary_rule.get("text", "{summary}").format(summary=summary.lower())
+        return None
+
+    def synthesize(self, user_message: str, agent_response: str) -> Optional[str]:
+        """Síntese da interação ou None se não for relevante"""
+        interest = self.interest(user_message)
+        if not interest:
+            return None
+        response = self.key_info(agent_response)
+        if not response:
+            return None
+        return self._template.format(response=response, **interest)
+
+    def topics(self, synthesis: str) -> List[str]:
+        """Tópicos da síntese, para facilitar buscas futuras"""
+        matched = self._topic_matcher.match(synthesis.lower())
+        topics: List[str] = []
+        for index in sorted(matched):
+            topics.extend(self._topics[index].get("topics", []))
+        return list(dict.fromkeys(topics)) or list(self._default_topics)
+
+
+class InteractionRuleRegistry:
+    """Carrega os conjuntos de regras por conta e mantém as versões compiladas"""
+
+    def __init__(self, path: Optional[str] = INTERACTION_RULES_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._compiled: Dict[str, InteractionRuleSet] = {}
+        self._overrides: Dict[str, Dict] = {}
+        self._default_rules: Dict = DEFAULT_RULES
+        self.reload()
+
+    def reload(self):
+        """Relê o arquivo de regras e descarta os conjuntos compilados"""
+        overrides: Dict[str, Dict] = {}
+        if self.path:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if not isinstance(data, dict):
+                    raise ValueError("o arquivo deve conter um objeto JSON por conta")
+                overrides = {str(k): v for k, v in data.items() if isinstance(v, dict)}
+            except Exception as e:
+                logging.warning(f"Regras de interação em {self.path} ignoradas: {e}")
+        with self._lock:
+            self._overrides = overrides
+            self._default_rules = {**DEFAULT_RULES, **overrides.get("default", {})}
+            self._compiled = {}
+
+    def get(self, account_id: Optional[str] = None) -> InteractionRuleSet:
+        """Conjunto compilado da conta (ou o padrão, se a conta não tiver regras próprias)"""
+        key = str(account_id) if account_id is not None and str(account_id) in self._overrides else "default"
+        rule_set = self._compiled.get(key)
+        if rule_set is None:
+            with self._lock:
+                rule_set = self._compiled.get(key)
+                if rule_set is None:
+                    rules = self._default_rules
+                    if key != "default":
+                        rules = {**rules, **self._overrides[key]}
+                    rule_set = InteractionRuleSet(rules)
+                    self._compiled[key] = rule_set
+        return rule_set
+
+
+# Instância global
+interaction_rules = InteractionRuleRegistry()
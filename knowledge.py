@@ -51,6 +51,8 @@ class KnowledgeManager:
     
     def __init__(self):
         self.knowledge_bases: Dict[str, Knowledge] = {}
+        # Incrementada a cada alteração de conteúdo (invalida respostas em cache dos agentes)
+        self.version = 0
         self._initialize_default_knowledge()
     
     def _initialize_default_knowledge(self):
@@ -93,6 +95,7 @@ class KnowledgeManager:
             
             knowledge = self.knowledge_bases[knowledge_id]
             knowledge.sync()
+            self.version += 1
             logger.info(f"Base de conhecimento '{knowledge_id}' sincronizada com sucesso")
             return True
             
@@ -132,6 +135,7 @@ class KnowledgeManager:
             # Adiciona à base existente
             knowledge = self.knowledge_bases[knowledge_id]
             knowledge.sources.append(new_source)
+            self.version += 1
             
             logger.info(f"Nova fonte adicionada à base '{knowledge_id}'")
             return True
@@ -178,6 +182,7 @@ class KnowledgeManager:
             )
             
             self.knowledge_bases[knowledge_id] = knowledge
+            self.version += 1
             logger.info(f"Base de conhecimento '{knowledge_id}' criada com sucesso")
             return True
             
@@ -210,6 +215,7 @@ class KnowledgeManager:
                 return False
             
             del self.knowledge_bases[knowledge_id]
+            self.version += 1
             logger.info(f"Base de conhecimento '{knowledge_id}' removida com sucesso")
             return True
             
@@ -2,6 +2,7 @@ import os
 import logging
 from typing import List, Dict, Any, Optional
 from postgres_memory_system import PostgreSQLMemorySystem
+from context_packer import context_packer
 import threading
 import time
 
@@ -153,19 +154,25 @@ class MemoryManager:
         logging.warning("⚠️ update_memory não implementado para PostgreSQL")
         return False
     
-    def format_memories_for_context(self, memories: List[Dict[str, Any]]) -> str:
-        """Formata memórias para uso como contexto em conversas"""
+    def format_memories_for_context(self, memories: List[Dict[str, Any]], query: str = "",
+                                    agent_id: Optional[str] = None, user_id: Optional[str] = None,
+                                    token_budget: Optional[int] = None) -> str:
+        """Formata memórias para uso como contexto, respeitando o orçamento de tokens do agente"""
         if not memories:
             return "Nenhuma memória relevante encontrada."
         
-        context_parts = []
+        snippets = []
         for memory in memories:
-            if 'text' in memory:
-                context_parts.append(f"- {memory['text']}")
-            elif 'content' in memory:
-                context_parts.append(f"- {memory['content']}")
+            text = memory.get('text') or memory.get('content') or memory.get('memory')
+            if text:
+                snippets.append({"text": f"- {text}", "relevance": memory.get('similarity')})
         
-        return "\n".join(context_parts)
+        if not snippets:
+            return ""
+        
+        packed = context_packer.pack([("", snippets)], query=query, agent_id=agent_id,
+                                     user_id=user_id, token_budget=token_budget)
+        return packed["text"]
     
     def save_conversation(self, user_id: str, user_message: str, assistant_response: str, agent_name: str = "Assistant") -> bool:
         """Salva uma conversa completa na memória"""
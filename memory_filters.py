@@ -0,0 +1,97 @@
+"""
+Filtros de memórias enriquecidas (message_history.metadata) aplicados no banco
+Tipo e agente usam metadata->>chave (índices de expressão) e tópicos usam
+containment em metadata->'topics' (índice GIN), para que uma consulta
+filtrada retorne exatamente `limit` linhas. Ver message_history_metadata_indexes.sql
+
+Também implementa a paginação por cursor (keyset em created_at, id): cada
+página continua de onde a anterior parou, sem OFFSET, com custo constante.
+"""
+import base64
+import json
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+def postgrest_quote(value: str) -> str:
+    """Valor entre aspas para filtros do PostgREST (vírgulas, parênteses e aspas ficam literais)"""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def topics_or_filter(topics: List[str]) -> str:
+    """Filtro or_ do PostgREST: a memória contém pelo menos um dos tópicos"""
+    clauses = []
+    for topic in dict.fromkeys(str(t) for t in topics if t):
+        clauses.append(f"metadata->topics.cs.{postgrest_quote(json.dumps([topic], ensure_ascii=False))}")
+    return ",".join(clauses)
+
+
+def apply_memory_filters(query: Any, memory_type: Optional[str] = None, agent_id: Optional[str] = None,
+                         topics: Optional[List[str]] = None) -> Any:
+    """
+    Aplica os filtros de tipo, agente e tópicos na consulta de message_history
+
+    Args:
+        query: Consulta do cliente Supabase (ou do backend SQLite)
+        memory_type: Valor de metadata.type
+        agent_id: Valor de metadata.agent_id
+        topics: Tópicos aceitos (qualquer um deles)
+    """
+    if memory_type:
+        query = query.eq("metadata->>type", memory_type)
+    if agent_id:
+        query = query.eq("metadata->>agent_id", agent_id)
+    if topics:
+        topics_filter = topics_or_filter(topics)
+        if topics_filter:
+            query = query.or_(topics_filter)
+    return query
+
+
+# ==================== PAGINAÇÃO POR CURSOR ====================
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    """Cursor opaco apontando para depois da linha informada (created_at, id)"""
+    payload = json.dumps([row["created_at"], row["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, Any]:
+    """Converte o cursor em (created_at, id); lança ValueError se for inválido"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise ValueError("Cursor inválido")
+    if not isinstance(created_at, str) or not isinstance(row_id, (int, str)):
+        raise ValueError("Cursor inválido")
+    return created_at, row_id
+
+
+def apply_keyset_page(query: Any, cursor: Optional[str], limit: int) -> Any:
+    """
+    Ordena do mais recente para o mais antigo e posiciona a consulta após o cursor
+
+    Busca limit + 1 linhas para saber se existe próxima página (ver split_page).
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        created_at = json.dumps(created_at)  # entre aspas: o valor tem ':' e '+'
+        query = query.or_(f"created_at.lt.{created_at},and(created_at.eq.{created_at},id.lt.{row_id})")
+    return query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1)
+
+
+def split_page(rows: List[Dict[str, Any]], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Separa a página (até limit linhas) e o cursor da próxima (None na última página)"""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def iter_pages(fetch_page: Callable[[Optional[str]], Tuple[List[Dict[str, Any]], Optional[str]]],
+               cursor: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Percorre todas as páginas a partir do cursor, mantendo só uma página em memória"""
+    while True:
+        rows, cursor = fetch_page(cursor)
+        yield from rows
+        if not cursor:
+            return
@@ -0,0 +1,93 @@
+"""
+Estatísticas de memórias enriquecidas (message_history, role = 'system')
+Lidas das tabelas memory_stats e memory_topic_stats, mantidas por trigger no
+banco (ver memory_stats.sql): o custo não depende do número de memórias.
+Se as tabelas ainda não existirem, calcula a partir das memórias baixando
+apenas a coluna metadata.
+"""
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from memory_filters import apply_memory_filters
+
+ALL_AGENTS = "*"
+
+
+def _summarize(rows: Iterable[Dict], topic_rows: Iterable[Dict], source: str) -> Dict[str, Any]:
+    by_type: Dict[str, int] = {}
+    last_activity = None
+    for row in rows:
+        memory_type = row.get("memory_type") or ""
+        by_type[memory_type] = by_type.get(memory_type, 0) + int(row.get("total") or 0)
+        if row.get("last_activity") and (last_activity is None or row["last_activity"] > last_activity):
+            last_activity = row["last_activity"]
+
+    topics: Dict[str, Dict[str, Any]] = {}
+    for row in topic_rows:
+        entry = topics.setdefault(row["topic"], {"topic": row["topic"], "count": 0, "last_activity": None})
+        entry["count"] += int(row.get("total") or 0)
+        if row.get("last_activity") and (entry["last_activity"] is None or row["last_activity"] > entry["last_activity"]):
+            entry["last_activity"] = row["last_activity"]
+    topic_list = sorted(topics.values(), key=lambda t: (-t["count"], t["topic"]))
+
+    return {
+        "total_memories": sum(by_type.values()),
+        "last_activity": last_activity,
+        "by_type": by_type,
+        "unique_topics": len(topic_list),
+        "topics_list": [t["topic"] for t in topic_list],
+        "topics": topic_list,
+        "source": source,
+    }
+
+
+def _read_stats_tables(client: Any, user_id: str, agent_id: Optional[str],
+                       memory_type: Optional[str]) -> Dict[str, Any]:
+    results = []
+    for table, columns in (("memory_stats", "memory_type,total,last_activity"),
+                           ("memory_topic_stats", "memory_type,topic,total,last_activity")):
+        query = client.table(table).select(columns).eq("user_id", user_id).eq("agent_id", agent_id or ALL_AGENTS)
+        if memory_type:
+            query = query.eq("memory_type", memory_type)
+        results.append(query.execute().data or [])
+    return _summarize(results[0], results[1], "stats")
+
+
+def _scan_memories(client: Any, user_id: str, agent_id: Optional[str],
+                   memory_type: Optional[str]) -> Dict[str, Any]:
+    query = client.table("message_history").select("metadata,created_at")
+    query = query.eq("user_id", user_id).eq("role", "system")
+    result = apply_memory_filters(query, memory_type=memory_type, agent_id=agent_id).execute()
+
+    rows: List[Dict] = []
+    topic_rows: List[Dict] = []
+    for row in result.data or []:
+        metadata = row.get("metadata") or {}
+        created_at = row.get("created_at")
+        rows.append({"memory_type": metadata.get("type") or "", "total": 1, "last_activity": created_at})
+        topics = metadata.get("topics") or []
+        for topic in dict.fromkeys(topics if isinstance(topics, list) else []):
+            topic_rows.append({"topic": str(topic), "total": 1, "last_activity": created_at})
+    return _summarize(rows, topic_rows, "scan")
+
+
+def get_memory_statistics(client: Any, user_id: str, agent_id: Optional[str] = None,
+                          memory_type: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Estatísticas das memórias do usuário
+
+    Args:
+        client: Cliente Supabase (ou backend SQLite)
+        user_id: ID do usuário
+        agent_id: ID do agente (None = todos os agentes)
+        memory_type: Tipo de memória (None = todos os tipos)
+
+    Returns:
+        Dict com total_memories, last_activity, by_type, unique_topics,
+        topics_list, topics (contagem e última atividade por tópico) e source
+    """
+    try:
+        return _read_stats_tables(client, user_id, agent_id, memory_type)
+    except Exception as e:
+        logging.warning(f"Tabelas de estatísticas indisponíveis, calculando a partir das memórias: {e}")
+        return _scan_memories(client, user_id, agent_id, memory_type)
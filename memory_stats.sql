@@ -0,0 +1,111 @@
+-- Estatísticas de memórias enriquecidas mantidas pelo banco
+-- Execute este script no SQL Editor do Supabase (depois de message_history_metadata_indexes.sql)
+--
+-- memory_stats e memory_topic_stats são atualizadas por trigger a cada
+-- insert/update/delete de memórias (role = 'system') em message_history.
+-- Cada memória conta para o seu agente e para agent_id = '*' (todos os agentes),
+-- então a consulta de estatísticas lê poucas linhas, independente do volume.
+
+CREATE TABLE IF NOT EXISTS public.memory_stats (
+    user_id TEXT NOT NULL,
+    agent_id TEXT NOT NULL DEFAULT '',
+    memory_type TEXT NOT NULL DEFAULT '',
+    total BIGINT NOT NULL DEFAULT 0,
+    last_activity TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, agent_id, memory_type)
+);
+
+CREATE TABLE IF NOT EXISTS public.memory_topic_stats (
+    user_id TEXT NOT NULL,
+    agent_id TEXT NOT NULL DEFAULT '',
+    memory_type TEXT NOT NULL DEFAULT '',
+    topic TEXT NOT NULL,
+    total BIGINT NOT NULL DEFAULT 0,
+    last_activity TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, agent_id, memory_type, topic)
+);
+
+-- Aplica +1 (inclusão) ou -1 (remoção) de uma memória nas estatísticas
+CREATE OR REPLACE FUNCTION public.memory_stats_apply(p_row public.message_history, p_delta INTEGER)
+RETURNS VOID AS $$
+DECLARE
+    v_agent TEXT := COALESCE(p_row.metadata->>'agent_id', '');
+    v_type TEXT := COALESCE(p_row.metadata->>'type', '');
+    v_key TEXT;
+BEGIN
+    IF p_row.role IS DISTINCT FROM 'system' THEN
+        RETURN;
+    END IF;
+
+    FOREACH v_key IN ARRAY ARRAY[v_agent, '*'] LOOP
+        INSERT INTO public.memory_stats AS s (user_id, agent_id, memory_type, total, last_activity)
+        VALUES (p_row.user_id, v_key, v_type, GREATEST(p_delta, 0),
+                CASE WHEN p_delta > 0 THEN p_row.created_at END)
+        ON CONFLICT (user_id, agent_id, memory_type) DO UPDATE
+            SET total = s.total + p_delta,
+                last_activity = GREATEST(s.last_activity, EXCLUDED.last_activity),
+                updated_at = NOW();
+
+        IF jsonb_typeof(p_row.metadata->'topics') = 'array' THEN
+            INSERT INTO public.memory_topic_stats AS t (user_id, agent_id, memory_type, topic, total, last_activity)
+            SELECT p_row.user_id, v_key, v_type, topic, GREATEST(p_delta, 0),
+                   CASE WHEN p_delta > 0 THEN p_row.created_at END
+            FROM (SELECT DISTINCT jsonb_array_elements_text(p_row.metadata->'topics') AS topic) topics
+            ON CONFLICT (user_id, agent_id, memory_type, topic) DO UPDATE
+                SET total = t.total + p_delta,
+                    last_activity = GREATEST(t.last_activity, EXCLUDED.last_activity),
+                    updated_at = NOW();
+        END IF;
+    END LOOP;
+
+    IF p_delta < 0 THEN
+        DELETE FROM public.memory_topic_stats WHERE user_id = p_row.user_id AND total <= 0;
+        DELETE FROM public.memory_stats WHERE user_id = p_row.user_id AND total <= 0;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION public.message_history_stats_trigger()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM public.memory_stats_apply(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM public.memory_stats_apply(NEW, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_message_history_stats ON public.message_history;
+CREATE TRIGGER trg_message_history_stats
+    AFTER INSERT OR DELETE OR UPDATE OF role, user_id, metadata, created_at ON public.message_history
+    FOR EACH ROW
+    EXECUTE FUNCTION public.message_history_stats_trigger();
+
+-- Carga inicial a partir das memórias existentes (pode ser reexecutada para recalcular)
+BEGIN;
+LOCK TABLE public.message_history IN SHARE MODE;
+TRUNCATE public.memory_stats, public.memory_topic_stats;
+
+INSERT INTO public.memory_stats (user_id, agent_id, memory_type, total, last_activity)
+SELECT m.user_id, a.agent_id, COALESCE(m.metadata->>'type', ''), COUNT(*), MAX(m.created_at)
+FROM public.message_history m
+CROSS JOIN LATERAL (VALUES (COALESCE(m.metadata->>'agent_id', '')), ('*')) a(agent_id)
+WHERE m.role = 'system'
+GROUP BY 1, 2, 3;
+
+INSERT INTO public.memory_topic_stats (user_id, agent_id, memory_type, topic, total, last_activity)
+SELECT m.user_id, a.agent_id, COALESCE(m.metadata->>'type', ''), t.topic, COUNT(*), MAX(m.created_at)
+FROM public.message_history m
+CROSS JOIN LATERAL (VALUES (COALESCE(m.metadata->>'agent_id', '')), ('*')) a(agent_id)
+CROSS JOIN LATERAL (
+    SELECT DISTINCT jsonb_array_elements_text(m.metadata->'topics') AS topic
+    WHERE jsonb_typeof(m.metadata->'topics') = 'array'
+) t
+WHERE m.role = 'system'
+GROUP BY 1, 2, 3, 4;
+COMMIT;
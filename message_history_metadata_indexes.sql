@@ -0,0 +1,31 @@
+-- Índices para os filtros de memórias enriquecidas em message_history.metadata
+-- Execute este script no SQL Editor do Supabase
+--
+-- Consultas atendidas (PostgREST):
+--   .eq("metadata->>type", ...)      -> idx_message_history_user_type_created
+--   .eq("metadata->>agent_id", ...)  -> idx_message_history_user_agent_created
+--   or=(metadata->topics.cs.["t"])   -> idx_message_history_topics_gin
+--   .contains("metadata", {...})     -> idx_message_history_metadata_gin
+
+-- Requer metadata do tipo JSONB (padrão de message_history)
+
+-- Memórias por usuário + tipo, mais recentes primeiro (só linhas de memória)
+CREATE INDEX IF NOT EXISTS idx_message_history_user_type_created
+    ON public.message_history (user_id, (metadata->>'type'), created_at DESC)
+    WHERE role = 'system';
+
+-- Memórias por usuário + agente, mais recentes primeiro
+CREATE INDEX IF NOT EXISTS idx_message_history_user_agent_created
+    ON public.message_history (user_id, (metadata->>'agent_id'), created_at DESC)
+    WHERE role = 'system';
+
+-- Tópicos: containment (@>) no array metadata->'topics'
+CREATE INDEX IF NOT EXISTS idx_message_history_topics_gin
+    ON public.message_history USING GIN ((metadata->'topics') jsonb_path_ops)
+    WHERE role = 'system';
+
+-- Demais filtros por containment no metadata (ex.: memory_id)
+CREATE INDEX IF NOT EXISTS idx_message_history_metadata_gin
+    ON public.message_history USING GIN (metadata jsonb_path_ops);
+
+ANALYZE public.message_history;
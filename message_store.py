@@ -0,0 +1,127 @@
+"""
+Armazenamento indexado de mensagens em memória
+Usado pelo SupabaseService no modo fallback (sem Supabase): mantém deques
+por sessão e por usuário em ordem de gravação e um índice invertido de
+trigramas para a busca por substring
+"""
+import threading
+from collections import deque
+from itertools import count, islice
+from typing import Dict, Iterator, List, Set
+
+NGRAM_SIZE = 3
+
+
+def _message_text(message: Dict) -> str:
+    return ((message.get("user_message") or "") + "\n" + (message.get("agent_response") or "")).lower()
+
+
+def _ngrams(text: str) -> Set[str]:
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+class InMemoryMessageStore:
+    """
+    Mensagens indexadas por sessão, usuário e trigramas do conteúdo
+
+    Cada mensagem recebe um número de sequência crescente, que define a ordem
+    cronológica (no modo em memória o created_at é sempre "now()").
+    """
+
+    def __init__(self):
+        self._seq = count()
+        self._messages: Dict[int, Dict] = {}
+        self._texts: Dict[int, str] = {}
+        self._by_session: Dict[str, deque] = {}
+        self._by_user: Dict[str, deque] = {}
+        # user_id -> trigrama -> sequências das mensagens que o contêm
+        self._index: Dict[str, Dict[str, Set[int]]] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self) -> Iterator[Dict]:
+        with self._lock:
+            return iter([self._messages[seq] for seq in sorted(self._messages)])
+
+    def append(self, message: Dict) -> Dict:
+        """Adiciona uma mensagem e atualiza os índices"""
+        with self._lock:
+            seq = next(self._seq)
+            text = _message_text(message)
+            self._messages[seq] = message
+            self._texts[seq] = text
+            self._by_session.setdefault(message.get("session_id"), deque()).append(seq)
+            user_id = message.get("user_id")
+            self._by_user.setdefault(user_id, deque()).append(seq)
+            postings = self._index.setdefault(user_id, {})
+            for gram in _ngrams(text):
+                postings.setdefault(gram, set()).add(seq)
+        return message
+
+    # ==================== CONSULTAS ====================
+
+    def session_messages(self, session_id: str, limit: int = 50) -> List[Dict]:
+        """Primeiras mensagens da sessão em ordem cronológica"""
+        with self._lock:
+            seqs = self._by_session.get(session_id, ())
+            return [self._messages[seq] for seq in islice(seqs, max(limit, 0))]
+
+    def recent_session_messages(self, session_id: str, limit: int = 10) -> List[Dict]:
+        """Últimas mensagens da sessão em ordem cronológica"""
+        with self._lock:
+            seqs = self._by_session.get(session_id, ())
+            recent = list(islice(reversed(seqs), max(limit, 0)))
+            return [self._messages[seq] for seq in reversed(recent)]
+
+    def user_messages(self, user_id: str, limit: int = 100) -> List[Dict]:
+        """Mensagens do usuário, mais recentes primeiro"""
+        with self._lock:
+            seqs = self._by_user.get(user_id, ())
+            return [self._messages[seq] for seq in islice(reversed(seqs), max(limit, 0))]
+
+    def search(self, user_id: str, terms: List[str], limit: int = 10) -> List[Dict]:
+        """
+        Mensagens do usuário que contêm qualquer um dos termos (sem diferenciar maiúsculas)
+
+        Termos com pelo menos 3 caracteres usam o índice de trigramas e os
+        candidatos são confirmados por substring; termos menores percorrem
+        as mensagens do usuário.
+        """
+        terms = [term.lower() for term in terms if term]
+        if not terms or limit <= 0:
+            return []
+        with self._lock:
+            user_seqs = self._by_user.get(user_id)
+            if not user_seqs:
+                return []
+            if any(len(term) < NGRAM_SIZE for term in terms):
+                candidates = user_seqs
+            else:
+                postings = self._index.get(user_id, {})
+                found: Set[int] = set()
+                for term in terms:
+                    found |= self._candidates(postings, term)
+                candidates = sorted(found)
+
+            results = []
+            for seq in reversed(candidates):
+                text = self._texts[seq]
+                if any(term in text for term in terms):
+                    results.append(self._messages[seq])
+                    if len(results) >= limit:
+                        break
+            return results
+
+    @staticmethod
+    def _candidates(postings: Dict[str, Set[int]], term: str) -> Set[int]:
+        grams = sorted((postings.get(gram, set()) for gram in _ngrams(term)), key=len)
+        if not grams or not grams[0]:
+            return set()
+        result = set(grams[0])
+        for posting in grams[1:]:
+            result &= posting
+            if not result:
+                break
+        return result
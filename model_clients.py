@@ -0,0 +1,135 @@
+"""
+Clientes de modelo compartilhados
+Cada objeto de modelo do Agno (OpenAIChat / OpenRouterModel) criava o seu
+próprio cliente OpenAI, com pool HTTP e sessões TLS próprios. Aqui os
+clientes são criados uma vez por (provider, base_url, credencial) e
+reutilizados por todos os agentes: o cliente OpenAI síncrono é thread-safe e
+as conexões abertas por um agente servem os demais. Os objetos de modelo
+continuam um por agente, porque o Agent do Agno altera o modelo (ferramentas,
+funções) ao preparar cada execução.
+"""
+import hashlib
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import httpx  # type: ignore
+except Exception:  # dependência do SDK da OpenAI
+    httpx = None  # type: ignore
+
+try:
+    from openai import OpenAI  # type: ignore
+except Exception:  # pacote pode não estar instalado em ambiente de testes
+    OpenAI = None  # type: ignore
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+MODEL_POOL_MAX_CONNECTIONS = int(os.getenv("MODEL_POOL_MAX_CONNECTIONS", "100"))
+MODEL_POOL_MAX_KEEPALIVE = int(os.getenv("MODEL_POOL_MAX_KEEPALIVE", "20"))
+MODEL_POOL_KEEPALIVE_EXPIRY = float(os.getenv("MODEL_POOL_KEEPALIVE_EXPIRY", "60"))
+MODEL_HTTP_TIMEOUT = float(os.getenv("MODEL_HTTP_TIMEOUT", "60"))
+MODEL_CONNECT_TIMEOUT = float(os.getenv("MODEL_CONNECT_TIMEOUT", "5"))
+# Abre a primeira conexão (TLS) em segundo plano assim que o cliente é criado
+MODEL_CLIENT_PREWARM = os.getenv("MODEL_CLIENT_PREWARM", "false").lower() == "true"
+
+
+def _credential_hash(api_key: Optional[str]) -> str:
+    # A chave não fica exposta nas métricas nem nos logs
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+class ModelClientCache:
+    """Clientes OpenAI compartilhados por (provider, base_url, credencial)"""
+
+    def __init__(self, prewarm: bool = MODEL_CLIENT_PREWARM):
+        self.prewarm = prewarm
+        self._clients: Dict[Tuple[str, str, str], Any] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "attached": 0, "attach_errors": 0, "prewarm_errors": 0}
+
+    def get_client(self, provider: str, base_url: Optional[str], api_key: Optional[str]) -> Optional[Any]:
+        """Cliente compartilhado (None se o SDK da OpenAI não estiver instalado)"""
+        if OpenAI is None or httpx is None:
+            return None
+        key = (provider, base_url or DEFAULT_BASE_URL, _credential_hash(api_key))
+        client = self._clients.get(key)
+        if client is not None:
+            with self._lock:
+                self.stats["hits"] += 1
+            return client
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self.stats["hits"] += 1
+                return client
+            self.stats["misses"] += 1
+            client = OpenAI(
+                api_key=api_key,
+                base_url=key[1],
+                http_client=httpx.Client(
+                    limits=httpx.Limits(max_connections=MODEL_POOL_MAX_CONNECTIONS,
+                                        max_keepalive_connections=MODEL_POOL_MAX_KEEPALIVE,
+                                        keepalive_expiry=MODEL_POOL_KEEPALIVE_EXPIRY),
+                    timeout=httpx.Timeout(MODEL_HTTP_TIMEOUT, connect=MODEL_CONNECT_TIMEOUT),
+                ),
+            )
+            self._clients[key] = client
+        if self.prewarm:
+            threading.Thread(target=self._prewarm, args=(client,), daemon=True).start()
+        return client
+
+    def _prewarm(self, client: Any):
+        try:
+            client.models.list()
+        except Exception as e:
+            logging.info(f"Pré-aquecimento do cliente de modelo falhou: {e}")
+            with self._lock:
+                self.stats["prewarm_errors"] += 1
+
+    def create_model(self, model_class: Any, provider: str, model_id: str,
+                     api_key: Optional[str], base_url: Optional[str] = None) -> Any:
+        """Cria o objeto de modelo do agente já ligado ao cliente compartilhado"""
+        kwargs = {"model_id": model_id, "api_key": api_key}
+        if base_url:
+            kwargs["base_url"] = base_url
+        model = model_class(**kwargs)
+        client = self.get_client(provider, base_url, api_key)
+        if client is not None:
+            try:
+                # OpenAILike.get_client() devolve self.client quando já definido
+                model.client = client
+                with self._lock:
+                    self.stats["attached"] += 1
+            except Exception as e:
+                logging.warning(f"Modelo {model_id} sem cliente compartilhado: {e}")
+                with self._lock:
+                    self.stats["attach_errors"] += 1
+        return model
+
+    def close(self):
+        """Fecha os pools HTTP (encerramento do processo)"""
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            try:
+                client.close()
+            except Exception:
+                pass
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["clients"] = [{"provider": p, "base_url": u, "credential": c} for p, u, c in self._clients]
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        stats["pool"] = {
+            "max_connections": MODEL_POOL_MAX_CONNECTIONS,
+            "max_keepalive_connections": MODEL_POOL_MAX_KEEPALIVE,
+            "keepalive_expiry": MODEL_POOL_KEEPALIVE_EXPIRY,
+        }
+        return stats
+
+
+# Instância global
+model_clients = ModelClientCache()
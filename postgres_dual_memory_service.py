@@ -76,7 +76,7 @@ class PostgresDualMemoryService:
             Lista de mensagens da sessão
         """
         try:
-            return self.supabase.get_session_messages(session_id, limit)
+            return self.supabase.get_recent_session_messages(session_id, limit)
         except Exception as e:
             logging.error(f"Erro ao recuperar histórico da sessão: {e}")
             return []
@@ -11,6 +11,8 @@ import numpy as np
 from typing import List, Dict, Optional
 from datetime import datetime
 import os
+from context_packer import context_packer, recency_from_position
+from session_history_cache import message_history_cache, fetch_recent
 
 # Configuração da OpenAI - Nova API
 openai_client = OpenAI(
@@ -113,7 +115,9 @@ class PostgreSQLMemorySystem:
             cur.execute("""
                 INSERT INTO message_history (session_id, user_id, role, content, metadata)
                 VALUES (%s, %s, %s, %s, %s)
+                RETURNING created_at
             """, (session_id, user_id, role, content, json.dumps(metadata)))
+            created_at = cur.fetchone()[0]
             
             conn.commit()
         except Exception as e:
@@ -123,9 +127,24 @@ class PostgreSQLMemorySystem:
         finally:
             cur.close()
             conn.close()
+        
+        # Write-through no cache quente da sessão
+        message_history_cache.append(session_id, {
+            'role': role,
+            'content': content,
+            'metadata': metadata,
+            'created_at': created_at.isoformat() if created_at else None
+        })
     
     def get_history(self, session_id: str, limit: int = 50) -> List[Dict]:
-        """Recupera histórico de uma sessão"""
+        """Recupera histórico de uma sessão (lendo primeiro do cache)"""
+        try:
+            return fetch_recent(message_history_cache, session_id, limit, self._load_history)
+        except Exception as e:
+            print(f"Erro ao buscar histórico: {e}")
+            return []
+    
+    def _load_history(self, session_id: str, limit: int) -> List[Dict]:
         conn = self.get_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         
@@ -148,10 +167,6 @@ class PostgreSQLMemorySystem:
                 })
             
             return list(reversed(messages))  # Retorna em ordem cronológica
-            
-        except Exception as e:
-            print(f"Erro ao buscar histórico: {e}")
-            return []
         finally:
             cur.close()
             conn.close()
@@ -330,40 +345,63 @@ class PostgreSQLMemorySystem:
             print(f"Erro no processamento: {e}")
             return []
     
-    def get_context(self, user_id: str, current_message: str = "", session_id: str = "") -> str:
-        """Recupera contexto completo para o agente"""
-        context_parts = []
+    def get_context(self, user_id: str, current_message: str = "", session_id: str = "",
+                    agent_id: Optional[str] = None, token_budget: Optional[int] = None) -> str:
+        """
+        Recupera contexto completo para o agente
+
+        O contexto é empacotado dentro do orçamento de tokens do agente
+        (ver context_packer), priorizando trechos relevantes e recentes.
+        """
+        sections = []
         
         try:
             # Busca memórias relevantes se houver mensagem atual
             if current_message:
                 relevant = self.search_memories(user_id, current_message, limit=3)
                 if relevant:
-                    context_parts.append("Informações relevantes sobre o usuário:")
-                    for mem in relevant:
-                        context_parts.append(f"• {mem['memory']} (similaridade: {mem['similarity']:.2f})")
+                    sections.append(("Informações relevantes sobre o usuário:", [
+                        {
+                            "text": f"• {mem['memory']} (similaridade: {mem['similarity']:.2f})",
+                            "relevance": mem['similarity'],
+                        }
+                        for mem in relevant
+                    ]))
             
             # Busca histórico recente da sessão
             if session_id:
                 history = self.get_history(session_id, limit=6)  # Últimas 3 trocas
                 if history:
-                    context_parts.append("\nHistórico recente da conversa:")
-                    for msg in history[-6:]:  # Últimas 6 mensagens
+                    recent = history[-6:]  # Últimas 6 mensagens
+                    snippets = []
+                    for i, msg in enumerate(recent):
                         role_emoji = "👤" if msg['role'] == "user" else "🤖"
-                        context_parts.append(f"{role_emoji} {msg['content'][:100]}...")
+                        snippets.append({
+                            "text": f"{role_emoji} {msg['content'][:100]}...",
+                            "recency": recency_from_position(i, len(recent), newest_first=False),
+                        })
+                    sections.append(("\nHistórico recente da conversa:", snippets))
             
             # Busca memórias gerais (limitado)
             all_memories = self.get_all_user_memories(user_id, limit=5)
             if all_memories:
-                context_parts.append("\nO que sei sobre o usuário:")
-                for mem in all_memories:
-                    context_parts.append(f"• {mem['memory']}")
+                sections.append(("\nO que sei sobre o usuário:", [
+                    {
+                        "text": f"• {mem['memory']}",
+                        "recency": recency_from_position(i, len(all_memories), newest_first=True),
+                    }
+                    for i, mem in enumerate(all_memories)
+                ]))
             
         except Exception as e:
             print(f"Erro ao gerar contexto: {e}")
-            context_parts.append("Erro ao recuperar contexto da memória.")
+            sections.append(("", [{"text": "Erro ao recuperar contexto da memória."}]))
         
-        return "\n".join(context_parts) if context_parts else ""
+        if not sections:
+            return ""
+        packed = context_packer.pack(sections, query=current_message, agent_id=agent_id,
+                                     user_id=user_id, token_budget=token_budget)
+        return packed["text"]
 
 def test_postgres_memory():
     """Testa o sistema de memória PostgreSQL"""
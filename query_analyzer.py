@@ -0,0 +1,283 @@
+"""
+Analisador de consultas em português para extração de termos de busca
+Normaliza acentos, remove stopwords, aplica stemming leve e pondera os termos
+por IDF calculado sobre o histórico do próprio usuário
+"""
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Stopwords do português já sem acentos (a comparação é feita após o folding)
+PORTUGUESE_STOPWORDS = frozenset({
+    "a", "ao", "aos", "aquela", "aquelas", "aquele", "aqueles", "aquilo", "as", "ate",
+    "bem", "boa", "bom", "cada", "com", "como", "contra", "da", "das", "de", "dela",
+    "delas", "dele", "deles", "depois", "desde", "dessa", "dessas", "desse", "desses",
+    "desta", "destas", "deste", "destes", "deve", "do", "dos", "e", "ela", "elas",
+    "ele", "eles", "em", "entao", "entre", "era", "eram", "essa", "essas", "esse",
+    "esses", "esta", "estamos", "estao", "estar", "estas", "estava", "estavam", "este",
+    "esteja", "estes", "estou", "eu", "foi", "fomos", "for", "foram", "fosse", "fui",
+    "ha", "isso", "isto", "ja", "la", "lhe", "lhes", "mais", "mas", "me", "mesmo",
+    "meu", "meus", "minha", "minhas", "muito", "muitos", "na", "nao", "nas", "nem",
+    "nessa", "nesse", "nesta", "neste", "no", "nos", "nossa", "nossas", "nosso",
+    "nossos", "num", "numa", "o", "oi", "ola", "onde", "os", "ou", "para", "pela",
+    "pelas", "pelo", "pelos", "per", "perante", "pode", "poderia", "por", "porque",
+    "pois", "quais", "qual", "qualquer", "quando", "que", "quem", "quero", "queria",
+    "sao", "se", "seja", "sejam", "sem", "sera", "seu", "seus", "si", "sim", "sob",
+    "sobre", "sua", "suas", "tal", "tambem", "te", "tem", "temos", "tenho", "ter",
+    "teu", "teus", "ti", "tinha", "tu", "tua", "tuas", "tudo", "um", "uma", "umas",
+    "uns", "vai", "voce", "voces", "vos", "vou", "gostaria", "favor", "obrigado",
+    "obrigada", "tipo", "algum", "alguma", "alguns", "algumas", "aqui",
+    "ai", "agora", "ainda", "assim", "ne", "pra", "pro", "pras", "pros", "ta", "to",
+    "quanto", "quanta", "quantos", "quantas", "posso", "podemos", "podem", "preciso",
+    "precisa", "fazer", "faz", "sei", "saber", "nessa", "nesse", "dessa", "desse",
+})
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_VOWELS = frozenset("aeiou")
+
+# Regras aplicadas em ordem; cada tupla é (sufixo, substituição, tamanho mínimo do radical)
+_PLURAL_RULES = (
+    ("oes", "ao", 2), ("aes", "ao", 2), ("ais", "al", 2), ("eis", "el", 2),
+    ("ois", "ol", 2), ("res", "r", 2), ("ses", "s", 2), ("ns", "m", 2), ("s", "", 3),
+)
+_ADVERB_RULES = (("mente", "", 4),)
+_NOUN_RULES = (
+    ("amento", "", 3), ("imento", "", 3), ("acao", "", 3), ("icao", "", 3),
+    ("ucao", "", 3), ("agem", "", 3), ("idade", "", 3), ("ismo", "", 3),
+    ("ista", "", 3), ("avel", "", 3), ("ivel", "", 3),
+)
+_VERB_RULES = (
+    ("ando", "", 4), ("endo", "", 4), ("indo", "", 4), ("ar", "", 4),
+    ("er", "", 4), ("ir", "", 4), ("ou", "", 4), ("am", "", 4), ("em", "", 4),
+)
+
+
+def fold_accents(text: str) -> str:
+    """Converte para minúsculas e remove acentos (á → a, ç → c)"""
+    decomposed = unicodedata.normalize("NFKD", (text or "").lower())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def _apply_rules(word: str, rules) -> str:
+    for suffix, replacement, min_stem in rules:
+        if word.endswith(suffix) and len(word) - len(suffix) >= min_stem:
+            return word[: -len(suffix)] + replacement
+    return word
+
+
+@lru_cache(maxsize=50000)
+def stem(word: str) -> str:
+    """
+    Stemming leve para português (palavra já sem acentos)
+
+    Inspirado no RSLP: reduz plural, advérbios em -mente, sufixos nominais
+    comuns, terminações verbais e a vogal temática final.
+    """
+    if len(word) <= 3 or word.isdigit():
+        return word
+    stemmed = _apply_rules(word, _PLURAL_RULES)
+    stemmed = _apply_rules(stemmed, _ADVERB_RULES)
+    reduced = _apply_rules(stemmed, _NOUN_RULES)
+    if reduced == stemmed:
+        reduced = _apply_rules(stemmed, _VERB_RULES)
+    stemmed = reduced
+    # Remove a vogal temática final (consulta/consulto → consult)
+    if (len(stemmed) > 4 and stemmed[-1] in "aeo" and stemmed[-2] not in _VOWELS):
+        stemmed = stemmed[:-1]
+    return stemmed
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokeniza o texto após remover acentos e converter para minúsculas"""
+    return _TOKEN_RE.findall(fold_accents(text))
+
+
+class QueryAnalyzer:
+    """Analisador de consultas com pesos IDF calculados a partir do histórico do usuário"""
+
+    def __init__(self, documents: Iterable[str] = (), stopwords: frozenset = PORTUGUESE_STOPWORDS,
+                 min_length: int = 3):
+        """
+        Compila o analisador
+
+        Args:
+            documents: Textos do histórico do usuário usados para calcular o IDF
+            stopwords: Conjunto de stopwords (sem acentos)
+            min_length: Tamanho mínimo de um token para ser considerado
+        """
+        self.stopwords = stopwords
+        self.min_length = min_length
+        self.document_frequency: Counter = Counter()
+        self.total_documents = 0
+        for document in documents:
+            stems = {stem(token) for token in tokenize(document) if self._is_candidate(token)}
+            if stems:
+                self.document_frequency.update(stems)
+                self.total_documents += 1
+
+    def _is_candidate(self, token: str) -> bool:
+        return len(token) >= self.min_length and token not in self.stopwords
+
+    def idf(self, term_stem: str) -> float:
+        """IDF suavizado do radical no histórico do usuário"""
+        df = self.document_frequency.get(term_stem, 0)
+        return math.log((self.total_documents + 1) / (df + 1)) + 1.0
+
+    def analyze(self, query: str) -> List[Dict]:
+        """
+        Analisa a consulta e retorna os termos candidatos com pontuação
+
+        Returns:
+            Lista de dicts com stem, pattern (prefixo usado na busca), df, idf e score
+        """
+        lowered = (query or "").lower()
+        terms: "OrderedDict[str, Dict]" = OrderedDict()
+        for match in re.finditer(r"\w+", lowered):
+            surface = match.group(0)
+            folded = fold_accents(surface)
+            if not folded.isalnum() or not self._is_candidate(folded):
+                continue
+            term_stem = stem(folded)
+            if term_stem in terms:
+                terms[term_stem]["tf"] += 1
+                continue
+            terms[term_stem] = {
+                "stem": term_stem,
+                "pattern": self._search_pattern(surface, folded, term_stem),
+                "position": len(terms),
+                "tf": 1,
+            }
+
+        for term in terms.values():
+            df = self.document_frequency.get(term["stem"], 0)
+            term["df"] = df
+            term["idf"] = self.idf(term["stem"])
+            score = term["idf"] * (1.0 + 0.05 * min(len(term["stem"]), 10))
+            # Termo ausente do histórico não recupera nada na busca textual
+            if self.total_documents and df == 0:
+                score *= 0.1
+            term["score"] = score
+        return list(terms.values())
+
+    def top_terms(self, query: str, top_k: int = 5, min_relative_score: float = 0.6) -> List[Dict]:
+        """
+        Retorna os top-k termos mais discriminativos da consulta
+
+        Termos com pontuação abaixo de min_relative_score × melhor pontuação são
+        descartados: na busca por OR eles só trariam resultados fora do assunto.
+        """
+        ranked = sorted(self.analyze(query), key=lambda t: (-t["score"], t["position"]))
+        if not ranked:
+            return []
+        cutoff = ranked[0]["score"] * min_relative_score
+        return [term for term in ranked[:top_k] if term["score"] >= cutoff]
+
+    def extract_search_terms(self, query: str, top_k: int = 5) -> List[str]:
+        """
+        Retorna os padrões de busca dos top-k termos
+
+        Cada termo gera o prefixo original (com acentos) e, se diferente, sua
+        versão sem acentos, para que buscas por substring (ilike) encontrem
+        as duas grafias.
+        """
+        patterns: List[str] = []
+        for term in self.top_terms(query, top_k):
+            for pattern in (term["pattern"], fold_accents(term["pattern"])):
+                if pattern not in patterns:
+                    patterns.append(pattern)
+        return patterns
+
+    def relevance(self, terms: List[Dict], text: str) -> float:
+        """Soma das pontuações dos termos cujo radical aparece no texto"""
+        text_stems = {stem(token) for token in tokenize(text) if self._is_candidate(token)}
+        return sum(term["score"] for term in terms if term["stem"] in text_stems)
+
+    def rerank(self, query: str, candidates: List[Dict], text_of: Callable[[Dict], str],
+               top_k: int = 5, limit: Optional[int] = None) -> List[Dict]:
+        """
+        Reordena candidatos (já em ordem de recência) pela relevância ponderada por IDF
+
+        Empates mantêm a ordem original, preservando a preferência por mensagens recentes.
+        """
+        terms = self.top_terms(query, top_k)
+        if not terms:
+            return candidates[:limit] if limit else candidates
+        scored = [(-self.relevance(terms, text_of(c)), i, c) for i, c in enumerate(candidates)]
+        scored.sort(key=lambda item: (item[0], item[1]))
+        ranked = [c for _, _, c in scored]
+        return ranked[:limit] if limit else ranked
+
+    @staticmethod
+    def _search_pattern(surface: str, folded: str, term_stem: str) -> str:
+        # Maior prefixo comum entre o token e seu radical, preservando os acentos originais
+        common = 0
+        for a, b in zip(folded, term_stem):
+            if a != b:
+                break
+            common += 1
+        if common < 3 or len(surface) != len(folded):
+            return surface
+        return surface[:common]
+
+
+class QueryAnalyzerCache:
+    """Cache LRU com TTL de analisadores compilados por usuário"""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str, history_loader: Optional[Callable[[], Iterable[str]]] = None) -> QueryAnalyzer:
+        """Retorna o analisador do usuário, compilando-o a partir do histórico se necessário"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        documents: Iterable[str] = ()
+        if history_loader is not None:
+            try:
+                documents = list(history_loader() or [])
+            except Exception:
+                documents = ()
+        analyzer = QueryAnalyzer(documents)
+
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl_seconds, analyzer)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return analyzer
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """Descarta o analisador de um usuário (ou todos)"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+
+_default_analyzer = QueryAnalyzer()
+query_analyzer_cache = QueryAnalyzerCache()
+
+
+def get_query_analyzer(user_id: Optional[str] = None,
+                       history_loader: Optional[Callable[[], Iterable[str]]] = None) -> QueryAnalyzer:
+    """Retorna o analisador do usuário (ou um analisador sem histórico)"""
+    if not user_id:
+        return _default_analyzer
+    return query_analyzer_cache.get(user_id, history_loader)
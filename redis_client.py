@@ -0,0 +1,48 @@
+"""
+Cliente Redis compartilhado (opcional)
+Retorna None quando REDIS_URL não está configurada, a lib não está instalada
+ou o servidor não responde; os chamadores usam fallback em memória
+"""
+import logging
+import os
+import threading
+from typing import Optional
+
+try:
+    import redis  # type: ignore
+except Exception:  # pacote opcional
+    redis = None  # type: ignore
+
+_client = None
+_initialized = False
+_lock = threading.Lock()
+
+
+def get_redis() -> Optional["redis.Redis"]:
+    """Retorna o cliente Redis do processo (ou None se indisponível)"""
+    global _client, _initialized
+    if _initialized:
+        return _client
+    with _lock:
+        if _initialized:
+            return _client
+        _initialized = True
+        url = os.getenv("REDIS_URL")
+        if not url or redis is None:
+            return None
+        try:
+            client = redis.Redis.from_url(
+                url,
+                password=os.getenv("REDIS_PASSWORD") or None,
+                db=int(os.getenv("REDIS_DB", "0")),
+                decode_responses=True,
+                socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.5")),
+                socket_connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", "0.5")),
+            )
+            client.ping()
+            _client = client
+            logging.info("✅ Redis conectado")
+        except Exception as e:
+            logging.warning(f"Redis indisponível, usando fallback em memória: {e}")
+            _client = None
+        return _client
@@ -0,0 +1,206 @@
+"""
+Cache de respostas por agente (opt-in)
+Agentes de FAQ respondem as mesmas perguntas milhares de vezes por dia. Para
+os agentes habilitados, a resposta fica guardada sob a impressão digital da
+configuração do agente (instruções, modelo, versão da base de conhecimento) e
+a mensagem normalizada. Por padrão só mensagens idênticas (após normalização)
+contam como acerto. Com RESPONSE_CACHE_THRESHOLD < 1, mensagens parecidas
+também contam, mas só quando diferem em stopwords: termos de conteúdo,
+números e negações ("não", "sem") precisam ser os mesmos, porque trocar
+"10" por "50" ou "sábado" por "domingo" muda a resposta.
+
+Alterar o agente ou a base de conhecimento muda a impressão digital e
+descarta as respostas antigas. O cache é local ao processo.
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from query_analyzer import PORTUGUESE_STOPWORDS, stem, tokenize
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# Similaridade mínima (0-1) para reaproveitar a resposta de uma mensagem parecida (1 = só idênticas)
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "1.0"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+# Agentes habilitados por ID ou nome, separados por vírgula (agentes personalizados também via response_cache=true)
+RESPONSE_CACHE_AGENTS = frozenset(
+    name.strip() for name in os.getenv("RESPONSE_CACHE_AGENTS", "").split(",") if name.strip())
+
+# Palavras que invertem o sentido da mensagem (várias são stopwords, mas aqui precisam bater)
+NEGATION_TOKENS = frozenset({"nao", "sem", "nem", "nunca", "jamais", "nenhum", "nenhuma", "nada", "ninguem"})
+
+
+def normalize_message(message: str) -> str:
+    """Minúsculas, sem acentos e sem pontuação (chave da busca exata)"""
+    return " ".join(tokenize(message))
+
+
+def message_vector(message: str) -> Tuple[Dict[str, int], float]:
+    """Vetor de frequência dos radicais (stopwords incluídas) e sua norma"""
+    vector = Counter(stem(token) for token in tokenize(message))
+    return vector, math.sqrt(sum(count * count for count in vector.values()))
+
+
+def message_signature(message: str) -> Tuple[str, ...]:
+    """
+    Termos que precisam ser idênticos para reaproveitar uma resposta parecida
+
+    Radicais das palavras de conteúdo, números sem stemming e negações. Só o
+    que sobra (stopwords) pode variar entre mensagens consideradas parecidas.
+    """
+    terms = []
+    for token in tokenize(message):
+        if token.isdigit() or token in NEGATION_TOKENS:
+            terms.append(token)
+        elif token not in PORTUGUESE_STOPWORDS:
+            terms.append(stem(token))
+    return tuple(sorted(terms))
+
+
+def cosine(a: Dict[str, int], norm_a: float, b: Dict[str, int], norm_b: float) -> float:
+    if not norm_a or not norm_b:
+        return 0.0
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(count * b.get(term, 0) for term, count in a.items()) / (norm_a * norm_b)
+
+
+def agent_fingerprint(agent: Any, knowledge_version: Any = None) -> str:
+    """Hash da configuração que determina a resposta do agente (+ versão do conhecimento)"""
+    model = getattr(agent, "model", None)
+    config = {
+        "name": getattr(agent, "name", None),
+        "role": getattr(agent, "role", None),
+        "instructions": getattr(agent, "instructions", None),
+        "system_message": getattr(agent, "system_message", None),
+        "model": getattr(model, "id", None) or getattr(model, "model_id", None),
+        "knowledge": knowledge_version,
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class _AgentEntries:
+    """Respostas de um agente para uma impressão digital, em ordem de uso"""
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        # mensagem normalizada -> (resposta, vetor, norma, criado em, latência original em ms, assinatura)
+        self.items: "OrderedDict[str, Tuple[str, Dict[str, int], float, float, float, Tuple[str, ...]]]" = OrderedDict()
+
+
+class ResponseCache:
+    """Respostas por agente com busca exata e por similaridade, TTL e LRU"""
+
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, threshold: float = RESPONSE_CACHE_THRESHOLD,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, agents: Iterable[str] = RESPONSE_CACHE_AGENTS):
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_entries = max(max_entries, 1)
+        self.agents = frozenset(agents)
+        self._agents: Dict[str, _AgentEntries] = {}
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0,
+                      "expired": 0, "evictions": 0, "invalidations": 0, "latency_saved_ms": 0.0}
+
+    def enabled_for(self, agent_id: Optional[str], agent_name: Optional[str] = None,
+                    record: Optional[Dict] = None) -> bool:
+        """Cache habilitado para o agente (RESPONSE_CACHE_AGENTS ou response_cache no registro)"""
+        if record and record.get("response_cache"):
+            return True
+        return bool(self.agents) and (agent_id in self.agents or agent_name in self.agents)
+
+    def _entries(self, agent_key: str, fingerprint: str) -> _AgentEntries:
+        entries = self._agents.get(agent_key)
+        if entries is None or entries.fingerprint != fingerprint:
+            if entries is not None and entries.items:
+                # Agente ou base de conhecimento alterados: respostas antigas não valem mais
+                self.stats["invalidations"] += 1
+            entries = self._agents[agent_key] = _AgentEntries(fingerprint)
+        return entries
+
+    def lookup(self, agent_key: str, fingerprint: str, message: str) -> Optional[Dict]:
+        """
+        Resposta guardada para a mensagem (ou uma parecida)
+
+        Returns:
+            {"content", "match" ("exact" | "semantic"), "similarity", "age_s"} ou None
+        """
+        normalized = normalize_message(message)
+        now = time.time()
+        with self._lock:
+            self.stats["lookups"] += 1
+            entries = self._entries(agent_key, fingerprint)
+            found = entries.items.get(normalized)
+            match, similarity = "exact", 1.0
+            if found is None and self.threshold < 1 and entries.items:
+                vector, norm = message_vector(message)
+                signature = message_signature(message)
+                best_key, similarity = None, 0.0
+                for key, (_, other, other_norm, created, _, other_signature) in entries.items.items():
+                    if now - created > self.ttl or other_signature != signature:
+                        continue
+                    score = cosine(vector, norm, other, other_norm)
+                    if score > similarity:
+                        best_key, similarity = key, score
+                if best_key is not None and similarity >= self.threshold:
+                    normalized, found, match = best_key, entries.items[best_key], "semantic"
+            if found is not None and now - found[3] > self.ttl:
+                del entries.items[normalized]
+                self.stats["expired"] += 1
+                found = None
+            if found is None:
+                self.stats["misses"] += 1
+                return None
+            entries.items.move_to_end(normalized)
+            self.stats["exact_hits" if match == "exact" else "semantic_hits"] += 1
+            self.stats["latency_saved_ms"] += found[4]
+        return {"content": found[0], "match": match, "similarity": round(similarity, 3),
+                "age_s": round(now - found[3], 1)}
+
+    def store(self, agent_key: str, fingerprint: str, message: str, content: str, latency_ms: float):
+        """Guarda a resposta de uma execução real (respostas vazias não são guardadas)"""
+        if not content:
+            return
+        normalized = normalize_message(message)
+        vector, norm = message_vector(message)
+        signature = message_signature(message)
+        with self._lock:
+            entries = self._entries(agent_key, fingerprint)
+            entries.items[normalized] = (content, vector, norm, time.time(), latency_ms, signature)
+            entries.items.move_to_end(normalized)
+            self.stats["stores"] += 1
+            while len(entries.items) > self.max_entries:
+                entries.items.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, agent_key: Optional[str] = None):
+        """Descarta as respostas de um agente (ou de todos)"""
+        with self._lock:
+            if agent_key is None:
+                dropped = [key for key, entries in self._agents.items() if entries.items]
+                self._agents.clear()
+            else:
+                entries = self._agents.pop(agent_key, None)
+                dropped = [agent_key] if entries is not None and entries.items else []
+            self.stats["invalidations"] += len(dropped)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = sum(len(entries.items) for entries in self._agents.values())
+            stats["agents"] = {key: len(entries.items) for key, entries in self._agents.items()}
+        hits = stats["exact_hits"] + stats["semantic_hits"]
+        stats["hit_rate"] = round(hits / stats["lookups"], 3) if stats["lookups"] else 0.0
+        stats["latency_saved_ms"] = round(stats["latency_saved_ms"], 1)
+        stats["ttl"] = self.ttl
+        stats["threshold"] = self.threshold
+        return stats
+
+
+# Instância global
+response_cache = ResponseCache()
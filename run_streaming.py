@@ -0,0 +1,185 @@
+"""
+Execução de agentes e times em streaming (SSE ou NDJSON)
+O run(stream=True) do Agno é um iterador bloqueante: cada pedaço é lido em
+uma thread do pool de execução (agent_executor.iterate, com as vagas por
+agente/conta e o prazo das demais execuções) e repassado ao cliente assim
+que chega. O texto
+completo é entregue no evento final e só então a persistência é disparada,
+sem atrasar o fim da resposta. Tempo até o primeiro pedaço (TTFT) e duração
+total são registrados por agente/time.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, Optional
+
+STREAM_METRICS_WINDOW = int(os.getenv("STREAM_METRICS_WINDOW", "500"))
+
+MEDIA_TYPES = {"sse": "text/event-stream", "ndjson": "application/x-ndjson"}
+# Evita que proxies (nginx) acumulem o stream antes de repassar
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+# Eventos com pedaços de texto da resposta (Agent e Team do Agno)
+CONTENT_EVENTS = {"RunContent", "TeamRunContent"}
+
+
+def iter_text(runnable: Any, message: str, final: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+    """
+    Pedaços de texto de runnable.run(message, stream=True) (Agent ou Team do Agno)
+
+    Pede também a saída final da execução (yield_run_output), que é a única
+    com métricas no stream; se final for informado, final["response"] a
+    recebe (tokens do provedor, ver usage_accounting.run_usage). Só eventos
+    de conteúdo viram texto: a saída final e o RunCompleted trazem a resposta
+    inteira, que seria repetida.
+    """
+    try:
+        result = runnable.run(message, stream=True, yield_run_output=True)
+    except TypeError:
+        # Versões/implementações sem yield_run_output
+        result = runnable.run(message, stream=True)
+    if isinstance(result, str) or not hasattr(result, "__iter__"):
+        # Implementações sem streaming (ex.: mock) devolvem a resposta inteira
+        if final is not None:
+            final["response"] = result
+        content = getattr(result, "content", result)
+        if content:
+            yield str(content)
+        return
+    # Times: só o texto do próprio time (eventos dos membros ficam de fora)
+    content_events = {"TeamRunContent"} if hasattr(runnable, "members") else CONTENT_EVENTS
+    for chunk in result:
+        if isinstance(chunk, str):
+            if chunk:
+                yield chunk
+            continue
+        event = getattr(chunk, "event", None)
+        if event is None or str(event).endswith("RunCompleted"):
+            # Saída final (RunOutput/TeamRunOutput) ou evento de conclusão: métricas, sem texto
+            if final is not None and getattr(chunk, "metrics", None) is not None:
+                final["response"] = chunk
+            continue
+        content = getattr(chunk, "content", None)
+        if event in content_events and isinstance(content, str) and content:
+            yield content
+
+
+def format_event(fmt: str, event: str, data: Dict) -> str:
+    if fmt == "ndjson":
+        return json.dumps({"event": event, "data": data}, ensure_ascii=False, default=str) + "\n"
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+class StreamMetrics:
+    """TTFT e duração total dos streams por alvo (agente ou time), em janela deslizante"""
+
+    def __init__(self, window: int = STREAM_METRICS_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._targets: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, target: str, ttft_ms: Optional[float], total_ms: float, chunks: int,
+               error: bool = False, cancelled: bool = False):
+        with self._lock:
+            entry = self._targets.setdefault(target, {
+                "streams": 0, "errors": 0, "cancelled": 0, "chunks": 0,
+                "ttft_ms": deque(maxlen=self.window), "total_ms": deque(maxlen=self.window)})
+            entry["streams"] += 1
+            entry["errors"] += int(error)
+            entry["cancelled"] += int(cancelled)
+            entry["chunks"] += chunks
+            if ttft_ms is not None:
+                entry["ttft_ms"].append(ttft_ms)
+            entry["total_ms"].append(total_ms)
+
+    @staticmethod
+    def _summary(values: Deque[float]) -> Dict[str, Optional[float]]:
+        if not values:
+            return {"avg": None, "p50": None, "p95": None}
+        ordered = sorted(values)
+        return {
+            "avg": round(sum(ordered) / len(ordered), 1),
+            "p50": round(ordered[len(ordered) // 2], 1),
+            "p95": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], 1),
+        }
+
+    def get_stats(self, target: Optional[str] = None) -> Dict:
+        with self._lock:
+            items = [(k, v) for k, v in self._targets.items() if target is None or k == target]
+            snapshot = {k: {**v, "ttft_ms": list(v["ttft_ms"]), "total_ms": list(v["total_ms"])} for k, v in items}
+        return {
+            key: {
+                "streams": entry["streams"],
+                "errors": entry["errors"],
+                "cancelled": entry["cancelled"],
+                "avg_chunks": round(entry["chunks"] / entry["streams"], 1) if entry["streams"] else 0,
+                "ttft_ms": self._summary(entry["ttft_ms"]),
+                "total_ms": self._summary(entry["total_ms"]),
+            }
+            for key, entry in snapshot.items()
+        }
+
+
+async def stream_run(chunks: AsyncIterator[str], fmt: str, target: str, start_data: Dict,
+                     done_data: Callable[[str, Dict], Dict],
+                     on_complete: Optional[Callable[[str], None]] = None,
+                     metrics: Optional[StreamMetrics] = None) -> AsyncIterator[str]:
+    """
+    Repassa os pedaços como eventos start / delta / done (ou error)
+
+    Args:
+        chunks: Pedaços de texto (ex.: agent_executor.iterate(iter_text(...)))
+        fmt: "sse" ou "ndjson"
+        target: Chave das métricas (ex.: "agent:<id>")
+        start_data: Conteúdo do evento start
+        done_data: Monta o evento done a partir do texto completo e das métricas
+        on_complete: Persistência/enriquecimento, executado em thread ao fim da geração
+    """
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    ttft_ms = None
+    parts = []
+    finished = False
+    error = False
+    try:
+        yield format_event(fmt, "start", start_data)
+        async for chunk in chunks:
+            if ttft_ms is None:
+                ttft_ms = (time.perf_counter() - started) * 1000
+            parts.append(chunk)
+            yield format_event(fmt, "delta", {"content": chunk})
+        finished = True
+        content = "".join(parts)
+        timing = {"ttft_ms": round(ttft_ms, 1) if ttft_ms is not None else None,
+                  "total_ms": round((time.perf_counter() - started) * 1000, 1)}
+        if on_complete is not None:
+            # Disparado antes do evento final: roda mesmo se o cliente fechar a conexão ao recebê-lo
+            future = loop.run_in_executor(None, on_complete, content)
+            future.add_done_callback(_log_completion_error)
+        yield format_event(fmt, "done", done_data(content, timing))
+    except Exception as e:
+        error = True
+        finished = True
+        logging.error(f"Erro no stream de {target}: {e}")
+        yield format_event(fmt, "error", {"detail": str(e)})
+    finally:
+        if not finished and hasattr(chunks, "aclose"):
+            # Cliente desconectou: interrompe a geração no provedor
+            await chunks.aclose()
+        if metrics is not None:
+            metrics.record(target, ttft_ms, (time.perf_counter() - started) * 1000, len(parts),
+                           error=error, cancelled=not finished)
+
+
+def _log_completion_error(future: "asyncio.Future"):
+    if not future.cancelled() and future.exception() is not None:
+        logging.warning(f"Falha na persistência após o stream: {future.exception()}")
+
+
+# Instância global
+stream_metrics = StreamMetrics()
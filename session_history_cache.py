@@ -0,0 +1,213 @@
+"""
+Cache quente do histórico de sessão (últimas N mensagens por sessão)
+Usa listas no Redis quando disponível e um LRU em memória como fallback,
+evitando reler do banco o histórico que acabou de ser gravado
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+from redis_client import get_redis
+
+SESSION_HISTORY_MAX_TURNS = int(os.getenv("SESSION_HISTORY_MAX_TURNS", "50"))
+SESSION_HISTORY_TTL = int(os.getenv("SESSION_HISTORY_TTL", "3600"))
+SESSION_HISTORY_LOCAL_SESSIONS = int(os.getenv("SESSION_HISTORY_LOCAL_SESSIONS", "10000"))
+
+
+class SessionHistoryCache:
+    """
+    Buffer circular das últimas mensagens de cada sessão, em ordem cronológica
+
+    As gravações são write-through (após salvar no banco). Uma leitura só é
+    atendida pelo cache se ele tiver pelo menos `limit` mensagens ou se a
+    sessão estiver marcada como completa (carregada do banco com menos
+    linhas do que o pedido, ou seja, todo o histórico está no cache).
+    """
+
+    def __init__(self, namespace: str, max_turns: int = SESSION_HISTORY_MAX_TURNS,
+                 ttl_seconds: int = SESSION_HISTORY_TTL,
+                 max_local_sessions: int = SESSION_HISTORY_LOCAL_SESSIONS):
+        self.namespace = namespace
+        self.max_turns = max_turns
+        self.ttl_seconds = ttl_seconds
+        self.max_local_sessions = max_local_sessions
+        # session_id -> [deque de mensagens, completa, expira_em]
+        self._local: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "errors": 0}
+
+    # ==================== CHAVES ====================
+
+    def _key(self, session_id: str) -> str:
+        return f"agentos:history:{self.namespace}:{session_id}"
+
+    def _complete_key(self, session_id: str) -> str:
+        return f"agentos:history:{self.namespace}:{session_id}:complete"
+
+    # ==================== OPERAÇÕES ====================
+
+    def append(self, session_id: str, message: Dict):
+        """Adiciona uma mensagem já persistida ao final do histórico da sessão"""
+        if not session_id:
+            return
+        self._count("writes")
+        client = get_redis()
+        if client is not None:
+            try:
+                key = self._key(session_id)
+                pipe = client.pipeline(transaction=True)
+                pipe.rpush(key, json.dumps(message, default=str))
+                pipe.ltrim(key, -self.max_turns, -1)
+                pipe.expire(key, self.ttl_seconds)
+                pipe.expire(self._complete_key(session_id), self.ttl_seconds)
+                pipe.execute()
+            except Exception as e:
+                self._count("errors")
+                logging.warning(f"Falha ao gravar histórico no Redis: {e}")
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(session_id)
+            if entry is None or entry[2] <= now:
+                # Sessão fria: guarda a mensagem, mas o histórico anterior é desconhecido
+                entry = [deque(maxlen=self.max_turns), False, 0.0]
+                self._local[session_id] = entry
+            entry[0].append(message)
+            entry[2] = now + self.ttl_seconds
+            self._local.move_to_end(session_id)
+            self._evict_locked()
+
+    def populate(self, session_id: str, messages: List[Dict], complete: bool = False):
+        """
+        Substitui o histórico em cache pelo resultado de uma leitura do banco
+
+        Args:
+            session_id: ID da sessão
+            messages: Mensagens em ordem cronológica
+            complete: True se a leitura retornou todo o histórico da sessão
+        """
+        if not session_id:
+            return
+        messages = list(messages)[-self.max_turns:]
+        client = get_redis()
+        if client is not None:
+            try:
+                key = self._key(session_id)
+                pipe = client.pipeline(transaction=True)
+                pipe.delete(key, self._complete_key(session_id))
+                if messages:
+                    pipe.rpush(key, *[json.dumps(m, default=str) for m in messages])
+                    pipe.expire(key, self.ttl_seconds)
+                if complete:
+                    pipe.set(self._complete_key(session_id), "1", ex=self.ttl_seconds)
+                pipe.execute()
+            except Exception as e:
+                self._count("errors")
+                logging.warning(f"Falha ao popular histórico no Redis: {e}")
+            return
+
+        with self._lock:
+            self._local[session_id] = [deque(messages, maxlen=self.max_turns), complete,
+                                       time.monotonic() + self.ttl_seconds]
+            self._local.move_to_end(session_id)
+            self._evict_locked()
+
+    def get(self, session_id: str, limit: int) -> Optional[List[Dict]]:
+        """
+        Retorna as últimas `limit` mensagens da sessão (ordem cronológica)
+
+        Returns:
+            Lista de mensagens, ou None se o cache não puder atender a leitura
+        """
+        if not session_id or limit <= 0 or limit > self.max_turns:
+            self._count("misses")
+            return None
+        client = get_redis()
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                pipe.lrange(self._key(session_id), -limit, -1)
+                pipe.llen(self._key(session_id))
+                pipe.exists(self._complete_key(session_id))
+                raw, length, complete = pipe.execute()
+                if length >= limit or (complete and length < self.max_turns):
+                    self._count("hits")
+                    return [json.loads(item) for item in raw]
+            except Exception as e:
+                self._count("errors")
+                logging.warning(f"Falha ao ler histórico do Redis: {e}")
+            self._count("misses")
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(session_id)
+            if entry is not None and entry[2] > now:
+                messages, complete, _ = entry
+                if len(messages) >= limit or (complete and len(messages) < self.max_turns):
+                    self._local.move_to_end(session_id)
+                    self.stats["hits"] += 1
+                    return list(messages)[-limit:]
+            self.stats["misses"] += 1
+            return None
+
+    def invalidate(self, session_id: str):
+        """Descarta o histórico em cache de uma sessão"""
+        client = get_redis()
+        if client is not None:
+            try:
+                client.delete(self._key(session_id), self._complete_key(session_id))
+            except Exception as e:
+                self._count("errors")
+                logging.warning(f"Falha ao invalidar histórico no Redis: {e}")
+        with self._lock:
+            self._local.pop(session_id, None)
+
+    def get_stats(self) -> Dict:
+        """Métricas do cache"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["local_sessions"] = len(self._local)
+        total = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / total, 3) if total else 0.0
+        stats["backend"] = "redis" if get_redis() is not None else "memory"
+        return stats
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _evict_locked(self):
+        while len(self._local) > self.max_local_sessions:
+            self._local.popitem(last=False)
+
+
+def fetch_recent(cache: SessionHistoryCache, session_id: str, limit: int, loader) -> List[Dict]:
+    """
+    Lê as últimas `limit` mensagens da sessão pelo cache, recorrendo ao banco em caso de miss
+
+    Args:
+        cache: Cache da tabela
+        session_id: ID da sessão
+        limit: Número de mensagens
+        loader: Função (session_id, limit) -> mensagens em ordem cronológica
+
+    Returns:
+        Mensagens em ordem cronológica
+    """
+    cached = cache.get(session_id, limit)
+    if cached is not None:
+        return cached
+    messages = loader(session_id, limit) or []
+    cache.populate(session_id, messages, complete=len(messages) < limit)
+    return messages
+
+
+# Caches globais por tabela (compartilhados entre os serviços que gravam nelas)
+chat_history_cache = SessionHistoryCache("mensagens_ia")
+message_history_cache = SessionHistoryCache("message_history")
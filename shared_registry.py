@@ -0,0 +1,226 @@
+"""
+Registro compartilhado entre workers e nós
+Mapeamento chave -> registro JSON guardado em um hash do Redis. Cada processo
+mantém uma cópia local (cache de leitura) e assina um canal de pub/sub: toda
+alteração publica a chave alterada e os demais processos releem só aquela
+chave. Ao (re)conectar, o processo compara a cópia local com o hash inteiro,
+cobrindo mensagens perdidas. Sem Redis (REDIS_URL ausente ou servidor fora
+do ar), funciona como um dict local, como antes.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from redis_client import get_redis
+
+SHARED_REGISTRY_PREFIX = os.getenv("SHARED_REGISTRY_PREFIX", "agentos:registry")
+SHARED_REGISTRY_POLL_SECONDS = float(os.getenv("SHARED_REGISTRY_POLL_SECONDS", "1.0"))
+
+# listener(chave, registro anterior ou None, novo registro ou None), chamado para alterações de outros processos
+ChangeListener = Callable[[str, Optional[Dict], Optional[Dict]], None]
+
+
+class SharedMapping(MutableMapping):
+    """
+    Dict de registros JSON sincronizado pelo Redis
+
+    Leituras vêm sempre da cópia local (sem ida à rede). Escritas atualizam a
+    cópia local, o hash e publicam a chave no canal do namespace.
+    """
+
+    def __init__(self, namespace: str, listener: Optional[ChangeListener] = None,
+                 redis_getter: Callable[[], Any] = get_redis, lock: Optional[threading.RLock] = None):
+        self.namespace = namespace
+        self.hash_key = f"{SHARED_REGISTRY_PREFIX}:{namespace}"
+        self.channel = f"{self.hash_key}:changes"
+        self.listener = listener
+        self._redis_getter = redis_getter
+        self._local: Dict[str, Dict] = {}
+        # O dono dos índices derivados (listener) pode compartilhar o mesmo lock
+        self._lock = lock if lock is not None else threading.RLock()
+        self._origin = uuid.uuid4().hex
+        self._pid = None
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"local_writes": 0, "remote_writes": 0, "remote_errors": 0,
+                      "notifications": 0, "resyncs": 0}
+        self._start()
+
+    # ==================== CONEXÃO ====================
+
+    @property
+    def redis(self):
+        return self._redis_getter()
+
+    @property
+    def shared(self) -> bool:
+        """True quando o registro está sincronizado pelo Redis"""
+        return self.redis is not None
+
+    def _start(self):
+        # Processos criados por fork não herdam a thread de assinatura
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        client = self.redis
+        if client is None:
+            return
+        self._resync(client)
+        self._thread = threading.Thread(target=self._listen, name=f"registry-{self.namespace}", daemon=True)
+        self._thread.start()
+
+    def _listen(self):
+        pubsub = None
+        while True:
+            client = self.redis
+            try:
+                if pubsub is None:
+                    pubsub = client.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(self.channel)
+                    # Alterações feitas enquanto o canal estava desconectado
+                    self._resync(client)
+                message = pubsub.get_message(timeout=SHARED_REGISTRY_POLL_SECONDS)
+                if message and message.get("type") == "message":
+                    self._on_message(client, message.get("data"))
+            except Exception as e:
+                logging.warning(f"Assinatura do registro {self.namespace} interrompida: {e}")
+                with self._lock:
+                    self.stats["remote_errors"] += 1
+                try:
+                    if pubsub is not None:
+                        pubsub.close()
+                except Exception:
+                    pass
+                pubsub = None
+                time.sleep(SHARED_REGISTRY_POLL_SECONDS)
+
+    def _on_message(self, client, data: Any):
+        event = json.loads(data)
+        if event.get("origin") == self._origin:
+            return
+        with self._lock:
+            self.stats["notifications"] += 1
+        key = event["key"]
+        raw = client.hget(self.hash_key, key)
+        self._apply(key, json.loads(raw) if raw is not None else None)
+
+    def _resync(self, client):
+        try:
+            remote = {key: json.loads(raw) for key, raw in client.hgetall(self.hash_key).items()}
+        except Exception as e:
+            logging.warning(f"Registro {self.namespace} não sincronizado com o Redis: {e}")
+            with self._lock:
+                self.stats["remote_errors"] += 1
+            return
+        with self._lock:
+            self.stats["resyncs"] += 1
+            keys = set(self._local) | set(remote)
+        for key in keys:
+            self._apply(key, remote.get(key))
+
+    def _apply(self, key: str, record: Optional[Dict]):
+        with self._lock:
+            previous = self._local.get(key)
+            if previous == record:
+                return
+            if record is None:
+                self._local.pop(key, None)
+            else:
+                self._local[key] = record
+            if self.listener is not None:
+                try:
+                    self.listener(key, previous, record)
+                except Exception as e:
+                    logging.warning(f"Falha ao aplicar alteração remota em {self.namespace}/{key}: {e}")
+
+    def _publish(self, client, op: str, key: Optional[str] = None):
+        client.publish(self.channel, json.dumps({"op": op, "key": key, "origin": self._origin}))
+
+    # ==================== DICT ====================
+
+    def __getitem__(self, key: str) -> Dict:
+        return self._local[key]
+
+    def __setitem__(self, key: str, record: Dict):
+        self._start()
+        payload = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._local[key] = record
+            self.stats["local_writes"] += 1
+        client = self.redis
+        if client is None:
+            return
+        try:
+            client.hset(self.hash_key, key, payload)
+            self._publish(client, "set", key)
+            with self._lock:
+                self.stats["remote_writes"] += 1
+        except Exception as e:
+            logging.warning(f"Registro {self.namespace}/{key} gravado só localmente: {e}")
+            with self._lock:
+                self.stats["remote_errors"] += 1
+
+    def __delitem__(self, key: str):
+        self._start()
+        with self._lock:
+            del self._local[key]
+            self.stats["local_writes"] += 1
+        client = self.redis
+        if client is None:
+            return
+        try:
+            client.hdel(self.hash_key, key)
+            self._publish(client, "del", key)
+            with self._lock:
+                self.stats["remote_writes"] += 1
+        except Exception as e:
+            logging.warning(f"Remoção de {self.namespace}/{key} não propagada: {e}")
+            with self._lock:
+                self.stats["remote_errors"] += 1
+
+    def __iter__(self):
+        # Itera sobre uma cópia: alterações remotas chegam por outra thread
+        return iter(list(self._local))
+
+    def __len__(self) -> int:
+        return len(self._local)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._local
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._local.get(key, default)
+
+    def seed(self, items: Iterable[Tuple[str, Dict]]):
+        """
+        Carrega registros de outra fonte (ex.: banco no restart) sem notificar
+
+        Os demais processos fazem a mesma carga; o hash só é completado para
+        quem conectar depois.
+        """
+        items = list(items)
+        with self._lock:
+            for key, record in items:
+                self._local[key] = record
+        client = self.redis
+        if client is None or not items:
+            return
+        try:
+            client.hset(self.hash_key, mapping={
+                key: json.dumps(record, ensure_ascii=False, default=str) for key, record in items})
+        except Exception as e:
+            logging.warning(f"Registro {self.namespace} carregado só localmente: {e}")
+            with self._lock:
+                self.stats["remote_errors"] += 1
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._local)
+        stats["shared"] = self.shared
+        stats["listening"] = self._thread is not None and self._thread.is_alive()
+        return stats
@@ -0,0 +1,713 @@
+"""
+Backend SQLite local para as tabelas do Supabase
+Implementa o subconjunto da API do cliente Supabase/PostgREST usado pelos
+serviços (table().select/insert/update/delete com filtros eq, contains, or_,
+order, limit...) sobre um arquivo SQLite em modo WAL, com índices e filtros
+em metadados via JSON1. Permite rodar benchmarks e testes de integração
+com volumes realistas sem rede.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+SQLITE_PATH = os.getenv("SQLITE_PATH", "agentos_local.db")
+
+# ==================== ESQUEMA ====================
+
+TABLES: Dict[str, Dict[str, Any]] = {
+    "agentes_solo": {
+        "ddl": """
+            CREATE TABLE IF NOT EXISTS agentes_solo (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                role TEXT NOT NULL,
+                instructions TEXT NOT NULL DEFAULT '[]',
+                model TEXT NOT NULL DEFAULT 'gemini-2.5-flash',
+                provider TEXT NOT NULL DEFAULT 'gemini',
+                account_id TEXT NOT NULL,
+                user_id TEXT,
+                config TEXT NOT NULL DEFAULT '{}',
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """,
+        # Colunas incluídas depois da criação da tabela (bancos locais antigos)
+        "added_columns": [
+            ("user_id", "TEXT"),
+            ("config", "TEXT NOT NULL DEFAULT '{}'"),
+        ],
+        "indexes": [
+            "CREATE INDEX IF NOT EXISTS idx_agentes_solo_account_id ON agentes_solo(account_id)",
+            "CREATE INDEX IF NOT EXISTS idx_agentes_solo_created_at ON agentes_solo(created_at)",
+        ],
+        "json_columns": {"instructions", "config"},
+        "uuid_pk": True,
+    },
+    "mensagens_ia": {
+        "ddl": """
+            CREATE TABLE IF NOT EXISTS mensagens_ia (
+                id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                session_id TEXT NOT NULL,
+                agent_id TEXT NOT NULL,
+                user_message TEXT NOT NULL,
+                agent_response TEXT NOT NULL,
+                agent_name TEXT,
+                message_id TEXT,
+                timestamp TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """,
+        "indexes": [
+            "CREATE INDEX IF NOT EXISTS idx_mensagens_ia_session_created ON mensagens_ia(session_id, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_mensagens_ia_user_created ON mensagens_ia(user_id, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_mensagens_ia_agent_id ON mensagens_ia(agent_id)",
+        ],
+        "json_columns": set(),
+        "uuid_pk": True,
+    },
+    "message_history": {
+        "ddl": """
+            CREATE TABLE IF NOT EXISTS message_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                metadata TEXT NOT NULL DEFAULT '{}',
+                created_at TEXT NOT NULL
+            )
+        """,
+        "indexes": [
+            "CREATE INDEX IF NOT EXISTS idx_message_history_user_role_created "
+            "ON message_history(user_id, role, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_message_history_session ON message_history(session_id)",
+            # Filtros de memórias enriquecidas por tipo e agente (metadata->>type / ->>agent_id)
+            "CREATE INDEX IF NOT EXISTS idx_message_history_user_type_created "
+            "ON message_history(user_id, json_extract(metadata, '$.type'), created_at) WHERE role = 'system'",
+            "CREATE INDEX IF NOT EXISTS idx_message_history_user_agent_created "
+            "ON message_history(user_id, json_extract(metadata, '$.agent_id'), created_at) WHERE role = 'system'",
+        ],
+        "json_columns": {"metadata"},
+        "uuid_pk": False,
+        "triggers": [],  # preenchido abaixo (estatísticas de memórias)
+    },
+    # Estatísticas de memórias mantidas por trigger (mesmo esquema de memory_stats.sql)
+    "memory_stats": {
+        "ddl": """
+            CREATE TABLE IF NOT EXISTS memory_stats (
+                user_id TEXT NOT NULL,
+                agent_id TEXT NOT NULL DEFAULT '',
+                memory_type TEXT NOT NULL DEFAULT '',
+                total INTEGER NOT NULL DEFAULT 0,
+                last_activity TEXT,
+                PRIMARY KEY (user_id, agent_id, memory_type)
+            )
+        """,
+        "indexes": [],
+        "json_columns": set(),
+        "uuid_pk": False,
+    },
+    "memory_topic_stats": {
+        "ddl": """
+            CREATE TABLE IF NOT EXISTS memory_topic_stats (
+                user_id TEXT NOT NULL,
+                agent_id TEXT NOT NULL DEFAULT '',
+                memory_type TEXT NOT NULL DEFAULT '',
+                topic TEXT NOT NULL,
+                total INTEGER NOT NULL DEFAULT 0,
+                last_activity TEXT,
+                PRIMARY KEY (user_id, agent_id, memory_type, topic)
+            )
+        """,
+        "indexes": [],
+        "json_columns": set(),
+        "uuid_pk": False,
+    },
+}
+
+
+def _memory_stats_statements(row: str, delta: int) -> str:
+    """Comandos que aplicam +1/-1 de uma memória (NEW/OLD) em memory_stats e memory_topic_stats"""
+    agent = f"COALESCE(json_extract({row}.metadata, '$.agent_id'), '')"
+    memory_type = f"COALESCE(json_extract({row}.metadata, '$.type'), '')"
+    activity = f"{row}.created_at" if delta > 0 else "NULL"
+    statements = []
+    for key in (agent, "'*'"):
+        statements.append(
+            f"INSERT INTO memory_stats (user_id, agent_id, memory_type, total, last_activity) "
+            f"VALUES ({row}.user_id, {key}, {memory_type}, {max(delta, 0)}, {activity}) "
+            f"ON CONFLICT (user_id, agent_id, memory_type) DO UPDATE SET total = total + ({delta}), "
+            f"last_activity = COALESCE(MAX(last_activity, excluded.last_activity), last_activity);"
+        )
+        statements.append(
+            f"INSERT INTO memory_topic_stats (user_id, agent_id, memory_type, topic, total, last_activity) "
+            f"SELECT {row}.user_id, {key}, {memory_type}, topic, {max(delta, 0)}, {activity} "
+            f"FROM (SELECT DISTINCT value AS topic FROM json_each({row}.metadata, '$.topics')) "
+            f"WHERE json_type({row}.metadata, '$.topics') = 'array' "
+            f"ON CONFLICT (user_id, agent_id, memory_type, topic) DO UPDATE SET total = total + ({delta}), "
+            f"last_activity = COALESCE(MAX(last_activity, excluded.last_activity), last_activity);"
+        )
+    if delta < 0:
+        statements.append(f"DELETE FROM memory_topic_stats WHERE user_id = {row}.user_id AND total <= 0;")
+        statements.append(f"DELETE FROM memory_stats WHERE user_id = {row}.user_id AND total <= 0;")
+    return "\n".join(statements)
+
+
+_MEMORY_STATS_BACKFILL = """
+BEGIN;
+INSERT INTO memory_stats (user_id, agent_id, memory_type, total, last_activity)
+SELECT user_id, agent_id, memory_type, COUNT(*), MAX(created_at) FROM (
+    SELECT user_id, COALESCE(json_extract(metadata, '$.agent_id'), '') AS agent_id,
+           COALESCE(json_extract(metadata, '$.type'), '') AS memory_type, created_at
+    FROM message_history WHERE role = 'system'
+    UNION ALL
+    SELECT user_id, '*', COALESCE(json_extract(metadata, '$.type'), ''), created_at
+    FROM message_history WHERE role = 'system'
+) GROUP BY user_id, agent_id, memory_type;
+INSERT INTO memory_topic_stats (user_id, agent_id, memory_type, topic, total, last_activity)
+SELECT user_id, agent_id, memory_type, topic, COUNT(*), MAX(created_at) FROM (
+    SELECT DISTINCT m.id, m.user_id,
+           CASE WHEN k.star THEN '*' ELSE COALESCE(json_extract(m.metadata, '$.agent_id'), '') END AS agent_id,
+           COALESCE(json_extract(m.metadata, '$.type'), '') AS memory_type, t.value AS topic, m.created_at
+    FROM message_history m
+    JOIN (SELECT 0 AS star UNION ALL SELECT 1) k
+    JOIN json_each(m.metadata, '$.topics') t
+    WHERE m.role = 'system' AND json_type(m.metadata, '$.topics') = 'array'
+) GROUP BY user_id, agent_id, memory_type, topic;
+COMMIT;
+"""
+
+TABLES["message_history"]["triggers"] = [
+    f"""CREATE TRIGGER IF NOT EXISTS trg_message_history_stats_insert
+        AFTER INSERT ON message_history WHEN NEW.role = 'system'
+        BEGIN {_memory_stats_statements("NEW", 1)} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_message_history_stats_delete
+        AFTER DELETE ON message_history WHEN OLD.role = 'system'
+        BEGIN {_memory_stats_statements("OLD", -1)} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_message_history_stats_update_old
+        AFTER UPDATE OF role, user_id, metadata, created_at ON message_history WHEN OLD.role = 'system'
+        BEGIN {_memory_stats_statements("OLD", -1)} END""",
+    f"""CREATE TRIGGER IF NOT EXISTS trg_message_history_stats_update_new
+        AFTER UPDATE OF role, user_id, metadata, created_at ON message_history WHEN NEW.role = 'system'
+        BEGIN {_memory_stats_statements("NEW", 1)} END""",
+]
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_JSON_PATH = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*)((?:->>?[A-Za-z0-9_]+)+)$")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _identifier(name: str) -> str:
+    if not _IDENTIFIER.match(name):
+        raise ValueError(f"Identificador inválido: {name}")
+    return f'"{name}"'
+
+
+def _column_expr(column: str) -> Tuple[str, bool]:
+    """
+    Converte uma coluna PostgREST em expressão SQL
+
+    Suporta caminhos JSON: metadata->>type (texto) e metadata->topics (JSON).
+
+    Returns:
+        (expressão SQL, True se o resultado é JSON)
+    """
+    match = _JSON_PATH.match(column)
+    if not match:
+        return _identifier(column), False
+    base, path = match.groups()
+    keys = re.findall(r"->>?([A-Za-z0-9_]+)", path)
+    as_text = path.rsplit("->", 1)[-1].startswith(">")
+    json_path = "$" + "".join(f"[{k}]" if k.isdigit() else f".{k}" for k in keys)
+    if as_text:
+        return f"json_extract({_identifier(base)}, '{json_path}')", False
+    return f"json_extract({_identifier(base)}, '{json_path}')", True
+
+
+def _sql_value(value: Any) -> Any:
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def _split_top_level(text: str, sep: str = ",") -> List[str]:
+    """Divide por vírgulas fora de aspas, colchetes, chaves e parênteses"""
+    parts, depth, quote, escaped, current = [], 0, None, False, []
+    for ch in text:
+        if quote:
+            current.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == quote:
+                quote = None
+            continue
+        if ch in "\"'":
+            quote = ch
+        elif ch in "([{":
+            depth += 1
+        elif ch in ")]}":
+            depth -= 1
+        elif ch == sep and depth == 0:
+            parts.append("".join(current))
+            current = []
+            continue
+        current.append(ch)
+    if current:
+        parts.append("".join(current))
+    return [p.strip() for p in parts if p.strip()]
+
+
+class SQLiteResponse:
+    """Resposta no mesmo formato do APIResponse do postgrest (data e count)"""
+
+    def __init__(self, data: List[Dict], count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+class SQLiteQueryBuilder:
+    """Construtor de consultas com a mesma interface encadeável do PostgREST"""
+
+    def __init__(self, client: "SQLiteClient", table: str):
+        if table not in TABLES:
+            raise ValueError(f"Tabela desconhecida: {table}")
+        self.client = client
+        self.table = table
+        self.schema = TABLES[table]
+        self._action = "select"
+        self._columns = "*"
+        self._count = None
+        self._payload: Any = None
+        self._on_conflict: List[str] = []
+        self._where: List[str] = []
+        self._params: List[Any] = []
+        self._order: List[str] = []
+        self._limit: Optional[int] = None
+        self._offset: Optional[int] = None
+
+    # ==================== AÇÕES ====================
+
+    def select(self, columns: str = "*", count: Optional[str] = None) -> "SQLiteQueryBuilder":
+        self._action = "select"
+        self._columns = columns
+        self._count = count
+        return self
+
+    def insert(self, rows: Any) -> "SQLiteQueryBuilder":
+        self._action = "insert"
+        self._payload = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def upsert(self, rows: Any, on_conflict: str = "id") -> "SQLiteQueryBuilder":
+        """Insere ou, se on_conflict já existir, atualiza as colunas enviadas (created_at preservado)"""
+        self._action = "upsert"
+        self._payload = rows if isinstance(rows, list) else [rows]
+        self._on_conflict = [c.strip() for c in on_conflict.split(",") if _identifier(c.strip())]
+        return self
+
+    def update(self, data: Dict) -> "SQLiteQueryBuilder":
+        self._action = "update"
+        self._payload = data
+        return self
+
+    def delete(self) -> "SQLiteQueryBuilder":
+        self._action = "delete"
+        return self
+
+    # ==================== FILTROS ====================
+
+    def _compare(self, column: str, op: str, value: Any) -> "SQLiteQueryBuilder":
+        expr, _ = _column_expr(column)
+        self._where.append(f"{expr} {op} ?")
+        self._params.append(_sql_value(value))
+        return self
+
+    def eq(self, column: str, value: Any) -> "SQLiteQueryBuilder":
+        return self._compare(column, "=", value)
+
+    def neq(self, column: str, value: Any) -> "SQLiteQueryBuilder":
+        return self._compare(column, "!=", value)
+
+    def gt(self, column: str, value: Any) -> "SQLiteQueryBuilder":
+        return self._compare(column, ">", value)
+
+    def gte(self, column: str, value: Any) -> "SQLiteQueryBuilder":
+        return self._compare(column, ">=", value)
+
+    def lt(self, column: str, value: Any) -> "SQLiteQueryBuilder":
+        return self._compare(column, "<", value)
+
+    def lte(self, column: str, value: Any) -> "SQLiteQueryBuilder":
+        return self._compare(column, "<=", value)
+
+    def like(self, column: str, pattern: str) -> "SQLiteQueryBuilder":
+        expr, _ = _column_expr(column)
+        self._where.append(f"{expr} LIKE ?")
+        self._params.append(pattern.replace("*", "%"))
+        return self
+
+    def ilike(self, column: str, pattern: str) -> "SQLiteQueryBuilder":
+        expr, _ = _column_expr(column)
+        self._where.append(f"py_lower({expr}) LIKE py_lower(?)")
+        self._params.append(pattern.replace("*", "%"))
+        return self
+
+    def in_(self, column: str, values: Sequence[Any]) -> "SQLiteQueryBuilder":
+        expr, _ = _column_expr(column)
+        values = list(values)
+        if not values:
+            self._where.append("0")
+            return self
+        self._where.append(f"{expr} IN ({', '.join('?' for _ in values)})")
+        self._params.extend(_sql_value(v) for v in values)
+        return self
+
+    def is_(self, column: str, value: Any) -> "SQLiteQueryBuilder":
+        expr, _ = _column_expr(column)
+        self._where.append(f"{expr} IS NULL" if value in (None, "null") else f"{expr} IS NOT NULL")
+        return self
+
+    def contains(self, column: str, value: Any) -> "SQLiteQueryBuilder":
+        """Equivalente ao operador @> do PostgreSQL para colunas JSON"""
+        sql, params = self._contains_sql(column, value)
+        self._where.append(sql)
+        self._params.extend(params)
+        return self
+
+    def _contains_sql(self, column: str, value: Any) -> Tuple[str, List[Any]]:
+        expr, _ = _column_expr(column)
+        return self._contains_at(expr, "$", value)
+
+    def _contains_at(self, expr: str, path: str, value: Any) -> Tuple[str, List[Any]]:
+        if isinstance(value, dict):
+            clauses, params = [], []
+            for key, item in value.items():
+                if not _IDENTIFIER.match(str(key)):
+                    raise ValueError(f"Chave JSON inválida: {key}")
+                sql, item_params = self._contains_at(expr, f"{path}.{key}", item)
+                clauses.append(sql)
+                params.extend(item_params)
+            return ("(" + " AND ".join(clauses) + ")") if clauses else "1", params
+        if isinstance(value, list):
+            clauses, params = [], []
+            for item in value:
+                clauses.append(f"EXISTS (SELECT 1 FROM json_each({expr}, '{path}') WHERE json_each.value = ?)")
+                params.append(_sql_value(item) if not isinstance(item, (dict, list)) else json.dumps(item))
+            return ("(" + " AND ".join(clauses) + ")") if clauses else f"json_type({expr}, '{path}') = 'array'", params
+        return f"json_extract({expr}, '{path}') = ?", [_sql_value(value)]
+
+    def or_(self, filters: str) -> "SQLiteQueryBuilder":
+        """Filtro OR no formato PostgREST: "col.op.valor,and(col.op.valor,col.op.valor)" """
+        sql, params = self._logic_sql(filters, "OR")
+        if sql:
+            self._where.append(sql)
+            self._params.extend(params)
+        return self
+
+    def _logic_sql(self, filters: str, joiner: str) -> Tuple[str, List[Any]]:
+        clauses, params = [], []
+        for clause in _split_top_level(filters):
+            nested = re.match(r"^(and|or)\((.*)\)$", clause, re.S)
+            if nested:
+                sql, clause_params = self._logic_sql(nested.group(2), nested.group(1).upper())
+            else:
+                column, op, value = clause.split(".", 2)
+                # Valores entre aspas (ex.: timestamps, tópicos com vírgula) são literais; \ escapa " e \
+                if len(value) >= 2 and value[0] == value[-1] == '"':
+                    value = re.sub(r'\\(.)', r'\1', value[1:-1])
+                sql, clause_params = self._operator_sql(column, op, value)
+            if sql:
+                clauses.append(sql)
+                params.extend(clause_params)
+        if not clauses:
+            return "", []
+        return "(" + f" {joiner} ".join(clauses) + ")", params
+
+    def filter(self, column: str, operator: str, criteria: str) -> "SQLiteQueryBuilder":
+        """Filtro genérico no formato PostgREST (ex.: filter("metadata->topics", "cs", '["a"]'))"""
+        sql, params = self._operator_sql(column, operator, criteria)
+        self._where.append(sql)
+        self._params.extend(params)
+        return self
+
+    def _operator_sql(self, column: str, op: str, value: str) -> Tuple[str, List[Any]]:
+        if op.startswith("not."):
+            sql, params = self._operator_sql(column, op[4:], value)
+            return f"NOT ({sql})", params
+        expr, _ = _column_expr(column)
+        if op in ("eq", "neq", "gt", "gte", "lt", "lte"):
+            sql_op = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}[op]
+            return f"{expr} {sql_op} ?", [value]
+        if op == "like":
+            return f"{expr} LIKE ?", [value.replace("*", "%")]
+        if op == "ilike":
+            return f"py_lower({expr}) LIKE py_lower(?)", [value.replace("*", "%")]
+        if op == "cs":
+            return self._contains_sql(column, json.loads(value))
+        if op == "is":
+            return (f"{expr} IS NULL" if value == "null" else f"{expr} IS NOT NULL"), []
+        raise ValueError(f"Operador não suportado: {op}")
+
+    # ==================== ORDENAÇÃO E PAGINAÇÃO ====================
+
+    def order(self, column: str, desc: bool = False) -> "SQLiteQueryBuilder":
+        expr, _ = _column_expr(column)
+        self._order.append(f"{expr} {'DESC' if desc else 'ASC'}")
+        return self
+
+    def limit(self, count: int) -> "SQLiteQueryBuilder":
+        self._limit = int(count)
+        return self
+
+    def range(self, start: int, end: int) -> "SQLiteQueryBuilder":
+        self._offset = int(start)
+        self._limit = int(end) - int(start) + 1
+        return self
+
+    # ==================== EXECUÇÃO ====================
+
+    def _where_sql(self) -> str:
+        return (" WHERE " + " AND ".join(self._where)) if self._where else ""
+
+    def _decode(self, row: sqlite3.Row) -> Dict:
+        data = dict(row)
+        for column in self.schema["json_columns"]:
+            if isinstance(data.get(column), str):
+                try:
+                    data[column] = json.loads(data[column])
+                except ValueError:
+                    pass
+        return data
+
+    def _encode(self, row: Dict) -> Dict:
+        encoded = {}
+        for column, value in row.items():
+            _identifier(column)
+            if column in self.schema["json_columns"] and not isinstance(value, str):
+                value = json.dumps(value, ensure_ascii=False)
+            encoded[column] = _sql_value(value)
+        return encoded
+
+    def execute(self) -> SQLiteResponse:
+        if self._action == "select" and not self.client.shared_connection:
+            return self._execute_select(self.client.connection)
+        with self.client.transaction() as conn:
+            return getattr(self, f"_execute_{self._action}")(conn)
+
+    def _execute_select(self, conn: sqlite3.Connection) -> SQLiteResponse:
+        table = _identifier(self.table)
+        columns = "*" if self._columns.strip() == "*" else \
+            ", ".join(_identifier(c.strip()) for c in self._columns.split(",") if c.strip())
+        sql = f"SELECT {columns} FROM {table}{self._where_sql()}"
+        # rowid desempata registros com o mesmo created_at (ordem de inserção)
+        order = self._order + ["rowid " + ("DESC" if self._order and self._order[-1].endswith("DESC") else "ASC")]
+        sql += " ORDER BY " + ", ".join(order)
+        params = list(self._params)
+        if self._limit is not None or self._offset is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [self._limit if self._limit is not None else -1, self._offset or 0]
+        rows = [self._decode(row) for row in conn.execute(sql, params)]
+        count = None
+        if self._count:
+            count = conn.execute(f"SELECT COUNT(*) FROM {table}{self._where_sql()}", self._params).fetchone()[0]
+        return SQLiteResponse(rows, count)
+
+    def _execute_upsert(self, conn: sqlite3.Connection) -> SQLiteResponse:
+        return self._execute_insert(conn, upsert=True)
+
+    def _execute_insert(self, conn: sqlite3.Connection, upsert: bool = False) -> SQLiteResponse:
+        table = _identifier(self.table)
+        rowids = []
+        for row in self._payload:
+            row = dict(row)
+            if self.schema["uuid_pk"] and not row.get("id"):
+                row["id"] = str(uuid.uuid4())
+            for column in ("created_at", "updated_at"):
+                if column in self._table_columns(conn) and row.get(column) in (None, "now()"):
+                    row[column] = _now()
+            encoded = self._encode(row)
+            columns = ", ".join(_identifier(c) for c in encoded)
+            placeholders = ", ".join("?" for _ in encoded)
+            sql = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
+            if upsert:
+                assignments = ", ".join(f"{_identifier(c)} = excluded.{_identifier(c)}" for c in encoded
+                                        if c not in self._on_conflict and c != "created_at")
+                sql += f" ON CONFLICT ({', '.join(_identifier(c) for c in self._on_conflict)}) DO " + (
+                    f"UPDATE SET {assignments}" if assignments else "NOTHING")
+                conn.execute(sql, list(encoded.values()))
+                where = " AND ".join(f"{_identifier(c)} = ?" for c in self._on_conflict)
+                found = conn.execute(f"SELECT rowid FROM {table} WHERE {where}",
+                                     [encoded[c] for c in self._on_conflict]).fetchone()
+                rowids.extend([found[0]] if found else [])
+                continue
+            cursor = conn.execute(sql, list(encoded.values()))
+            rowids.append(cursor.lastrowid)
+        return SQLiteResponse(self._rows_by_rowid(conn, rowids))
+
+    def _execute_update(self, conn: sqlite3.Connection) -> SQLiteResponse:
+        table = _identifier(self.table)
+        rowids = [r[0] for r in conn.execute(f"SELECT rowid FROM {table}{self._where_sql()}", self._params)]
+        if not rowids:
+            return SQLiteResponse([])
+        data = dict(self._payload)
+        if "updated_at" in self._table_columns(conn) and data.get("updated_at") in (None, "now()"):
+            data["updated_at"] = _now()
+        encoded = self._encode(data)
+        assignments = ", ".join(f"{_identifier(c)} = ?" for c in encoded)
+        for start in range(0, len(rowids), 500):
+            chunk = rowids[start:start + 500]
+            conn.execute(
+                f"UPDATE {table} SET {assignments} WHERE rowid IN ({', '.join('?' for _ in chunk)})",
+                list(encoded.values()) + chunk,
+            )
+        return SQLiteResponse(self._rows_by_rowid(conn, rowids))
+
+    def _execute_delete(self, conn: sqlite3.Connection) -> SQLiteResponse:
+        table = _identifier(self.table)
+        rows = [(r[0], self._decode(r)) for r in conn.execute(
+            f"SELECT rowid AS _rowid, * FROM {table}{self._where_sql()}", self._params)]
+        for start in range(0, len(rows), 500):
+            chunk = [rowid for rowid, _ in rows[start:start + 500]]
+            conn.execute(f"DELETE FROM {table} WHERE rowid IN ({', '.join('?' for _ in chunk)})", chunk)
+        deleted = []
+        for _, row in rows:
+            row.pop("_rowid", None)
+            deleted.append(row)
+        return SQLiteResponse(deleted)
+
+    def _rows_by_rowid(self, conn: sqlite3.Connection, rowids: List[int]) -> List[Dict]:
+        table = _identifier(self.table)
+        rows = []
+        for start in range(0, len(rowids), 500):
+            chunk = rowids[start:start + 500]
+            found = {r["_rowid"]: r for r in conn.execute(
+                f"SELECT rowid AS _rowid, * FROM {table} WHERE rowid IN ({', '.join('?' for _ in chunk)})", chunk)}
+            for rowid in chunk:
+                row = self._decode(found[rowid])
+                row.pop("_rowid", None)
+                rows.append(row)
+        return rows
+
+    def _table_columns(self, conn: sqlite3.Connection) -> set:
+        return self.client.table_columns(conn, self.table)
+
+
+class SQLiteClient:
+    """
+    Cliente com a interface do supabase.Client (table/from_) sobre SQLite
+
+    Uma conexão por thread; WAL permite leituras concorrentes com uma escrita.
+    Com path=":memory:" todas as operações usam uma única conexão.
+    """
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self._uri = path == ":memory:"
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+        self._columns: Dict[str, set] = {}
+        self._anchor = self._connect()
+        self._init_schema(self._anchor)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        conn.create_function("py_lower", 1, lambda v: v.lower() if isinstance(v, str) else v,
+                             deterministic=True)
+        return conn
+
+    def _init_schema(self, conn: sqlite3.Connection):
+        existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for name, spec in TABLES.items():
+            conn.execute(spec["ddl"])
+            if spec.get("added_columns") and name in existing:
+                columns = {row[1] for row in conn.execute(f"PRAGMA table_info({name})")}
+                for column, definition in spec["added_columns"]:
+                    if column not in columns:
+                        conn.execute(f"ALTER TABLE {name} ADD COLUMN {column} {definition}")
+            for index in spec["indexes"]:
+                conn.execute(index)
+            for trigger in spec.get("triggers", []):
+                conn.execute(trigger)
+        if "message_history" in existing and "memory_stats" not in existing:
+            # Banco criado antes das tabelas de estatísticas: carga inicial
+            conn.executescript(_MEMORY_STATS_BACKFILL)
+
+    @property
+    def shared_connection(self) -> bool:
+        # Banco em memória: uma única conexão, com todas as operações serializadas
+        return self._uri
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._uri:
+            return self._anchor
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def transaction(self):
+        return _Transaction(self)
+
+    def table_columns(self, conn: sqlite3.Connection, table: str) -> set:
+        if table not in self._columns:
+            self._columns[table] = {row[1] for row in conn.execute(f"PRAGMA table_info({_identifier(table)})")}
+        return self._columns[table]
+
+    def table(self, name: str) -> SQLiteQueryBuilder:
+        return SQLiteQueryBuilder(self, name)
+
+    from_ = table
+
+
+class _Transaction:
+    """Transação curta: escritas serializadas no processo (leituras não passam por aqui, exceto em memória)"""
+
+    def __init__(self, client: SQLiteClient):
+        self.client = client
+        self.conn = client.connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.client._write_lock.acquire()
+        self.conn.execute("BEGIN")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.client._write_lock.release()
+        return False
+
+
+_clients: Dict[str, SQLiteClient] = {}
+_lock = threading.Lock()
+
+
+def get_sqlite_client(path: Optional[str] = None) -> SQLiteClient:
+    """Retorna o cliente SQLite do processo para o arquivo informado"""
+    path = path or SQLITE_PATH
+    with _lock:
+        if path not in _clients:
+            _clients[path] = SQLiteClient(path)
+        return _clients[path]
@@ -0,0 +1,188 @@
+"""
+Fábrica de clientes Supabase compartilhados
+Um cliente por (URL, chave) por processo, todos usando o mesmo pool HTTP
+(keep-alive e HTTP/2 quando disponível), com limites e timeouts
+configuráveis e estatísticas de reutilização de conexões.
+Com AGENTOS_BACKEND=sqlite, retorna o backend SQLite local no lugar do Supabase
+"""
+import logging
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+try:
+    import httpx  # type: ignore
+except Exception:  # dependência do SDK do Supabase
+    httpx = None  # type: ignore
+
+try:
+    from supabase import create_client, Client  # type: ignore
+except Exception:  # pacote pode não estar instalado em ambiente de testes
+    create_client = None  # type: ignore
+    Client = None  # type: ignore
+
+try:
+    import h2  # type: ignore  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except Exception:
+    _HTTP2_AVAILABLE = False
+
+SUPABASE_POOL_MAX_CONNECTIONS = int(os.getenv("SUPABASE_POOL_MAX_CONNECTIONS", "20"))
+SUPABASE_POOL_MAX_KEEPALIVE = int(os.getenv("SUPABASE_POOL_MAX_KEEPALIVE", "10"))
+SUPABASE_POOL_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_POOL_KEEPALIVE_EXPIRY", "30"))
+SUPABASE_HTTP_TIMEOUT = float(os.getenv("SUPABASE_HTTP_TIMEOUT", "10"))
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "5"))
+SUPABASE_HTTP2 = os.getenv("SUPABASE_HTTP2", "true").lower() == "true"
+
+# "supabase" (padrão) ou "sqlite" (arquivo local definido por SQLITE_PATH)
+AGENTOS_BACKEND = os.getenv("AGENTOS_BACKEND", "supabase").lower()
+LOCAL_BACKEND = AGENTOS_BACKEND == "sqlite"
+
+SUPABASE_AVAILABLE = LOCAL_BACKEND or (create_client is not None and httpx is not None)
+
+
+class ConnectionStats:
+    """Conta requisições e conexões abertas pelo pool compartilhado"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self.errors = 0
+        self.http_versions: Dict[str, int] = {}
+
+    def trace(self, event_name: str, info: Dict):
+        # Eventos emitidos pelo httpcore a cada etapa da requisição
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.connections_opened += 1
+        elif event_name == "connection.start_tls.complete":
+            with self._lock:
+                self.tls_handshakes += 1
+
+    def on_request(self, request: "httpx.Request"):
+        request.extensions["trace"] = self.trace
+        with self._lock:
+            self.requests += 1
+
+    def on_response(self, response: "httpx.Response"):
+        with self._lock:
+            self.http_versions[response.http_version] = self.http_versions.get(response.http_version, 0) + 1
+            if response.status_code >= 500:
+                self.errors += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            reused = max(self.requests - self.connections_opened, 0)
+            return {
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "connections_reused": reused,
+                "reuse_rate": round(reused / self.requests, 3) if self.requests else 0.0,
+                "tls_handshakes": self.tls_handshakes,
+                "server_errors": self.errors,
+                "http_versions": dict(self.http_versions),
+            }
+
+
+connection_stats = ConnectionStats()
+
+_transport = None
+_clients: Dict[Tuple[str, str], "Client"] = {}
+_lock = threading.Lock()
+
+
+def _http_limits() -> "httpx.Limits":
+    return httpx.Limits(
+        max_connections=SUPABASE_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=SUPABASE_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=SUPABASE_POOL_KEEPALIVE_EXPIRY,
+    )
+
+
+def _http_timeout() -> "httpx.Timeout":
+    return httpx.Timeout(SUPABASE_HTTP_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT)
+
+
+def get_http_transport() -> "httpx.HTTPTransport":
+    """Transporte HTTP (pool de conexões) compartilhado pelo processo"""
+    global _transport
+    if _transport is None:
+        with _lock:
+            if _transport is None:
+                http2 = SUPABASE_HTTP2 and _HTTP2_AVAILABLE
+                if SUPABASE_HTTP2 and not _HTTP2_AVAILABLE:
+                    logging.warning("Pacote h2 ausente: pool Supabase usando HTTP/1.1")
+                _transport = httpx.HTTPTransport(http2=http2, limits=_http_limits(), retries=1)
+    return _transport
+
+
+def create_pooled_http_client(base_url: str = "", headers: Optional[Dict] = None) -> "httpx.Client":
+    """Cria um httpx.Client leve sobre o pool compartilhado (não fecha o transporte)"""
+    return httpx.Client(
+        base_url=base_url,
+        headers=headers,
+        timeout=_http_timeout(),
+        transport=get_http_transport(),
+        follow_redirects=True,
+        event_hooks={"request": [connection_stats.on_request], "response": [connection_stats.on_response]},
+    )
+
+
+def get_supabase_client(url: Optional[str] = None, key: Optional[str] = None) -> "Client":
+    """
+    Retorna o cliente Supabase do processo para (url, key)
+
+    O cliente PostgREST passa a usar o pool HTTP compartilhado. Se o SDK
+    recriar o cliente PostgREST (ex.: troca de token de autenticação), a
+    sessão padrão do SDK volta a ser usada até a próxima chamada.
+    Com AGENTOS_BACKEND=sqlite, retorna o cliente SQLite local (url/key ignorados).
+    """
+    if LOCAL_BACKEND:
+        from sqlite_backend import get_sqlite_client
+        return get_sqlite_client()
+    url = url or os.getenv("SUPABASE_URL")
+    key = key or os.getenv("SUPABASE_SERVICE_ROLE_KEY") or os.getenv("SUPABASE_KEY")
+    if not url or not key:
+        raise ValueError("Credenciais do Supabase não encontradas")
+    if not SUPABASE_AVAILABLE:
+        raise RuntimeError("Pacote supabase não instalado")
+
+    client = _clients.get((url, key))
+    if client is None:
+        with _lock:
+            client = _clients.get((url, key))
+            if client is None:
+                client = create_client(url, key)
+                _clients[(url, key)] = client
+    _install_pool(client)
+    return client
+
+
+def _install_pool(client: "Client"):
+    postgrest = client.postgrest
+    session = getattr(postgrest, "session", None)
+    if session is None or getattr(session, "_agentos_pooled", False):
+        return
+    pooled = create_pooled_http_client(str(session.base_url), dict(session.headers))
+    pooled._agentos_pooled = True  # type: ignore[attr-defined]
+    postgrest.session = pooled
+    try:
+        session.close()
+    except Exception:
+        pass
+
+
+def get_connection_stats() -> Dict:
+    """Estatísticas de reutilização de conexões do pool compartilhado"""
+    stats = connection_stats.snapshot()
+    stats["backend"] = AGENTOS_BACKEND
+    stats["clients"] = len(_clients)
+    stats["http2_enabled"] = SUPABASE_HTTP2 and _HTTP2_AVAILABLE
+    stats["pool"] = {
+        "max_connections": SUPABASE_POOL_MAX_CONNECTIONS,
+        "max_keepalive_connections": SUPABASE_POOL_MAX_KEEPALIVE,
+        "keepalive_expiry": SUPABASE_POOL_KEEPALIVE_EXPIRY,
+    }
+    return stats
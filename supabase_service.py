@@ -3,14 +3,14 @@ Serviço para gerenciar operações de agentes no Supabase
 """
 import os
 import uuid
-from typing import List, Dict, Optional
-# Tenta importar o cliente do Supabase; se não estiver disponível, usa fallback em memória
-try:
-    from supabase import create_client, Client  # type: ignore
-except Exception:  # pacote pode não estar instalado em ambiente de testes
-    create_client = None  # type: ignore
-    Client = None  # type: ignore
+from typing import List, Dict, Iterable, Optional
+# Cliente compartilhado do Supabase; se a lib não estiver disponível, usa fallback em memória
+from supabase_client import get_supabase_client, SUPABASE_AVAILABLE, LOCAL_BACKEND, Client
 from dotenv import load_dotenv
+from session_history_cache import chat_history_cache, fetch_recent
+from message_store import InMemoryMessageStore
+from bulk_ingest import BulkIngestor, RowError
+from agent_config_cache import AgentConfigCache
 
 # Carrega variáveis de ambiente
 load_dotenv()
@@ -25,10 +25,12 @@ class SupabaseService:
 
         self._use_memory = False
         self._agents_mem: Dict[str, Dict] = {}
-        self._messages_mem: List[Dict] = []
+        self._messages_mem = InMemoryMessageStore()
+        self.session_cache = chat_history_cache
+        self.agent_cache = AgentConfigCache()
 
         # Se faltar URL/KEY ou a lib supabase não estiver disponível, ativa memória
-        if not self.url or not self.key or create_client is None:
+        if not LOCAL_BACKEND and (not self.url or not self.key or not SUPABASE_AVAILABLE):
             self._use_memory = True
             self.supabase = None  # type: ignore
             # Semeia um agente padrão para testes que usam "test_agent_123"
@@ -49,7 +51,7 @@ class SupabaseService:
                 }
         else:
             # Modo Supabase real
-            self.supabase: Client = create_client(self.url, self.key)  # type: ignore
+            self.supabase: Client = get_supabase_client(self.url, self.key)  # type: ignore
     
     def create_agent(self, name: str, role: str, instructions: List[str], 
                     model: str = "gemini-2.5-flash", provider: str = "gemini", account_id: str = None) -> Dict:
@@ -108,13 +110,22 @@ class SupabaseService:
                 return self._agents_mem.get(agent_id)
             if self._use_memory:
                 return self._agents_mem.get(agent_id)
-            result = self.supabase.table("agentes_solo").select("*").eq("id", agent_id).execute()
-            if result.data:
-                return result.data[0]
-            return None
+            return self.agent_cache.get(agent_id, self._load_agent, self._load_agent_version)
         except Exception as e:
             raise Exception(f"Erro ao buscar agente: {str(e)}")
     
+    def _load_agent(self, agent_id: str) -> Optional[Dict]:
+        result = self.supabase.table("agentes_solo").select("*").eq("id", agent_id).execute()
+        if result.data:
+            return result.data[0]
+        return None
+    
+    def _load_agent_version(self, agent_id: str) -> Optional[str]:
+        result = self.supabase.table("agentes_solo").select("updated_at").eq("id", agent_id).execute()
+        if result.data:
+            return result.data[0].get("updated_at")
+        return None
+    
     def get_agents_by_account(self, account_id: str) -> List[Dict]:
         """Busca todos os agentes de uma conta"""
         try:
@@ -139,6 +150,7 @@ class SupabaseService:
                 agent.update(update_data)
                 return agent
             result = self.supabase.table("agentes_solo").update(update_data).eq("id", agent_id).execute()
+            self.agent_cache.invalidate(agent_id)
             if result.data:
                 return result.data[0]
             else:
@@ -152,6 +164,7 @@ class SupabaseService:
             if self._use_memory:
                 return self._agents_mem.pop(agent_id, None) is not None
             result = self.supabase.table("agentes_solo").delete().eq("id", agent_id).execute()
+            self.agent_cache.invalidate(agent_id)
             return len(result.data) > 0
         except Exception as e:
             raise Exception(f"Erro ao deletar agente: {str(e)}")
@@ -188,19 +201,77 @@ class SupabaseService:
                 return message_data
             result = self.supabase.table("mensagens_ia").insert(message_data).execute()
             if result.data:
+                # Write-through no cache quente da sessão
+                self.session_cache.append(session_id, result.data[0])
                 return result.data[0]
             else:
                 raise Exception("Falha ao salvar mensagem")
         except Exception as e:
             raise Exception(f"Erro ao salvar mensagem: {str(e)}")
     
+    def save_messages_bulk(self, messages: Iterable[Dict], chunk_size: int = None,
+                           max_concurrency: int = None) -> Dict:
+        """
+        Salva mensagens em lote (inserções de várias linhas com concorrência limitada)
+        
+        Cada item aceita os mesmos campos de save_message (user_id, session_id,
+        agent_id, message/user_message, response/agent_response, message_id).
+        
+        Returns:
+            Relatório com received, inserted, failed e errors (índice e motivo)
+        """
+        return self.messages_bulk_ingestor(chunk_size, max_concurrency).ingest(messages)
+    
+    def messages_bulk_ingestor(self, chunk_size: int = None, max_concurrency: int = None) -> BulkIngestor:
+        """Ingestor em lote de mensagens_ia (usado também no upload NDJSON em streaming)"""
+        return BulkIngestor(
+            insert_many=self._insert_message_rows,
+            insert_one=lambda row: self._insert_message_rows([row])[0],
+            build_row=self._build_message_row,
+            chunk_size=chunk_size,
+            max_concurrency=max_concurrency,
+        )
+    
+    def _build_message_row(self, item: Dict) -> Dict:
+        user_message = item.get("user_message", item.get("message"))
+        agent_response = item.get("agent_response", item.get("response"))
+        required = {
+            "user_id": item.get("user_id"),
+            "session_id": item.get("session_id"),
+            "agent_id": item.get("agent_id"),
+            "user_message": user_message,
+        }
+        missing = [field for field, value in required.items() if not value]
+        if missing:
+            raise RowError(f"Campos obrigatórios ausentes: {', '.join(missing)}")
+        return {
+            "id": item.get("message_id") or item.get("id") or str(uuid.uuid4()),
+            "user_id": item["user_id"],
+            "session_id": item["session_id"],
+            "agent_id": item["agent_id"],
+            "user_message": user_message,
+            "agent_response": agent_response or "",
+            "created_at": "now()"
+        }
+    
+    def _insert_message_rows(self, rows: List[Dict]) -> List[Dict]:
+        if self._use_memory:
+            for row in rows:
+                self._messages_mem.append(row)
+            return rows
+        result = self.supabase.table("mensagens_ia").insert(rows).execute()
+        if not result.data:
+            raise Exception("Falha ao inserir mensagens")
+        # Blocos concorrentes não garantem a ordem: invalida em vez de anexar ao cache
+        for session_id in {row.get("session_id") for row in result.data}:
+            self.session_cache.invalidate(session_id)
+        return result.data
+    
     def get_session_messages(self, session_id: str, limit: int = 50) -> List[Dict]:
         """Recupera mensagens de uma sessão específica"""
         try:
             if self._use_memory:
-                msgs = [m for m in self._messages_mem if m.get("session_id") == session_id]
-                msgs.sort(key=lambda m: m.get("created_at", ""))
-                return msgs[:limit]
+                return self._messages_mem.session_messages(session_id, limit)
             result = self.supabase.table("mensagens_ia")\
                 .select("*")\
                 .eq("session_id", session_id)\
@@ -211,13 +282,29 @@ class SupabaseService:
         except Exception as e:
             raise Exception(f"Erro ao recuperar mensagens da sessão: {str(e)}")
     
+    def get_recent_session_messages(self, session_id: str, limit: int = 10) -> List[Dict]:
+        """Recupera as últimas mensagens de uma sessão (ordem cronológica), lendo primeiro do cache"""
+        try:
+            if self._use_memory:
+                return self._messages_mem.recent_session_messages(session_id, limit)
+            return fetch_recent(self.session_cache, session_id, limit, self._load_recent_session_messages)
+        except Exception as e:
+            raise Exception(f"Erro ao recuperar mensagens recentes da sessão: {str(e)}")
+    
+    def _load_recent_session_messages(self, session_id: str, limit: int) -> List[Dict]:
+        result = self.supabase.table("mensagens_ia")\
+            .select("*")\
+            .eq("session_id", session_id)\
+            .order("created_at", desc=True)\
+            .limit(limit)\
+            .execute()
+        return list(reversed(result.data or []))
+    
     def get_user_messages(self, user_id: str, limit: int = 100) -> List[Dict]:
         """Recupera mensagens de um usuário específico"""
         try:
             if self._use_memory:
-                msgs = [m for m in self._messages_mem if m.get("user_id") == user_id]
-                msgs.sort(key=lambda m: m.get("created_at", ""), reverse=True)
-                return msgs[:limit]
+                return self._messages_mem.user_messages(user_id, limit)
             result = self.supabase.table("mensagens_ia")\
                 .select("*")\
                 .eq("user_id", user_id)\
@@ -234,15 +321,7 @@ class SupabaseService:
             raw = (query or "").strip()
             if self._use_memory:
                 terms = [t.strip() for t in raw.split("|") if t.strip()] if "|" in raw else ([raw] if raw else [])
-                results = []
-                for m in self._messages_mem:
-                    if m.get("user_id") != user_id:
-                        continue
-                    text = (m.get("user_message", "") + "\n" + m.get("agent_response", "")).lower()
-                    if any(term.lower() in text for term in terms):
-                        results.append(m)
-                results.sort(key=lambda m: m.get("created_at", ""), reverse=True)
-                return results[:limit]
+                return self._messages_mem.search(user_id, terms, limit)
             # Supabase real
             if "|" in raw:
                 terms = [t.strip() for t in raw.split("|") if t.strip()]
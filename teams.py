@@ -3,11 +3,36 @@ from agno.agent import Agent
 from agno.team import Team
 from mem0 import MemoryClient
 from agents import get_agent_by_name, get_all_agents
+from shared_registry import SharedMapping
+import threading
 import uuid
 from datetime import datetime
 
-# Armazenamento em memória para times (em produção, usar banco de dados)
-teams_storage: Dict[str, Dict[str, Any]] = {}
+# Instâncias de Team deste processo: team_id -> (updated_at, Team)
+_team_instances: Dict[str, Any] = {}
+_team_instances_lock = threading.Lock()
+
+def _drop_team_instance(team_id: str, previous: Optional[Dict], team_data: Optional[Dict]):
+    """Descarta a instância de um time alterado ou removido em outro worker"""
+    with _team_instances_lock:
+        _team_instances.pop(team_id, None)
+
+# Dados dos times, compartilhados entre workers pelo Redis (dict local sem Redis)
+teams_storage = SharedMapping("teams", listener=_drop_team_instance)
+
+def _build_team(team_data: Dict[str, Any]) -> Team:
+    """Cria a instância do Team a partir dos dados armazenados"""
+    agents = []
+    for agent_name in team_data["agent_names"]:
+        agent = get_agent_by_name(agent_name, user_id=team_data["user_id"])
+        if not agent:
+            raise ValueError(f"Agente '{agent_name}' não encontrado")
+        agents.append(agent)
+    return Team(
+        name=team_data["name"],
+        agents=agents,
+        description=team_data["description"]
+    )
 
 def create_team(name: str, description: str, agent_names: List[str], user_id: str = "default_user") -> Dict[str, Any]:
     """Cria um novo time com os agentes especificados"""
@@ -40,12 +65,13 @@ def create_team(name: str, description: str, agent_names: List[str], user_id: st
             "description": description,
             "agent_names": agent_names,
             "user_id": user_id,
-            "team_instance": team,
             "created_at": datetime.now().isoformat(),
             "updated_at": datetime.now().isoformat()
         }
         
         teams_storage[team_id] = team_data
+        with _team_instances_lock:
+            _team_instances[team_id] = (team_data["updated_at"], team)
         
         return {
             "id": team_id,
@@ -100,7 +126,14 @@ def get_team_instance_by_id(team_id: str, account_id: str = None) -> Optional[Te
         # Se account_id for fornecido, filtra por ele
         if account_id and team_data.get("account_id") != account_id:
             return None
-        return team_data["team_instance"]
+        # Recria a instância se o time foi alterado (aqui ou em outro worker)
+        cached = _team_instances.get(team_id)
+        if cached is not None and cached[0] == team_data["updated_at"]:
+            return cached[1]
+        team = _build_team(team_data)
+        with _team_instances_lock:
+            _team_instances[team_id] = (team_data["updated_at"], team)
+        return team
     return None
 
 def update_team(team_id: str, name: Optional[str] = None, description: Optional[str] = None, 
@@ -109,6 +142,7 @@ def update_team(team_id: str, name: Optional[str] = None, description: Optional[
     team_data = teams_storage.get(team_id)
     if not team_data or team_data["user_id"] != user_id:
         return None
+    team_data = dict(team_data)
     
     try:
         # Atualiza os campos fornecidos
@@ -118,23 +152,16 @@ def update_team(team_id: str, name: Optional[str] = None, description: Optional[
             team_data["description"] = description
         
         if agent_names is not None:
-            # Valida e atualiza agentes
-            agents = []
-            for agent_name in agent_names:
-                agent = get_agent_by_name(agent_name, user_id=user_id)
-                if not agent:
-                    raise ValueError(f"Agente '{agent_name}' não encontrado")
-                agents.append(agent)
-            
-            # Recria o team com novos agentes
-            team_data["team_instance"] = Team(
-                name=team_data["name"],
-                agents=agents,
-                description=team_data["description"]
-            )
+            # Valida os agentes e recria o team com os novos agentes
             team_data["agent_names"] = agent_names
+            team = _build_team(team_data)
         
         team_data["updated_at"] = datetime.now().isoformat()
+        # Grava o registro inteiro: os demais workers recriam a instância pelo updated_at
+        teams_storage[team_id] = team_data
+        if agent_names is not None:
+            with _team_instances_lock:
+                _team_instances[team_id] = (team_data["updated_at"], team)
         
         return {
             "id": team_data["id"],
@@ -152,6 +179,8 @@ def delete_team(team_id: str, user_id: str = "default_user") -> bool:
     team_data = teams_storage.get(team_id)
     if team_data and team_data["user_id"] == user_id:
         del teams_storage[team_id]
+        with _team_instances_lock:
+            _team_instances.pop(team_id, None)
         return True
     return False
 
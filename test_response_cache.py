@@ -0,0 +1,51 @@
+"""
+Testes do cache de respostas (response_cache.py)
+Perguntas que diferem em número, negação ou data não podem reaproveitar a
+resposta guardada, mesmo com a busca por similaridade ligada.
+"""
+import pytest
+
+from response_cache import ResponseCache
+
+AGENT_KEY = "agent:faq"
+FINGERPRINT = "fp"
+STORED_QUESTION = "Qual o preço do kit festa infantil completo para 10 pessoas com entrega no sábado?"
+
+NEAR_MISSES = [
+    "Qual o preço do kit festa infantil completo para 50 pessoas com entrega no sábado?",
+    "Qual o preço do kit festa infantil completo para 10 pessoas sem entrega no sábado?",
+    "Qual o preço do kit festa infantil completo para 10 pessoas com entrega no domingo?",
+]
+
+
+def make_cache(threshold: float) -> ResponseCache:
+    cache = ResponseCache(threshold=threshold, agents=())
+    cache.store(AGENT_KEY, FINGERPRINT, STORED_QUESTION, "R$ 300", latency_ms=1000)
+    return cache
+
+
+@pytest.mark.parametrize("threshold", [1.0, 0.92, 0.8, 0.5])
+@pytest.mark.parametrize("question", NEAR_MISSES)
+def test_near_misses_are_not_served(threshold, question):
+    cache = make_cache(threshold)
+    assert cache.lookup(AGENT_KEY, FINGERPRINT, question) is None
+
+
+def test_default_is_exact_only():
+    cache = ResponseCache(agents=())
+    cache.store(AGENT_KEY, FINGERPRINT, STORED_QUESTION, "R$ 300", latency_ms=1000)
+    assert cache.threshold == 1.0
+    hit = cache.lookup(AGENT_KEY, FINGERPRINT, "qual o PREÇO do kit festa infantil completo para 10 pessoas "
+                                               "com entrega no sabado")
+    assert hit is not None and hit["match"] == "exact"
+    assert cache.lookup(AGENT_KEY, FINGERPRINT, "Qual é o preço do kit festa infantil completo para 10 pessoas "
+                                                "com entrega no sábado?") is None
+
+
+def test_similar_hit_only_differs_in_stopwords():
+    cache = make_cache(0.8)
+    hit = cache.lookup(AGENT_KEY, FINGERPRINT, "Qual é o preço do kit festa infantil completo para 10 pessoas "
+                                               "com a entrega no sábado?")
+    assert hit is not None
+    assert hit["match"] == "semantic"
+    assert hit["content"] == "R$ 300"
@@ -0,0 +1,282 @@
+"""
+Contabilidade de uso por execução (tokens reais, modelo, latência, cache)
+Os tokens vêm das métricas do provedor: RunResponse/RunOutput do Agno ou
+usage_metadata do Vertex AI / Gemini. Cada execução soma contadores em um
+bucket por (hora, agente/time, conta); os buckets guardam só inteiros, então
+o custo de memória é fixo por agente e hora, independente do volume. Com
+Redis, os contadores são enviados em lote (HINCRBY) por uma thread e as
+consultas enxergam todos os workers; sem Redis, valem para o processo.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from redis_client import get_redis
+
+USAGE_RETENTION_HOURS = int(os.getenv("USAGE_RETENTION_HOURS", "168"))
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "5"))
+USAGE_REDIS_PREFIX = os.getenv("USAGE_REDIS_PREFIX", "agentos:usage")
+
+# Contadores somados por bucket (latências em ms inteiros); modelos entram como "model:<nome>"
+USAGE_FIELDS = ("runs", "errors", "cache_hits", "input_tokens", "output_tokens", "cached_tokens",
+                "reasoning_tokens", "total_ms", "queue_ms", "run_ms")
+
+BucketKey = Tuple[int, str, str]
+
+
+def _as_int(value: Any) -> int:
+    if isinstance(value, (list, tuple)):
+        # Agno 1.x guarda uma lista por chamada ao modelo dentro da execução
+        return sum(_as_int(item) for item in value)
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def run_usage(response: Any, fallback_model: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Tokens e modelo de uma execução do Agno (Agent.run / Team.run)
+
+    Aceita as métricas como objeto (Agno 2.x) ou dict de listas (Agno 1.x).
+    Sem métricas (ex.: MockAgent), os tokens ficam 0.
+    """
+    metrics = getattr(response, "metrics", None) or {}
+    if isinstance(metrics, dict):
+        read = metrics.get
+    else:
+        def read(name, default=None):
+            return getattr(metrics, name, default)
+    return {
+        "input_tokens": _as_int(read("input_tokens", 0) or read("prompt_tokens", 0)),
+        "output_tokens": _as_int(read("output_tokens", 0) or read("completion_tokens", 0)),
+        "cached_tokens": _as_int(read("cache_read_tokens", 0) or read("cached_tokens", 0)),
+        "reasoning_tokens": _as_int(read("reasoning_tokens", 0)),
+        "model": getattr(response, "model", None) or fallback_model,
+    }
+
+
+def vertex_usage(response: Any, model: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Tokens do usage_metadata de uma resposta do google-genai (None se a resposta não trouxer)"""
+    metadata = getattr(response, "usage_metadata", None)
+    if metadata is None:
+        return None
+    return {
+        "input_tokens": _as_int(getattr(metadata, "prompt_token_count", 0)),
+        "output_tokens": _as_int(getattr(metadata, "candidates_token_count", 0)),
+        "cached_tokens": _as_int(getattr(metadata, "cached_content_token_count", 0)),
+        "reasoning_tokens": _as_int(getattr(metadata, "thoughts_token_count", 0)),
+        "model": getattr(response, "model_version", None) or model,
+    }
+
+
+def model_name(runnable: Any) -> Optional[str]:
+    """ID do modelo configurado no agente/time (usado quando a resposta não informa)"""
+    model = getattr(runnable, "model", None)
+    return getattr(model, "id", None) or getattr(model, "model_id", None) or (model if isinstance(model, str) else None)
+
+
+def timed_run(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Tuple[Any, float]:
+    """func(*args) e o tempo da chamada em ms (medido na thread que executa, sem a espera na fila)"""
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, (time.perf_counter() - started) * 1000
+
+
+def _hour(timestamp: float) -> int:
+    return int(timestamp // 3600) * 3600
+
+
+class UsageAccountant:
+    """Agregados de uso por (hora, agente/time, conta)"""
+
+    def __init__(self, retention_hours: int = USAGE_RETENTION_HOURS, flush_seconds: float = USAGE_FLUSH_SECONDS,
+                 redis_getter=get_redis):
+        self.retention_hours = retention_hours
+        self.flush_seconds = flush_seconds
+        self._redis_getter = redis_getter
+        self._buckets: Dict[BucketKey, Counter] = {}
+        self._pending: Dict[BucketKey, Counter] = {}
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self._current_hour = 0
+        self._pid = None
+        self.stats = {"recorded": 0, "flushes": 0, "flush_errors": 0}
+
+    # ==================== REGISTRO ====================
+
+    def record(self, target: str, account_id: Optional[str], usage: Optional[Dict[str, Any]] = None,
+               total_ms: float = 0.0, queue_ms: float = 0.0, run_ms: float = 0.0,
+               cache_hit: bool = False, error: bool = False, timestamp: Optional[float] = None):
+        """
+        Soma uma execução ao bucket da hora
+
+        Args:
+            target: "agent:<id>" ou "team:<id>"
+            usage: Saída de run_usage/vertex_usage (tokens e modelo)
+            total_ms / queue_ms / run_ms: Latência total, espera por vaga e execução no provedor
+        """
+        usage = usage or {}
+        delta = Counter({
+            "runs": 1,
+            "errors": int(error),
+            "cache_hits": int(cache_hit),
+            "input_tokens": _as_int(usage.get("input_tokens")),
+            "output_tokens": _as_int(usage.get("output_tokens")),
+            "cached_tokens": _as_int(usage.get("cached_tokens")),
+            "reasoning_tokens": _as_int(usage.get("reasoning_tokens")),
+            "total_ms": int(round(total_ms)),
+            "queue_ms": int(round(queue_ms)),
+            "run_ms": int(round(run_ms)),
+        })
+        if usage.get("model") and not cache_hit:
+            delta[f"model:{usage['model']}"] = 1
+        key = (_hour(timestamp or time.time()), target, account_id or "")
+        shared = self._redis_getter() is not None
+        with self._lock:
+            if key[0] != self._current_hour:
+                self._current_hour = key[0]
+                self._prune()
+            self._buckets.setdefault(key, Counter()).update(delta)
+            if shared:
+                self._pending.setdefault(key, Counter()).update(delta)
+            self.stats["recorded"] += 1
+        if shared:
+            self._ensure_flusher()
+
+    # ==================== REDIS ====================
+
+    def _redis_key(self, key: BucketKey) -> str:
+        hour, target, account = key
+        return f"{USAGE_REDIS_PREFIX}:{hour}:{target}:{account}"
+
+    def _index_key(self, hour: int) -> str:
+        return f"{USAGE_REDIS_PREFIX}:index:{hour}"
+
+    def _ensure_flusher(self):
+        # Processos criados por fork não herdam a thread
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._flusher = threading.Thread(target=self._flush_loop, name="usage-flush", daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    def flush(self) -> int:
+        """Envia os contadores acumulados ao Redis (devolve quantos buckets foram enviados)"""
+        client = self._redis_getter()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if client is None or not pending:
+            return 0
+        ttl = self.retention_hours * 3600 + 3600
+        try:
+            pipe = client.pipeline(transaction=False)
+            for key, delta in pending.items():
+                redis_key = self._redis_key(key)
+                for field, value in delta.items():
+                    if value:
+                        pipe.hincrby(redis_key, field, value)
+                pipe.expire(redis_key, ttl)
+                pipe.sadd(self._index_key(key[0]), f"{key[1]}|{key[2]}")
+                pipe.expire(self._index_key(key[0]), ttl)
+            pipe.execute()
+            self.stats["flushes"] += 1
+            return len(pending)
+        except Exception as e:
+            logging.warning(f"Uso não enviado ao Redis (reenviado no próximo ciclo): {e}")
+            self.stats["flush_errors"] += 1
+            with self._lock:
+                for key, delta in pending.items():
+                    self._pending.setdefault(key, Counter()).update(delta)
+            return 0
+
+    def _prune(self):
+        oldest = _hour(time.time()) - self.retention_hours * 3600
+        for key in [key for key in self._buckets if key[0] < oldest]:
+            del self._buckets[key]
+
+    def _load(self, hours: List[int]) -> Dict[BucketKey, Counter]:
+        """Buckets das horas pedidas (Redis se disponível, senão os do processo)"""
+        client = self._redis_getter()
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                for hour in hours:
+                    pipe.smembers(self._index_key(hour))
+                keys = [(hour, *member.split("|", 1)) for hour, members in zip(hours, pipe.execute())
+                        for member in members]
+                pipe = client.pipeline(transaction=False)
+                for key in keys:
+                    pipe.hgetall(self._redis_key(key))
+                return {key: Counter({f: int(v) for f, v in values.items()})
+                        for key, values in zip(keys, pipe.execute())}
+            except Exception as e:
+                logging.warning(f"Uso lido só do processo local: {e}")
+        wanted = set(hours)
+        with self._lock:
+            return {key: Counter(counts) for key, counts in self._buckets.items() if key[0] in wanted}
+
+    # ==================== CONSULTA ====================
+
+    def query(self, hours: int = 24, target: Optional[str] = None, account_id: Optional[str] = None,
+              group_by: str = "target") -> List[Dict[str, Any]]:
+        """
+        Agregados das últimas `hours` horas
+
+        Args:
+            target: Filtra por agente/time ("agent:<id>", "team:<id>")
+            account_id: Filtra por conta
+            group_by: "target", "account", "hour" ou "target_hour"
+        """
+        now = _hour(time.time())
+        hour_list = [now - i * 3600 for i in range(max(min(hours, self.retention_hours), 1))]
+        groups: Dict[Tuple, Counter] = {}
+        for (hour, bucket_target, account), counts in self._load(hour_list).items():
+            if target is not None and bucket_target != target:
+                continue
+            if account_id is not None and account != account_id:
+                continue
+            group = {"target": (bucket_target,), "account": (account,), "hour": (hour,),
+                     "target_hour": (bucket_target, hour)}.get(group_by, (bucket_target,))
+            groups.setdefault(group, Counter()).update(counts)
+        rows = [self._row(group_by, group, counts) for group, counts in groups.items()]
+        if "hour" in group_by:
+            return sorted(rows, key=lambda row: row["hour"], reverse=True)
+        # Agentes/contas que mais consomem primeiro
+        return sorted(rows, key=lambda row: row["input_tokens"] + row["output_tokens"], reverse=True)
+
+    @staticmethod
+    def _row(group_by: str, group: Tuple, counts: Counter) -> Dict[str, Any]:
+        names = {"target": ("target",), "account": ("account_id",), "hour": ("hour",),
+                 "target_hour": ("target", "hour")}.get(group_by, ("target",))
+        row: Dict[str, Any] = dict(zip(names, group))
+        if "hour" in row:
+            row["hour"] = time.strftime("%Y-%m-%dT%H:00:00Z", time.gmtime(row["hour"]))
+        row.update({field: counts.get(field, 0) for field in USAGE_FIELDS})
+        executed = row["runs"] - row["cache_hits"]
+        row["cache_hit_rate"] = round(row["cache_hits"] / row["runs"], 3) if row["runs"] else 0.0
+        row["avg_total_ms"] = round(row["total_ms"] / row["runs"], 1) if row["runs"] else 0.0
+        row["avg_run_ms"] = round(row["run_ms"] / executed, 1) if executed > 0 else 0.0
+        row["avg_queue_ms"] = round(row["queue_ms"] / executed, 1) if executed > 0 else 0.0
+        row["models"] = {field[6:]: value for field, value in counts.items() if field.startswith("model:")}
+        return row
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["buckets"] = len(self._buckets)
+            stats["pending"] = len(self._pending)
+        stats["backend"] = "redis" if self._redis_getter() is not None else "memory"
+        return stats
+
+
+# Instância global
+usage_accountant = UsageAccountant()
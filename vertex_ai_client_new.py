@@ -8,6 +8,7 @@ import logging
 from typing import Dict, List, Any, Optional
 from google import genai
 from google.genai import types
+from usage_accounting import vertex_usage
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -149,17 +150,19 @@ class VertexAIClientNew:
                 # Tentar converter para string como fallback
                 response_text = str(response) if response else "Resposta vazia"
             
-            # Calcular usage (estimativa)
-            input_tokens = sum(len(str(content).split()) for content in contents)
-            output_tokens = len(response_text.split())
+            # Tokens informados pelo Vertex (usage_metadata); estimativa só se a resposta não trouxer
+            usage = vertex_usage(response, model_name)
+            if usage is None:
+                usage = {
+                    "input_tokens": sum(len(str(content).split()) for content in contents),
+                    "output_tokens": len(response_text.split()),
+                    "model": model_name,
+                    "estimated": True
+                }
             
             return {
                 "text": response_text,
-                "usage": {
-                    "input_tokens": input_tokens,
-                    "output_tokens": output_tokens,
-                    "model": model_name
-                }
+                "usage": usage
             }
             
         except Exception as e: